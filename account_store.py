@@ -0,0 +1,289 @@
+import abc
+import configparser
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from logger import setup_logger
+
+logger = setup_logger('account_store', 'logs/account_store.log')
+
+
+class AccountStore(abc.ABC):
+    """
+    ConfigManagerが使うアカウント情報とスケジュールの保存先の基底クラス
+
+    パスワードとスケジュールはConfigManagerが暗号化した文字列のまま保存する
+    """
+
+    @abc.abstractmethod
+    def load_accounts(self):
+        """
+        :return: ユーザー名から {'password': 暗号化されたパスワード, 'post_flag': bool} への辞書
+        """
+
+    @abc.abstractmethod
+    def write_accounts(self, upserts=(), deletes=(), replace=False):
+        """
+        アカウントの追加・更新・削除を1つのトランザクションで行う
+
+        :param upserts: (ユーザー名, パスワード, 投稿フラグ) のリスト。Noneの項目は既存の値を残す
+                        パスワードがNoneの場合は既存のアカウントだけを更新する
+        :param deletes: 削除するユーザー名のリスト
+        :param replace: Trueの場合、upsertsに含まれないアカウントを全て削除する
+        :return: 削除されたアカウントのユーザー名のリスト
+        """
+
+    @abc.abstractmethod
+    def stamp(self):
+        """変更検知用の値。アカウントかスケジュールが変更されると（他のプロセスによる変更でも）値が変わる"""
+
+    @abc.abstractmethod
+    def load_schedule(self):
+        """:return: 暗号化されたスケジュール。未設定の場合はNone"""
+
+    @abc.abstractmethod
+    def save_schedule(self, data):
+        """:param data: 暗号化されたスケジュール"""
+
+    @abc.abstractmethod
+    def get_meta(self, key):
+        """
+        移行済みかどうかなど、ストア自体の情報を取得する
+
+        :param key: 項目名
+        :return: 値の文字列。未設定の場合はNone
+        """
+
+    @abc.abstractmethod
+    def set_meta(self, key, value):
+        """
+        :param key: 項目名
+        :param value: 値の文字列
+        """
+
+
+class IniAccountStore(AccountStore):
+    """
+    従来のaccounts.ini（アカウント）とschedule.json（スケジュール）に保存するストア
+
+    get_meta/set_metaの値は、accounts_fileの拡張子を.meta.jsonに変えたファイルに保存する
+    """
+
+    def __init__(self, accounts_file, schedule_file):
+        self.accounts_file = accounts_file
+        self.schedule_file = schedule_file
+        self.meta_file = os.path.splitext(accounts_file)[0] + '.meta.json'
+        self._lock = threading.Lock()
+
+    def load_accounts(self):
+        config = self._read_config()
+        return {
+            section: {
+                'password': config[section]['password'],
+                'post_flag': config[section].get('postflag', 'true').lower() == 'true',
+            }
+            for section in config.sections()
+        }
+
+    def write_accounts(self, upserts=(), deletes=(), replace=False):
+        with self._lock:
+            config = self._read_config()
+            keep = {username for username, _, _ in upserts}
+            removed = [
+                username for username in config.sections()
+                if username in deletes or (replace and username not in keep)
+            ]
+            for username in removed:
+                config.remove_section(username)
+            for username, password, post_flag in upserts:
+                if username not in config:
+                    if password is None:
+                        continue
+                    config.add_section(username)
+                if password is not None:
+                    config[username]['password'] = password
+                if post_flag is not None or 'postflag' not in config[username]:
+                    config[username]['postflag'] = str(post_flag is not False).lower()
+            with open(self.accounts_file, 'w') as configfile:
+                config.write(configfile)
+        return removed
+
+    def stamp(self):
+        return _file_stamp(self.accounts_file) + _file_stamp(self.schedule_file)
+
+    def load_schedule(self):
+        if not os.path.exists(self.schedule_file):
+            return None
+        with open(self.schedule_file, 'rb') as file:
+            return file.read()
+
+    def save_schedule(self, data):
+        with open(self.schedule_file, 'wb') as file:
+            file.write(data)
+
+    def get_meta(self, key):
+        return self._read_meta().get(key)
+
+    def set_meta(self, key, value):
+        with self._lock:
+            meta = self._read_meta()
+            meta[key] = value
+            with open(self.meta_file, 'w') as file:
+                json.dump(meta, file, ensure_ascii=False)
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_file):
+            return {}
+        with open(self.meta_file) as file:
+            return json.load(file)
+
+    def _read_config(self):
+        config = configparser.ConfigParser()
+        config.read(self.accounts_file)
+        return config
+
+
+class SQLiteAccountStore(AccountStore):
+    """
+    SQLiteに保存するストア
+
+    WALモードで開き、読み込みはスレッドごとの接続で書き込みと並行して行う。書き込みは1つの接続で直列化する
+    """
+
+    def __init__(self, db_path='accounts.db'):
+        """
+        :param db_path: SQLiteファイルのパス
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS accounts (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL,
+                post_flag INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS schedule (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', '0');
+        ''')
+        logger.info(f"SQLiteAccountStoreが初期化されました: {db_path}")
+
+    def load_accounts(self):
+        rows = self._reader().execute('SELECT username, password, post_flag FROM accounts ORDER BY username')
+        return {username: {'password': password, 'post_flag': bool(post_flag)} for username, password, post_flag in rows}
+
+    def get_account(self, username):
+        """1件のアカウントをユーザー名で取得する。存在しない場合はNone"""
+        row = self._reader().execute(
+            'SELECT password, post_flag FROM accounts WHERE username = ?', (username,)
+        ).fetchone()
+        return {'password': row[0], 'post_flag': bool(row[1])} if row else None
+
+    def write_accounts(self, upserts=(), deletes=(), replace=False):
+        now = time.time()
+        keep = [username for username, _, _ in upserts]
+        with self._transaction() as conn:
+            if replace:
+                placeholders = ','.join('?' * len(keep))
+                removed = [
+                    username for username, in conn.execute(
+                        f'SELECT username FROM accounts WHERE username NOT IN ({placeholders})', keep
+                    )
+                ]
+            else:
+                removed = [
+                    username for username in dict.fromkeys(deletes)
+                    if conn.execute('SELECT 1 FROM accounts WHERE username = ?', (username,)).fetchone()
+                ]
+            conn.executemany('DELETE FROM accounts WHERE username = ?', [(username,) for username in removed])
+            conn.executemany('''
+                INSERT INTO accounts (username, password, post_flag, updated_at)
+                VALUES (?, ?, COALESCE(?, 1), ?)
+                ON CONFLICT (username) DO UPDATE SET
+                    password = excluded.password,
+                    post_flag = COALESCE(?, accounts.post_flag),
+                    updated_at = excluded.updated_at
+            ''', [
+                (username, password, _flag(post_flag), now, _flag(post_flag))
+                for username, password, post_flag in upserts if password is not None
+            ])
+            conn.executemany('''
+                UPDATE accounts SET post_flag = COALESCE(?, post_flag), updated_at = ? WHERE username = ?
+            ''', [
+                (_flag(post_flag), now, username)
+                for username, password, post_flag in upserts if password is None
+            ])
+        return removed
+
+    def stamp(self):
+        return self._reader().execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def load_schedule(self):
+        row = self._reader().execute('SELECT data FROM schedule WHERE id = 1').fetchone()
+        return bytes(row[0]) if row else None
+
+    def save_schedule(self, data):
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO schedule (id, data, updated_at) VALUES (1, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', (data, time.time()))
+
+    def get_meta(self, key):
+        row = self._reader().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _connect(self):
+        # トランザクションはBEGIN IMMEDIATEで明示的に開始する
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False, timeout=10)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みをBEGIN IMMEDIATEで開始し、成功すればリビジョンを進めてコミットする"""
+        with self._write_lock:
+            self._writer.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._writer
+                self._writer.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'revision'")
+                self._writer.execute('COMMIT')
+            except BaseException:
+                self._writer.execute('ROLLBACK')
+                raise
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _flag(post_flag):
+    return None if post_flag is None else int(bool(post_flag))
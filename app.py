@@ -1,9 +1,24 @@
-from flask import Flask, render_template, request, jsonify
-from instagram_uploader import InstagramUploader
+import configparser
+import json
+import os
+import threading
+from datetime import datetime
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, url_for
 from scheduler import Scheduler
+from post_history import PostHistory
+from post_schedule import Schedule, Timeline
+from scheduler_service import create_election
+from leader_election import LeaderLease
+from upload_pool import UploadPool
+from browser_pool import BrowserPool
+from browser_profile import BrowserProfile
+from browser_supervisor import BrowserSupervisor
+from video_preprocessor import VideoPreprocessor
+from job_manager import JobManager
 from config_manager import ConfigManager
+from lazy import lazy_instance
+import metrics
 from logger import setup_logger
-from datetime import datetime, timedelta
 
 app = Flask(__name__)
 
@@ -12,19 +27,75 @@ logger = setup_logger('app', 'logs/app.log')
 VIDEO_FOLDER = 'upload_videos'
 ACCOUNTS_FILE = 'accounts.ini'
 SCHEDULE_FILE = 'schedule.json'
+MAX_UPLOAD_WORKERS = 3
+# 1アカウント内でシェア処理の完了を待たずに次の動画を進める数（タブを並行して使う。1の場合は順番に投稿する）
+VIDEOS_IN_FLIGHT = 2
+# 画面の無いサーバーで動かすため、ブラウザはヘッドレスで起動する（Falseにすると画面付きで起動する）
+HEADLESS_BROWSER = True
+# ブラウザ全体のメモリ使用量の上限（MB）。超えている間は新しいブラウザを起動しない
+BROWSER_MEMORY_BUDGET_MB = 2048
+# 投稿する動画の長さの上限（秒）。これより長い動画は投稿せずに除外する
+MAX_VIDEO_DURATION_SECONDS = 90
 
-config_manager = ConfigManager(ACCOUNTS_FILE, SCHEDULE_FILE)
-scheduler = Scheduler(config_manager, VIDEO_FOLDER)
+# 各インスタンスは初めて使われる時に作成する（モジュールの読み込みだけではファイルの作成やブラウザ関連の読み込みを行わない）
+@lazy_instance
+def get_config_manager():
+    return ConfigManager(ACCOUNTS_FILE, SCHEDULE_FILE)
+
+@lazy_instance
+def get_post_history():
+    return PostHistory()
+
+@lazy_instance
+def get_browser_supervisor():
+    # WSGIサーバーのワーカーでは __main__ のブロックが実行されないため、最初に使われた時に監視を開始する
+    supervisor = BrowserSupervisor(memory_budget_mb=BROWSER_MEMORY_BUDGET_MB)
+    supervisor.start()
+    return supervisor
+
+@lazy_instance
+def get_browser_pool():
+    return BrowserPool(size=MAX_UPLOAD_WORKERS, profile=BrowserProfile(headless=HEADLESS_BROWSER),
+                       supervisor=get_browser_supervisor())
+
+@lazy_instance
+def get_upload_pool():
+    return UploadPool(get_config_manager(), VIDEO_FOLDER, max_workers=MAX_UPLOAD_WORKERS, browser_pool=get_browser_pool(),
+                      videos_in_flight=VIDEOS_IN_FLIGHT, history=get_post_history(),
+                      preprocessor=VideoPreprocessor(max_duration=MAX_VIDEO_DURATION_SECONDS))
+
+@lazy_instance
+def get_scheduler():
+    return Scheduler(get_config_manager(), VIDEO_FOLDER, upload_pool=get_upload_pool())
+
+@lazy_instance
+def get_scheduler_lease():
+    return LeaderLease('scheduler')
+
+@lazy_instance
+def get_scheduler_election():
+    # スケジューラーはリースを取得したプロセスでだけ動かす（複数のWebワーカーやscheduler_service.pyと同時に動かしても1つになる）
+    return create_election(get_scheduler(), get_scheduler_lease())
+
+@lazy_instance
+def get_job_manager():
+    return JobManager(get_upload_pool())
+
+def running_scheduler():
+    """このプロセスでスケジューラーが動いていれば返す（動いていない場合はNone。スケジューラーを作成しない）"""
+    if get_scheduler.is_created() and get_scheduler().running:
+        return get_scheduler()
+    return None
 
 @app.route('/')
 def index():
-    logger.info("メインページの表示リクエストを受信")
+    logger.debug("メインページの表示リクエストを受信")
+    config_manager = get_config_manager()
     accounts = config_manager.get_accounts()
     schedule_info = config_manager.load_schedule()
-    auto_post_status = scheduler.get_status()
-    next_post_times = scheduler.get_next_post_times()
+    auto_post_status, next_post_times = scheduler_status()
     
-    logger.debug(f"アカウント数: {len(accounts)}, 自動投稿状態: {auto_post_status}, 次回投稿時間: {next_post_times}")
+    logger.debug("アカウント数: %d, 自動投稿状態: %s, 次回投稿時間: %s", len(accounts), auto_post_status, next_post_times)
     
     return render_template('index.html', 
                            accounts=accounts, 
@@ -32,96 +103,237 @@ def index():
                            auto_post_status=auto_post_status, 
                            next_post_times=next_post_times)
 
+def scheduler_status():
+    """
+    スケジューラーの状態と次回の投稿時間を返す。スケジューラーが別のプロセスで動いている場合はリースの情報を使う
+    """
+    scheduler = running_scheduler()
+    if scheduler:
+        return scheduler.get_status(), scheduler.get_next_post_times()
+    holder = get_scheduler_lease().holder()
+    if holder is None:
+        return 'stopped', None
+    return 'running', (holder['info'] or {}).get('next_post_times')
+
+@app.route('/api/auto_post_status')
+def api_auto_post_status():
+    status, _ = scheduler_status()
+    return jsonify({'status': status})
+
+@app.route('/api/next_post_time')
+def api_next_post_time():
+    _, next_post_times = scheduler_status()
+    return jsonify({'next_post_times': next_post_times})
+
+@app.route('/api/schedule/timeline')
+def api_schedule_timeline():
+    """今後の投稿予定をアカウント枠ごとに返す（?limit=件数）"""
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    scheduler = running_scheduler()
+    if scheduler:
+        upcoming = scheduler.upcoming(limit)
+    else:
+        # スケジューラーが別のプロセスで動いている場合は、ランダムな待機時間を含まない予定を計算する
+        timeline = Timeline()
+        timeline.update(get_config_manager().load_schedule())
+        upcoming = timeline.upcoming(limit)
+    return jsonify([
+        {'post_time': occurrence['post_time'].strftime('%Y-%m-%d %H:%M'), 'account': occurrence['account'],
+         'entry': occurrence['entry'], 'caption': occurrence['caption']}
+        for occurrence in upcoming
+    ])
+
+def _parse_datetime_arg(name):
+    """クエリパラメータの日付（YYYY-MM-DD）または日時（YYYY-MM-DDTHH:MM）を読む。指定が無い場合はNone"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name}の形式が不正です（YYYY-MM-DD または YYYY-MM-DDTHH:MM）: {value}")
+
+@app.route('/api/history')
+def api_history():
+    """
+    投稿履歴を新しい順に返す。account, outcome, slot, video_hash, since, until で絞り込み、
+    limit件ごとにページを分ける（続きはレスポンスのnext_cursorをcursorに指定して取得する）
+    """
+    try:
+        since = _parse_datetime_arg('since')
+        until = _parse_datetime_arg('until')
+        page = get_post_history().query(
+            account=request.args.get('account'), outcome=request.args.get('outcome'),
+            slot=request.args.get('slot'), video_hash=request.args.get('video_hash'),
+            since=since.timestamp() if since else None, until=until.timestamp() if until else None,
+            limit=request.args.get('limit', 50, type=int), cursor=request.args.get('cursor', type=int)
+        )
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify(page)
+
+@app.route('/api/history/stats')
+def api_history_stats():
+    """
+    投稿履歴を日別・アカウント別・結果別に集計する（since, until は日付、accountで絞り込み）
+    unused=true を指定すると、動画フォルダ内で一度もシェアされていない動画も返す
+    """
+    try:
+        since = _parse_datetime_arg('since')
+        until = _parse_datetime_arg('until')
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    stats = get_post_history().stats(
+        since_day=since.strftime('%Y-%m-%d') if since else None,
+        until_day=until.strftime('%Y-%m-%d') if until else None,
+        account=request.args.get('account')
+    )
+    if request.args.get('unused', 'false').lower() == 'true':
+        stats['unused_videos'] = []
+        # 動画フォルダは最初の投稿時に作成されるため、まだ無い場合は未使用の動画も無い
+        if os.path.isdir(VIDEO_FOLDER):
+            video_catalog = get_config_manager().video_catalog
+            video_catalog.refresh(VIDEO_FOLDER)
+            stats['unused_videos'] = [
+                video['path'] for video in get_post_history().unused_videos(video_catalog.videos(VIDEO_FOLDER))
+            ]
+    return jsonify(stats)
+
 @app.route('/upload', methods=['POST'])
 def upload():
     logger.info("動画アップロードリクエストを受信")
     accounts = request.form.getlist('account')
     caption = request.form['caption']
-    
-    all_accounts = config_manager.get_accounts()
-    success_count = 0
-    error_messages = []
-
-    for account in accounts:
-        if account not in all_accounts:
-            error_message = f'アカウント {account} が見つかりません'
-            logger.error(error_message)
-            error_messages.append(error_message)
-            continue
-
-        if not all_accounts[account]['postFlag']:
-            logger.info(f"アカウント {account} は投稿フラグがFalseのためスキップします")
-            continue
-
-        video_paths = config_manager.get_random_videos(VIDEO_FOLDER, 3)
-        if len(video_paths) < 3:
-            error_message = f'アカウント {account} の投稿に失敗しました: 十分な数の動画ファイルが見つかりません'
-            logger.error(error_message)
-            error_messages.append(error_message)
-            continue
 
-        try:
-            uploader = InstagramUploader()
-            success = uploader.upload_to_instagram(video_paths, caption, account, all_accounts[account]['password'])
-            if success:
-                success_count += 1
-                logger.info(f"アカウント {account} への3つの動画アップロードが成功しました")
-            else:
-                error_message = f'アカウント {account} への投稿に失敗しました'
-                logger.error(error_message)
-                error_messages.append(error_message)
-        except Exception as e:
-            error_message = f"アカウント {account} でエラーが発生しました: {str(e)}"
-            logger.exception(error_message)
-            error_messages.append(error_message)
-
-    if success_count == len(accounts):
-        message = f'全ての選択されたアカウント ({success_count}個) に3つずつ動画をアップロードしました'
-        logger.info(message)
-        return jsonify({'message': message}), 200
-    elif success_count > 0:
-        message = f'{success_count}個のアカウントに3つずつ動画をアップロードしました。エラー: {"; ".join(error_messages)}'
-        logger.warning(message)
-        return jsonify({'message': message}), 207
-    else:
-        message = f'動画のアップロードに失敗しました。エラー: {"; ".join(error_messages)}'
-        logger.error(message)
-        return jsonify({'error': message}), 500
+    job = get_job_manager().submit(accounts, caption)
+    return jsonify({
+        'message': 'アップロードを受け付けました',
+        'job_id': job.id,
+        'status_url': url_for('api_job', job_id=job.id),
+        'events_url': url_for('api_job_events', job_id=job.id)
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = get_job_manager().get(job_id)
+    if not job:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    job = get_job_manager().get(job_id)
+    if not job:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+
+    def stream():
+        version = -1
+        while True:
+            state = job.to_dict()
+            if state['version'] != version:
+                version = state['version']
+                yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+            if state['status'] == 'finished':
+                break
+            if job.wait_for_change(version, timeout=15) == version:
+                # 接続維持のためのコメント行
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 # 他のルートやメソッドは変更なし
 # 既存のルートの後に以下を追加
 @app.route('/account_management')
 def account_management():
     logger.info("アカウント管理ページの表示リクエストを受信")
-    accounts = config_manager.get_accounts()
+    accounts = get_config_manager().get_accounts()
     return render_template('account_management.html', accounts=accounts)
 
 # アカウント関連のAPIエンドポイントも追加
 @app.route('/api/accounts', methods=['GET', 'POST'])
 def api_accounts():
     if request.method == 'GET':
-        accounts = config_manager.get_accounts()
+        accounts = get_config_manager().get_accounts()
         return jsonify([{"username": username, "postFlag": info['postFlag']} for username, info in accounts.items()])
     elif request.method == 'POST':
         data = request.json
-        config_manager.save_account(data['username'], data['password'], data['postFlag'])
-        return jsonify({"message": "アカウントが追加されました"})
+        # 配列の場合は複数のアカウントを1つのトランザクションで追加する
+        accounts = data if isinstance(data, list) else [data]
+        try:
+            result = get_config_manager().apply_account_changes(create=accounts)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        return jsonify({"message": "アカウントが追加されました", "saved": result['saved']})
 
 @app.route('/api/accounts/<username>', methods=['PUT', 'DELETE'])
 def api_account(username):
     if request.method == 'PUT':
-        data = request.json
-        config_manager.update_account(username, data)
+        data = request.get_json(silent=True)
+        try:
+            updated = get_config_manager().update_account(username, data)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        if not updated:
+            return jsonify({"error": "アカウントが見つかりません"}), 404
         return jsonify({"message": "アカウントが更新されました"})
     elif request.method == 'DELETE':
-        config_manager.delete_account(username)
+        if not get_config_manager().delete_account(username):
+            return jsonify({"error": "アカウントが見つかりません"}), 404
         return jsonify({"message": "アカウントが削除されました"})
-    
+
+@app.route('/api/accounts/bulk', methods=['POST'])
+def api_accounts_bulk():
+    """追加（create）・更新（update）・削除（delete）をまとめて1つのトランザクションで反映する"""
+    data = request.json or {}
+    try:
+        result = get_config_manager().apply_account_changes(
+            create=data.get('create', []), update=data.get('update', []), delete=data.get('delete', [])
+        )
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"message": "アカウントを一括で更新しました", **result})
+
+@app.route('/api/accounts/import', methods=['POST'])
+def api_accounts_import():
+    """
+    アカウントを取り込む。JSON {'accounts': [...], 'replace': bool} か、
+    accounts.ini形式のファイル（フォームのfile、パスワードは平文）を受け付ける
+    """
+    if 'file' in request.files:
+        config = configparser.ConfigParser()
+        try:
+            config.read_string(request.files['file'].read().decode('utf-8'))
+        except (configparser.Error, UnicodeDecodeError) as e:
+            return jsonify({"error": f"ファイルの形式が不正です: {str(e)}"}), 400
+        accounts = [
+            {'username': section, 'password': config[section].get('password'),
+             'postFlag': config[section].get('postflag', 'true')}
+            for section in config.sections()
+        ]
+        replace = request.form.get('replace', 'false').lower() == 'true'
+    else:
+        data = request.json or {}
+        accounts = data.get('accounts', [])
+        replace = bool(data.get('replace', False))
+    try:
+        result = get_config_manager().import_accounts(accounts, replace=replace)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"message": f"{len(result['saved'])}個のアカウントを取り込みました", **result})
+
 @app.route('/reencrypt_accounts', methods=['GET'])
 def reencrypt_accounts():
+    config_manager = get_config_manager()
     accounts = config_manager.get_accounts()
-    for username, account_info in accounts.items():
-        config_manager.save_account(username, account_info['password'], account_info['postFlag'])
+    config_manager.import_accounts([
+        {'username': username, 'password': account_info['password'], 'postFlag': account_info['postFlag']}
+        for username, account_info in accounts.items()
+    ])
     return "アカウント情報が再暗号化されました", 200
     
 @app.route('/set_schedule', methods=['POST'])
@@ -129,25 +341,20 @@ def set_schedule():
     data = request.json
     logger.info(f"受信したスケジュールデータ: {data}")  # 追加
     try:
-        if 'post_times' not in data or 'accounts' not in data or 'caption' not in data:
+        # entries（cron式とアカウントごとの設定）の形式と、従来のpost_times・accounts・captionの形式を受け付ける
+        if not isinstance(data, dict):
+            raise ValueError("スケジュールはオブジェクトで指定してください")
+        if 'entries' not in data and ('post_times' not in data or 'accounts' not in data or 'caption' not in data):
             raise ValueError("必要なデータが不足しています")
         
-        # 最大3つの投稿時間を受け付ける
-        post_times = data['post_times'][:3]
-        if not post_times:
-            raise ValueError("少なくとも1つの投稿時間を指定してください")
-        
-        post_times = [datetime.strptime(t, '%H:%M').time() for t in post_times]
-        
-        schedule_data = {
-            'post_times': post_times,
-            'accounts': data['accounts'],
-            'caption': data['caption']
-        }
+        schedule_data = Schedule.from_dict(data)
         
-        logger.info(f"保存するスケジュールデータ: {schedule_data}")  # 追加
-        config_manager.save_schedule(schedule_data)
-        scheduler.update_schedule()
+        logger.info(f"保存するスケジュールデータ: {schedule_data.to_dict()}")  # 追加
+        get_config_manager().save_schedule(schedule_data)
+        scheduler = running_scheduler()
+        if scheduler:
+            scheduler.update_schedule()
+        # 別のプロセスのスケジューラーは、リースの延長時にスケジュールの変更を検知して反映する
         return jsonify({"message": "スケジュールが設定されました"}), 200
     except ValueError as ve:
         logger.error(f"スケジュール設定中にバリデーションエラーが発生しました: {str(ve)}")
@@ -158,6 +365,8 @@ def set_schedule():
 
 if __name__ == '__main__':
     logger.info("アプリケーションを起動します")
-    scheduler.start()
-    app.run(debug=True, port=5001)
+    threading.Thread(target=get_browser_pool().warm, daemon=True).start()
+    get_scheduler_election().start()
+    # リローダーはこのブロックを親プロセスと子プロセスの両方で実行し、ブラウザとスケジューラーが二重に起動するため使わない
+    app.run(debug=True, port=5001, use_reloader=False)
     logger.info("アプリケーションを終了します")
\ No newline at end of file
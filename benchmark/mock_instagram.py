@@ -0,0 +1,217 @@
+import random
+import time
+import uuid
+from flask import Flask, jsonify, make_response, redirect, render_template_string, request
+
+# 模擬サーバーの既定の遅延（秒）。page: ページ表示, ui: 画面遷移, upload: 動画の受信, share: 投稿処理
+DEFAULT_LATENCIES = {
+    'page': 0.2,
+    'ui': 0.1,
+    'upload': 0.5,
+    'upload_per_mb': 0.05,
+    'share': 2.0,
+}
+
+# 失敗を発生させる確率。later_dialog は「後で」ダイアログを表示する確率
+DEFAULT_FAILURE_RATES = {
+    'login': 0.0,
+    'upload': 0.0,
+    'share': 0.0,
+    'later_dialog': 0.3,
+}
+
+LOGIN_PAGE = '''<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="UTF-8"><title>ログイン</title></head>
+<body>
+    {% if error %}<p id="error">{{ error }}</p>{% endif %}
+    <form method="post" action="/accounts/login/">
+        <input name="username" type="text">
+        <input name="password" type="password">
+        <button type="submit">ログイン</button>
+    </form>
+</body>
+</html>'''
+
+# InstagramUploaderが依存するDOM（セレクタ・テキスト）を再現した画面
+HOME_PAGE = '''<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<title>Instagram (mock)</title>
+<style>
+    svg { display: inline-block; }
+    [data-action] { cursor: pointer; padding: 4px; }
+    [role="dialog"] { border: 1px solid #ccc; margin: 8px; padding: 8px; }
+</style>
+</head>
+<body>
+<nav>
+    <div class="nav-item" data-action="new-post"><svg aria-label="新規投稿" width="24" height="24"><rect width="24" height="24"></rect></svg></div>
+</nav>
+<div id="app"></div>
+<script>
+const CONFIG = {{ config|tojson }};
+const app = document.getElementById('app');
+
+function later(fn) {
+    setTimeout(fn, CONFIG.latencies.ui * 1000);
+}
+
+function show(html) {
+    app.innerHTML = html;
+}
+
+const cropClass = 'x9f619 xjbqb8w x78zum5 x168nmei x13lgxp2 x5pf9jr xo71vjh x1y1aw1k x1sxyh0 xwib8y2 xurb0ha x1n2onr6 x1plvlek xryxfnj x1c4vz4f x2lah0s x1q0g3np xqjyukv x6s0dn4 x1oa3qoh xl56j7k';
+const verticalCropClass = 'x9f619 xjbqb8w x78zum5 x168nmei x13lgxp2 x5pf9jr xo71vjh xz9dl7a xn6708d xsag5q8 x1ye3gou x1n2onr6 x1plvlek xryxfnj x1c4vz4f x2lah0s xdt5ytf xqjyukv x1qjc9v5 x1oa3qoh x1nhvcw1';
+
+const actions = {
+    'later': function() {
+        later(() => show(''));
+    },
+    'close': function() {
+        show('');
+    },
+    'new-post': function() {
+        later(() => show('<div class="x9f619 xjbqb8w" data-action="post-menu"><span>投稿</span></div>'));
+    },
+    'post-menu': function() {
+        later(() => {
+            show('<div role="dialog"><form enctype="multipart/form-data"><input type="file" class="_ac69" accept="video/*"></form></div>');
+            app.querySelector('input[type="file"]').addEventListener('change', uploadFile);
+        });
+    },
+    'ack': function() {
+        later(() => show(
+            '<div role="dialog">' +
+            '<div class="' + cropClass + '" data-action="crop"><svg aria-label="切り取りを選択" width="16" height="16"><rect width="16" height="16"></rect></svg></div>' +
+            '</div>'
+        ));
+    },
+    'crop': function() {
+        later(() => show(
+            '<div role="dialog">' +
+            '<div class="' + verticalCropClass + '" data-action="vertical-crop"><svg aria-label="縦型トリミングアイコン" width="16" height="16"><rect width="16" height="16"></rect></svg></div>' +
+            '</div>'
+        ));
+    },
+    'vertical-crop': function() {
+        later(() => show('<div role="dialog"><div role="button" data-action="next-edit">次へ</div></div>'));
+    },
+    'next-edit': function() {
+        later(() => show('<div role="dialog"><p>編集</p><div role="button" data-action="next-caption">次へ</div></div>'));
+    },
+    'next-caption': function() {
+        later(() => show(
+            '<div role="dialog">' +
+            '<div aria-label="キャプションを入力…" contenteditable="true" role="textbox" style="min-height: 40px;"></div>' +
+            '<div role="button" data-action="share">シェア</div>' +
+            '</div>'
+        ));
+    },
+    'share': function() {
+        const caption = app.querySelector('div[contenteditable="true"]').innerText;
+        show('<div role="dialog"><p>シェア中</p></div>');
+        fetch('/api/v1/media/configure_to_clips/', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({caption: caption})
+        })
+        .then(response => {
+            if (!response.ok) throw new Error('share failed');
+            show(
+                '<div role="dialog">' +
+                '<div data-action="close"><svg aria-label="閉じる" width="16" height="16"><rect width="16" height="16"></rect></svg></div>' +
+                '<div>リール動画がシェアされました</div>' +
+                '</div>'
+            );
+        })
+        .catch(() => show('<div role="dialog"><p>投稿できませんでした</p></div>'));
+    }
+};
+
+function uploadFile(event) {
+    const file = event.target.files[0];
+    fetch('/rupload_igvideo/' + Date.now(), {method: 'POST', body: file, headers: {'X-Entity-Length': String(file.size)}})
+    .then(response => {
+        if (!response.ok) throw new Error('upload failed');
+        show('<div role="dialog"><button class="_acan _acap _acaq _acas _acav _aj1-" type="button" data-action="ack">OK</button></div>');
+    })
+    .catch(() => show('<div role="dialog"><p>アップロードできませんでした</p></div>'));
+}
+
+document.addEventListener('click', function(event) {
+    const target = event.target.closest('[data-action]');
+    if (target && actions[target.dataset.action]) {
+        actions[target.dataset.action](target);
+    }
+});
+
+if (Math.random() < CONFIG.failure_rates.later_dialog) {
+    later(() => show('<div role="dialog"><button class="_a9-- ap36 a9_1" data-action="later">後で</button></div>'));
+}
+</script>
+</body>
+</html>'''
+
+
+def create_app(latencies=None, failure_rates=None):
+    """
+    InstagramUploaderのDOM契約を再現した模擬Webアプリを作成する
+
+    :param latencies: DEFAULT_LATENCIESを上書きする遅延の設定
+    :param failure_rates: DEFAULT_FAILURE_RATESを上書きする失敗率の設定
+    :return: Flaskアプリ
+    """
+    app = Flask(__name__)
+    config = {
+        'latencies': dict(DEFAULT_LATENCIES, **(latencies or {})),
+        'failure_rates': dict(DEFAULT_FAILURE_RATES, **(failure_rates or {})),
+    }
+    app.config['MOCK'] = config
+    app.config['STATS'] = {'uploaded_bytes': 0, 'uploads': 0, 'shares': 0, 'logins': 0}
+
+    def sleep(key, extra=0.0):
+        time.sleep(config['latencies'][key] + extra)
+
+    def fails(key):
+        return random.random() < config['failure_rates'][key]
+
+    @app.route('/')
+    def home():
+        sleep('page')
+        if not request.cookies.get('sessionid'):
+            return redirect('/accounts/login/')
+        return render_template_string(HOME_PAGE, config=config)
+
+    @app.route('/accounts/login/', methods=['GET', 'POST'])
+    def login():
+        sleep('page')
+        if request.method == 'GET':
+            return render_template_string(LOGIN_PAGE, error=None)
+        if fails('login') or not request.form.get('username') or not request.form.get('password'):
+            return render_template_string(LOGIN_PAGE, error='ログインできませんでした')
+        app.config['STATS']['logins'] += 1
+        response = make_response(redirect('/'))
+        response.set_cookie('sessionid', uuid.uuid4().hex, max_age=3600 * 24 * 30)
+        return response
+
+    @app.route('/rupload_igvideo/<name>', methods=['POST'])
+    def upload(name):
+        size = len(request.get_data())
+        sleep('upload', config['latencies']['upload_per_mb'] * size / (1024 * 1024))
+        if fails('upload'):
+            return jsonify({'status': 'fail'}), 500
+        app.config['STATS']['uploads'] += 1
+        app.config['STATS']['uploaded_bytes'] += size
+        return jsonify({'status': 'ok', 'bytes': size})
+
+    @app.route('/api/v1/media/configure_to_clips/', methods=['POST'])
+    def configure():
+        sleep('share')
+        if fails('share') or not request.json.get('caption'):
+            return jsonify({'status': 'fail'}), 500
+        app.config['STATS']['shares'] += 1
+        return jsonify({'status': 'ok'})
+
+    return app
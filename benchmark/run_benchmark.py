@@ -0,0 +1,239 @@
+"""
+模擬Instagramサーバーに対してアップロード処理を実行し、所要時間とスループットを計測するベンチマーク
+
+使い方:
+    python -m benchmark.run_benchmark --accounts 6 --workers 3 --output result.json
+    python -m benchmark.run_benchmark --baseline result.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class RssSampler:
+    """このプロセスと子プロセス（Chrome、ChromeDriver）の合計RSSの最大値を定期的に記録する"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if psutil is None:
+            # psutilが無い場合は終了済みの子プロセスも含めた最大RSSで代用する
+            import resource
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.peak_bytes = usage * 1024
+        return self.peak_bytes
+
+    def _run(self):
+        if psutil is None:
+            return
+        process = psutil.Process()
+        while not self._stop.wait(self.interval):
+            total = 0
+            for proc in [process, *process.children(recursive=True)]:
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.peak_bytes = max(self.peak_bytes, total)
+
+
+def start_mock_server(latencies, failure_rates):
+    """
+    模擬サーバーを別スレッドで起動する
+
+    :return: (ベースURL, サーバー)
+    """
+    from werkzeug.serving import make_server
+    from benchmark.mock_instagram import create_app
+
+    server = make_server('127.0.0.1', 0, create_app(latencies, failure_rates), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def create_dummy_videos(folder, count, size_mb):
+    """アップロード用のダミー動画ファイルを作成する（模擬サーバーは中身を検証しない）"""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'bench_{i:03d}.mp4')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(int(size_mb * 1024 * 1024)))
+        paths.append(path)
+    return paths
+
+
+def histogram_stats(histogram):
+    """ヒストグラムのスナップショットをラベルの値ごとの件数・合計・平均に変換する"""
+    stats = {}
+    for key, value in histogram.snapshot().items():
+        name = ','.join(f'{label}={label_value}' for label, label_value in key) or 'all'
+        stats[name] = dict(value, mean=value['sum'] / value['count'] if value['count'] else 0.0)
+    return stats
+
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    # 作業ディレクトリに移動してから読み込み、ログやセッションを作業ディレクトリに作成させる
+    from browser_pool import BrowserPool
+    from browser_profile import BrowserProfile
+    from instagram_uploader import (
+        InstagramUploader, LOGIN_SECONDS, SHARE_SERVER_SECONDS, UPLOAD_STEP_SECONDS, VIDEO_UPLOAD_SECONDS
+    )
+    from wait_policy import WaitPolicy
+
+    latencies = {'upload': args.upload_latency, 'share': args.share_latency}
+    failure_rates = {'upload': args.upload_failure_rate, 'share': args.share_failure_rate}
+    base_url, server = start_mock_server(latencies, failure_rates)
+    videos = create_dummy_videos('videos', args.videos, args.video_size_mb)
+    floors = {'between_videos': 0} if args.no_pacing else None
+
+    if args.full_profile:
+        profile = BrowserProfile.default()
+        profile.headless = not args.headful
+    else:
+        profile = BrowserProfile(headless=not args.headful)
+    profile.arguments.append('--no-sandbox')
+    pool = BrowserPool(size=args.workers, profile=profile)
+    sampler = RssSampler()
+    sampler.start()
+
+    def upload(index):
+        account = f'bench_user_{index:03d}'
+        started = time.monotonic()
+        with pool.lease() as driver:
+            uploader = InstagramUploader(driver=driver, wait_policy=WaitPolicy(floors=floors), base_url=base_url,
+                                         max_in_flight=args.in_flight, profile=profile)
+            result = uploader.upload_to_instagram(videos, args.caption, account, 'password')
+        shared = sum(1 for video in result['videos'] if video['status'] == 'shared')
+        return {'account': account, 'seconds': time.monotonic() - started, 'shared': shared, 'error': result['error']}
+
+    started = time.monotonic()
+    try:
+        if args.warm:
+            pool.warm()
+            started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            accounts = list(executor.map(upload, range(args.accounts)))
+        elapsed = time.monotonic() - started
+    finally:
+        peak_rss = sampler.stop()
+        pool.close()
+        server.shutdown()
+
+    shared = sum(account['shared'] for account in accounts)
+    return {
+        'config': {
+            'accounts': args.accounts,
+            'videos_per_account': args.videos,
+            'workers': args.workers,
+            'in_flight': args.in_flight,
+            'video_size_mb': args.video_size_mb,
+            'pacing': not args.no_pacing,
+            'warm': args.warm,
+            'profile': 'full' if args.full_profile else 'lean',
+            'latencies': latencies,
+            'failure_rates': failure_rates,
+        },
+        'elapsed_seconds': elapsed,
+        'reels_shared': shared,
+        'reels_per_hour': shared * 3600 / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss / (1024 * 1024),
+        'steps': histogram_stats(UPLOAD_STEP_SECONDS),
+        'videos': histogram_stats(VIDEO_UPLOAD_SECONDS),
+        'login': histogram_stats(LOGIN_SECONDS),
+        'share_server': histogram_stats(SHARE_SERVER_SECONDS),
+        'accounts': accounts,
+    }
+
+
+def print_report(result, baseline=None):
+    def delta(current, previous):
+        if previous in (None, 0):
+            return ''
+        return f' ({(current - previous) / previous * 100:+.1f}%)'
+
+    base = baseline or {}
+    print(f"経過時間: {result['elapsed_seconds']:.1f}秒{delta(result['elapsed_seconds'], base.get('elapsed_seconds'))}")
+    print(f"シェアした動画: {result['reels_shared']}件")
+    print(f"スループット: {result['reels_per_hour']:.1f}件/時{delta(result['reels_per_hour'], base.get('reels_per_hour'))}")
+    print(f"最大RSS: {result['peak_rss_mb']:.0f}MB{delta(result['peak_rss_mb'], base.get('peak_rss_mb'))}")
+    for section in ('login', 'videos', 'share_server', 'steps'):
+        print(f"\n[{section}]")
+        previous = base.get(section, {})
+        for name, stats in sorted(result[section].items()):
+            before = previous.get(name, {}).get('mean')
+            print(f"  {name:<32} 件数={stats['count']:>4}  平均={stats['mean']:.3f}秒{delta(stats['mean'], before)}")
+    print('\n[accounts]')
+    for account in result['accounts']:
+        status = account['error'] or 'OK'
+        print(f"  {account['account']}: {account['seconds']:.1f}秒, シェア{account['shared']}件, {status}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='模擬Instagramサーバーに対するアップロードのベンチマーク')
+    parser.add_argument('--accounts', type=int, default=3, help='投稿するアカウント数')
+    parser.add_argument('--videos', type=int, default=3, help='アカウントごとの動画数')
+    parser.add_argument('--workers', type=int, default=3, help='同時に動かすブラウザ数')
+    parser.add_argument('--in-flight', type=int, default=1, help='アカウント内で並行して進める動画数（2以上でタブを使った並行処理）')
+    parser.add_argument('--video-size-mb', type=float, default=5, help='ダミー動画のサイズ（MB）')
+    parser.add_argument('--caption', default='benchmark #reel', help='投稿のキャプション')
+    parser.add_argument('--upload-latency', type=float, default=0.5, help='模擬サーバーの動画受信の遅延（秒）')
+    parser.add_argument('--share-latency', type=float, default=2.0, help='模擬サーバーの投稿処理の遅延（秒）')
+    parser.add_argument('--upload-failure-rate', type=float, default=0.0, help='動画受信の失敗率')
+    parser.add_argument('--share-failure-rate', type=float, default=0.0, help='投稿処理の失敗率')
+    parser.add_argument('--no-pacing', action='store_true', help='動画間の待機を行わない')
+    parser.add_argument('--warm', action='store_true', help='計測前にブラウザを起動しておく')
+    parser.add_argument('--full-profile', action='store_true', help='リソースを遮断しない従来の設定でブラウザを起動する')
+    parser.add_argument('--headful', action='store_true', help='ブラウザを画面付きで起動する')
+    parser.add_argument('--workdir', default=None, help='ログ・セッション・ダミー動画を置く作業ディレクトリ')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    parser.add_argument('--baseline', help='比較対象とする以前の結果のJSONファイル')
+    args = parser.parse_args(argv)
+    # 作業ディレクトリに移動するため、ファイルのパスは先に絶対パスにしておく
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='insta_bench_'))
+    args.output = args.output and os.path.abspath(args.output)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    result = run(args)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
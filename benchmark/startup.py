@@ -0,0 +1,175 @@
+"""
+Webサーバー（app）とスケジューラー（scheduler_service）のモジュールを新しいプロセスで読み込み、起動時間を計測するベンチマーク
+
+`python -X importtime` の出力から、読み込みに時間のかかったモジュールと、
+読み込みだけで作成されたファイル・読み込まれた重いライブラリ（selenium、cryptographyなど）を報告する
+
+使い方:
+    python -m benchmark.startup --runs 5 --output startup.json
+    python -m benchmark.startup --baseline startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測するエントリーポイント（名前 -> 読み込むモジュール）
+TARGETS = {
+    'web': 'app',
+    'scheduler': 'scheduler_service',
+}
+# 起動時に読み込まれていないことを確認するライブラリ
+HEAVY_MODULES = ('selenium', 'webdriver_manager', 'cryptography', 'psutil')
+
+_PROBE = '''
+import json, sys, threading
+import {module}
+print(json.dumps({{
+    'heavy': sorted(name for name in {heavy!r} if name in sys.modules),
+    'threads': threading.active_count(),
+}}))
+'''
+
+
+def parse_importtime(stderr):
+    """
+    `-X importtime` の出力を解析する
+
+    :return: {モジュール名: 読み込みにかかった累積時間（マイクロ秒）}
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(cumulative)
+        except ValueError:
+            continue
+    return modules
+
+
+def list_files(folder):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), folder)
+        for root, dirs, files in os.walk(folder) for name in files
+    )
+
+
+def measure(module, workdir):
+    """
+    新しいPythonプロセスでmoduleを1回読み込む
+
+    :param workdir: プロセスの作業ディレクトリ（空のディレクトリを渡す）
+    :return: {'seconds', 'modules', 'heavy', 'threads', 'files', 'error'}
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    seconds = time.perf_counter() - started
+
+    probe = {}
+    error = None
+    if completed.returncode == 0:
+        probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    else:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'exit {completed.returncode}'
+    return {
+        'seconds': seconds,
+        'modules': parse_importtime(completed.stderr),
+        'heavy': probe.get('heavy', []),
+        'threads': probe.get('threads'),
+        'files': list_files(workdir),
+        'error': error,
+    }
+
+
+def run(args):
+    result = {}
+    for name, module in TARGETS.items():
+        samples = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory(prefix='insta_startup_') as workdir:
+                samples.append(measure(module, workdir))
+        # モジュールごとの時間は、.pycの作成などの影響を受けない最後の1回のものを使う
+        last = samples[-1]
+        import_us = last['modules'].get(module)
+        top = sorted(last['modules'].items(), key=lambda item: item[1], reverse=True)
+        result[name] = {
+            'module': module,
+            # 最初の1回はディスクキャッシュや.pycの作成の影響を受けるため、中央値で比較する
+            'median_seconds': statistics.median(sample['seconds'] for sample in samples),
+            'min_seconds': min(sample['seconds'] for sample in samples),
+            'import_seconds': import_us / 1e6 if import_us is not None else None,
+            'top_modules': [
+                {'module': mod, 'cumulative_seconds': us / 1e6}
+                for mod, us in top if mod != module
+            ][:args.top],
+            'heavy_modules': last['heavy'],
+            'threads': last['threads'],
+            'files_created': last['files'],
+            'error': last['error'],
+        }
+    return result
+
+
+def print_report(result, baseline=None):
+    def delta(current, previous):
+        if current is None or previous in (None, 0):
+            return ''
+        return f' ({(current - previous) / previous * 100:+.1f}%)'
+
+    base = baseline or {}
+    for name, target in result.items():
+        previous = base.get(name, {})
+        print(f"[{name}] import {target['module']}")
+        if target['error']:
+            print(f"  エラー: {target['error']}")
+        print(f"  プロセス起動から読み込み完了まで: 中央値={target['median_seconds']:.3f}秒"
+              f"{delta(target['median_seconds'], previous.get('median_seconds'))}  最小={target['min_seconds']:.3f}秒")
+        if target['import_seconds'] is not None:
+            print(f"  モジュールの読み込み: {target['import_seconds']:.3f}秒"
+                  f"{delta(target['import_seconds'], previous.get('import_seconds'))}")
+        print(f"  読み込まれた重いライブラリ: {', '.join(target['heavy_modules']) or 'なし'}")
+        print(f"  スレッド数: {target['threads']}")
+        print(f"  作成されたファイル: {', '.join(target['files_created']) or 'なし'}")
+        for module in target['top_modules']:
+            print(f"    {module['module']:<40} {module['cumulative_seconds'] * 1000:8.1f}ms")
+        print()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Webサーバーとスケジューラーの起動時間のベンチマーク')
+    parser.add_argument('--runs', type=int, default=5, help='エントリーポイントごとの計測回数')
+    parser.add_argument('--top', type=int, default=15, help='表示する読み込みに時間のかかったモジュールの数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    parser.add_argument('--baseline', help='比較対象とする以前の結果のJSONファイル')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    result = run(args)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
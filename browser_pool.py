@@ -0,0 +1,239 @@
+import queue
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from browser_profile import BrowserProfile
+from logger import setup_logger
+import metrics
+
+logger = setup_logger('browser_pool', 'logs/browser_pool.log')
+
+INSTAGRAM_ORIGIN = 'https://www.instagram.com'
+
+BROWSER_LAUNCH_SECONDS = metrics.histogram('browser_launch_seconds', 'ブラウザの起動にかかった時間（秒）')
+BROWSER_LEASES = metrics.counter('browser_leases_total', 'ブラウザの貸し出し回数（warm: 起動済みを再利用, cold: 新規起動）')
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path():
+    """ChromeDriverのパスを解決する（プロセス内で一度だけ解決しキャッシュする）"""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            _driver_path = ChromeDriverManager().install()
+            logger.info(f"ChromeDriverのパスを解決しました: {_driver_path}")
+        return _driver_path
+
+
+def create_driver(profile=None):
+    """
+    新しいChromeDriverを起動する
+
+    :param profile: 起動設定のBrowserProfile。省略時はヘッドレスでリソースを遮断する既定の設定
+    """
+    # seleniumはブラウザを起動する時に初めて読み込む（Webサーバーの起動を遅くしないため）
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    profile = profile or BrowserProfile()
+    driver = webdriver.Chrome(service=Service(get_driver_path()), options=profile.options())
+    profile.apply(driver)
+    driver.delete_all_cookies()
+    return driver
+
+
+class BrowserPool:
+    """起動済みのChromeDriverを貸し出し、アカウント間で再利用するプール"""
+
+    def __init__(self, size=3, max_uses=20, profile=None, supervisor=None):
+        """
+        :param size: プールが保持するブラウザの最大数
+        :param max_uses: 1つのブラウザを再起動するまでに貸し出す回数
+        :param profile: ブラウザの起動設定のBrowserProfile。省略時は既定の設定
+        :param supervisor: メモリの予算と期限を監視するBrowserSupervisor。省略時は監視しない
+        """
+        self.size = size
+        self.max_uses = max_uses
+        self.profile = profile or BrowserProfile()
+        self.supervisor = supervisor
+        self._idle = queue.LifoQueue()
+        self._uses = {}
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        logger.info(f"BrowserPoolが初期化されました: size={size}, max_uses={max_uses}, headless={self.profile.headless}")
+
+    def warm(self):
+        """
+        プールの上限までブラウザを事前に起動する
+
+        貸し出しと同じ枠を取ってから起動するため、同時に貸し出しが行われてもブラウザの数はsizeを超えない
+        """
+        while not self._closed:
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                with self._lock:
+                    if len(self._uses) >= self.size:
+                        break
+                if self.supervisor is not None and not self.supervisor.has_room():
+                    logger.warning("ブラウザのメモリ使用量が予算に達したため、事前起動を打ち切ります")
+                    break
+                try:
+                    self._idle.put(self._launch())
+                except Exception as e:
+                    logger.error(f"ブラウザの事前起動中にエラーが発生しました: {str(e)}")
+                    break
+            finally:
+                self._slots.release()
+        logger.info(f"ブラウザを事前起動しました: {self._idle.qsize()}個が待機中")
+
+    @contextmanager
+    def lease(self, account=None):
+        """
+        ブラウザを1つ貸し出すコンテキストマネージャー
+
+        :param account: 使用するアカウント。監視役がある場合、貸し出し中の時間にアカウントの期限を適用する
+        """
+        driver = self.acquire()
+        healthy = True
+        try:
+            if self.supervisor is None:
+                yield driver
+            else:
+                with self.supervisor.session(driver, account):
+                    yield driver
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release(driver, healthy=healthy)
+
+    def acquire(self):
+        """待機中のブラウザを取得する。無ければ新しく起動する"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    # メモリの予算を超えている場合は、他のブラウザの返却か使用量の低下を待つ
+                    if self.supervisor is None or self.supervisor.has_room():
+                        BROWSER_LEASES.inc(mode='cold')
+                        return self._launch()
+                    driver = self.supervisor.wait_for_room(self._idle)
+                    if driver is None:
+                        continue
+                if self._is_healthy(driver):
+                    BROWSER_LEASES.inc(mode='warm')
+                    return driver
+                self._discard(driver)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, driver, healthy=True):
+        """
+        ブラウザをプールに返却する。使用回数の上限に達したか異常がある場合は終了する
+
+        :param driver: 返却するChromeDriver
+        :param healthy: 呼び出し側で異常を検知していない場合はTrue
+        """
+        try:
+            with self._lock:
+                self._uses[driver] = self._uses.get(driver, 0) + 1
+                uses = self._uses[driver]
+            if self._closed or not healthy or uses >= self.max_uses or not self._reset(driver):
+                logger.info(f"ブラウザを終了します (使用回数: {uses})")
+                self._discard(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """待機中の全てのブラウザを終了する"""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+        logger.info("BrowserPoolを終了しました")
+
+    def _launch(self):
+        with BROWSER_LAUNCH_SECONDS.time():
+            driver = create_driver(self.profile)
+        with self._lock:
+            self._uses[driver] = 0
+        if self.supervisor is not None:
+            self.supervisor.register(driver)
+        logger.info("新しいブラウザを起動しました")
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._uses.pop(driver, None)
+        if self.supervisor is not None:
+            self.supervisor.unregister(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"ブラウザの終了中にエラーが発生しました: {str(e)}")
+
+    def _is_healthy(self, driver):
+        try:
+            driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        """
+        Cookie・ストレージ・余分なタブを消去し、次のアカウントで使える状態に戻す
+
+        ストレージは、Instagramに加えて各タブで開いたページとCookieのあるドメインの全てのオリジンについて消去する
+        """
+        try:
+            handles = driver.window_handles
+            origins = self._visited_origins(driver, handles)
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            for origin in sorted(origins):
+                driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                    'origin': origin,
+                    'storageTypes': 'all'
+                })
+            driver.get('about:blank')
+            return True
+        except Exception as e:
+            logger.warning(f"ブラウザのリセットに失敗しました: {str(e)}")
+            return False
+
+    def _visited_origins(self, driver, handles):
+        """:return: 各タブの履歴とCookieから集めた、ストレージを消去するオリジンの集合"""
+        origins = {INSTAGRAM_ORIGIN}
+        for handle in handles:
+            driver.switch_to.window(handle)
+            history = driver.execute_cdp_cmd('Page.getNavigationHistory', {})
+            origins.update(_origin(entry['url']) for entry in history['entries'])
+        for cookie in driver.execute_cdp_cmd('Storage.getCookies', {})['cookies']:
+            domain = cookie['domain'].lstrip('.')
+            origins.update({f'https://{domain}', f'http://{domain}'})
+        origins.discard(None)
+        return origins
+
+
+def _origin(url):
+    """:return: URLのオリジン（http/https以外はNone）"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    return f'{parts.scheme}://{parts.netloc}'
@@ -0,0 +1,128 @@
+import os
+from logger import setup_logger
+
+logger = setup_logger('browser_profile', 'logs/browser_profile.log')
+
+# 投稿に不要なリソースのURLパターン（CDPのNetwork.setBlockedURLsの形式。*は任意の文字列）
+BLOCKED_URL_PATTERNS = {
+    # フィードの画像・動画（投稿画面のプレビューはローカルのblob:なので影響しない）
+    'media': [
+        '*://scontent*.cdninstagram.com/*',
+        '*://*.fbcdn.net/v/*',
+    ],
+    'fonts': [
+        '*.woff*',
+        '*.ttf*',
+        '*.otf*',
+    ],
+    'analytics': [
+        '*://graph.instagram.com/logging*',
+        '*/logging_client_events*',
+        '*/ajax/bz*',
+        '*://www.facebook.com/tr*',
+        '*://connect.facebook.net/*',
+        '*://*.google-analytics.com/*',
+        '*://*.googletagmanager.com/*',
+        '*://*.doubleclick.net/*',
+    ],
+}
+
+# バックグラウンド通信や拡張機能など、自動投稿に不要なChromeの機能を止める起動引数
+LEAN_ARGUMENTS = [
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-features=Translate,MediaRouter,OptimizationHints',
+    '--metrics-recording-only',
+    '--no-first-run',
+    '--mute-audio',
+    '--autoplay-policy=user-gesture-required',
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+]
+
+# 共有ディスクキャッシュの既定の場所と上限（バイト）
+DEFAULT_CACHE_DIR = 'browser_cache'
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class BrowserProfile:
+    """ChromeDriverの起動設定（ヘッドレス、画面サイズ、リソースの遮断、キャッシュ）"""
+
+    def __init__(self, headless=True, window_size=(1024, 768), block=('media', 'fonts', 'analytics'),
+                 extra_blocked_urls=None, block_images=True, cache_dir=DEFAULT_CACHE_DIR,
+                 cache_size=DEFAULT_CACHE_SIZE, lean=True, network_events=True, arguments=None):
+        """
+        :param headless: Trueの場合は画面なしで起動する
+        :param window_size: ウィンドウの (幅, 高さ)。投稿画面のボタンが表示される程度の固定サイズにする
+        :param block: 遮断するリソースの種類（BLOCKED_URL_PATTERNSのキー）
+        :param extra_blocked_urls: 追加で遮断するURLパターン
+        :param block_images: Trueの場合は画像の読み込みを無効にする（アイコンはSVGなので操作に影響しない）
+        :param cache_dir: ブラウザ間で共有するディスクキャッシュのディレクトリ。Noneの場合はChromeの既定
+        :param cache_size: ディスクキャッシュの上限（バイト）
+        :param lean: Trueの場合はLEAN_ARGUMENTSで不要な機能を止める
+        :param network_events: Trueの場合はCDPのNetworkイベントをパフォーマンスログに記録する（シェア完了の検知に使う）
+        :param arguments: 追加するChromeの起動引数
+        """
+        self.headless = headless
+        self.window_size = window_size
+        self.blocked_urls = [pattern for kind in block for pattern in BLOCKED_URL_PATTERNS[kind]]
+        self.blocked_urls.extend(extra_blocked_urls or [])
+        self.block_images = block_images
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.lean = lean
+        self.network_events = network_events
+        self.arguments = list(arguments or [])
+
+    @classmethod
+    def default(cls):
+        """従来どおり画面付きで、リソースを遮断しない設定"""
+        return cls(headless=False, window_size=None, block=(), block_images=False, cache_dir=None, lean=False)
+
+    def options(self):
+        """
+        この設定のChromeのOptionsを作成する
+
+        :return: selenium.webdriver.chrome.options.Options
+        """
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        if self.headless:
+            options.add_argument('--headless=new')
+        if self.window_size:
+            options.add_argument('--window-size={},{}'.format(*self.window_size))
+        if self.lean:
+            for argument in LEAN_ARGUMENTS:
+                options.add_argument(argument)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            options.add_argument(f'--disk-cache-dir={os.path.abspath(self.cache_dir)}')
+            options.add_argument(f'--disk-cache-size={self.cache_size}')
+        if self.block_images:
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        if self.network_events:
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+        for argument in self.arguments:
+            options.add_argument(argument)
+        return options
+
+    def apply(self, driver):
+        """
+        起動したブラウザにリソースの遮断を設定する。遮断はタブごとに有効なので、新しいタブでも呼ぶこと
+
+        :param driver: ChromeDriver
+        """
+        if not self.blocked_urls:
+            return
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_urls})
+        except Exception as e:
+            # 遮断できなくても投稿には影響しないため続行する
+            logger.warning(f"リソースの遮断を設定できませんでした: {str(e)}")
@@ -0,0 +1,367 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logger import setup_logger
+import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = setup_logger('browser_supervisor', 'logs/browser_supervisor.log')
+
+# ブラウザ全体のメモリ使用量（RSS）の上限（MB）
+DEFAULT_MEMORY_BUDGET_MB = 2048
+# 1つのステップ（WaitPolicyで区切られる操作）に許す時間（秒）。シェア完了の待機（180秒）より長くする
+DEFAULT_STEP_DEADLINE = 300
+# 1つのアカウントの投稿処理（ブラウザの貸し出しから返却まで）に許す時間（秒）
+DEFAULT_ACCOUNT_DEADLINE = 1800
+# 監視の間隔（秒）
+CHECK_INTERVAL = 5
+# 起動したChromeDriverのプロセスIDを記録するディレクトリ（前回のプロセスが残したブラウザの回収に使う）。
+# Webサーバーとスケジューラーのように複数のプロセスが同時に動くため、プロセスごとに別のファイルに記録する
+PID_DIR = 'browser_pids'
+
+BROWSER_ADMISSION_WAITS = metrics.counter('browser_admission_waits_total', 'メモリの予算を超えていたため起動を待たされたブラウザの数')
+BROWSER_ADMISSION_WAIT_SECONDS = metrics.histogram('browser_admission_wait_seconds', 'メモリの予算によってブラウザの起動を待った時間（秒）')
+BROWSER_KILLS = metrics.counter('browser_sessions_killed_total', '強制終了したブラウザの数（reason: step_deadline/account_deadline/orphan）')
+
+
+class BrowserAdmissionTimeout(Exception):
+    """メモリの予算に空きが出ないまま、起動の待機時間の上限を過ぎた"""
+
+
+class _Session:
+    def __init__(self, driver_pid):
+        self.driver_pid = driver_pid
+        # ChromeDriverが異常終了してもChromeを回収できるよう、子プロセスも記録しておく
+        self.pids = {driver_pid}
+        self.account = None
+        self.account_started = None
+        self.step = None
+        self.step_started = None
+
+
+class BrowserSupervisor:
+    """
+    ブラウザのメモリ使用量による起動の制限と、応答しないブラウザの強制終了を行う監視役
+
+    メモリの予算はpid_dirを共有する全てのプロセスのブラウザに適用するが、期限の監視と強制終了の対象はこのプロセスが起動したブラウザだけ。
+    他のプロセスのブラウザはそのプロセスの監視役が扱い、異常終了したプロセスのブラウザは次にstartした監視役が回収する
+    """
+
+    def __init__(self, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, step_deadline=DEFAULT_STEP_DEADLINE,
+                 account_deadline=DEFAULT_ACCOUNT_DEADLINE, admission_timeout=600, pid_dir=PID_DIR):
+        """
+        :param memory_budget_mb: 全てのブラウザのRSSの合計の上限（MB）。これを下回っている間だけ新しいブラウザを起動する
+        :param step_deadline: 1つのステップに許す時間（秒）
+        :param account_deadline: 1つのアカウントの投稿処理に許す時間（秒）
+        :param admission_timeout: メモリの予算に空きが出るのを待つ時間の上限（秒）
+        :param pid_dir: 起動したChromeDriverのプロセスIDを記録するディレクトリ
+        """
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.step_deadline = step_deadline
+        self.account_deadline = account_deadline
+        self.admission_timeout = admission_timeout
+        self.pid_dir = pid_dir
+        self.pid_file = os.path.join(pid_dir, f'{os.getpid()}.json')
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        if psutil is None:
+            logger.warning("psutilが見つからないため、メモリの予算による制限とプロセスの強制終了を行いません")
+        logger.info(f"BrowserSupervisorが初期化されました: memory_budget={memory_budget_mb}MB, "
+                     f"step_deadline={step_deadline}秒, account_deadline={account_deadline}秒")
+
+    def start(self):
+        """前回のプロセスが残したブラウザを回収し、監視スレッドを開始する"""
+        if psutil is None or self._thread is not None:
+            return
+        self._reap_previous_run()
+        self._thread = threading.Thread(target=self._run, name='browser-supervisor', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info("ブラウザの監視を開始しました")
+
+    def stop(self):
+        """監視を止め、登録されている全てのブラウザを強制終了する"""
+        self._stop_event.set()
+        if psutil is None:
+            return
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._kill(session)
+        self._save_pids()
+
+    def register(self, driver):
+        """起動したブラウザを監視の対象に加える"""
+        pid = _driver_pid(driver)
+        if pid is None:
+            return
+        session = _Session(pid)
+        session.pids.update(_descendants(pid))
+        with self._lock:
+            self._sessions[driver] = session
+        self._save_pids()
+
+    def unregister(self, driver):
+        """終了したブラウザを監視の対象から外す"""
+        with self._lock:
+            session = self._sessions.pop(driver, None)
+        if session is not None:
+            self._save_pids()
+
+    def has_room(self):
+        """
+        ブラウザのメモリ使用量が予算を下回っている場合はTrue
+
+        予算は同じpid_dirを使う全てのプロセス（Webサーバーとscheduler_service.py）のブラウザの合計に適用する
+        """
+        if psutil is None:
+            return True
+        return self.browser_rss() + self.other_processes_rss() < self.memory_budget
+
+    def browser_rss(self):
+        """このプロセスが監視しているブラウザのプロセスツリー全体のRSS（バイト）"""
+        with self._lock:
+            driver_pids = [session.driver_pid for session in self._sessions.values()]
+        return _tree_rss(driver_pids)
+
+    def other_processes_rss(self):
+        """動いている他のプロセスがpid_dirに記録したブラウザのRSSの合計（バイト）"""
+        driver_pids = []
+        for path, recorded in self._pid_files():
+            if path == self.pid_file or not _is_alive(recorded.get('owner_pid'), recorded.get('owner_started')):
+                continue
+            driver_pids.extend(entry['driver_pid'] for entry in recorded.get('sessions', []))
+        return _tree_rss(driver_pids)
+
+    def wait_for_room(self, idle):
+        """
+        メモリの予算に空きが出るか、他のブラウザが返却されるまで待つ
+
+        :param idle: 返却されたブラウザが入るキュー
+        :return: 返却されたブラウザ。予算に空きが出た場合はNone
+        :raises BrowserAdmissionTimeout: admission_timeoutを過ぎても空きが出なかった場合
+        """
+        BROWSER_ADMISSION_WAITS.inc()
+        logger.warning(f"ブラウザのメモリ使用量が予算を超えているため、起動を待機します: "
+                       f"{(self.browser_rss() + self.other_processes_rss()) / (1024 * 1024):.0f}MB / {self.memory_budget / (1024 * 1024):.0f}MB")
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < self.admission_timeout:
+                try:
+                    return idle.get(timeout=CHECK_INTERVAL)
+                except queue.Empty:
+                    if self.has_room():
+                        return None
+            raise BrowserAdmissionTimeout(f"{self.admission_timeout}秒待ってもブラウザのメモリの予算に空きが出ませんでした")
+        finally:
+            BROWSER_ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started)
+
+    @contextmanager
+    def session(self, driver, account=None):
+        """このブロックをアカウントの投稿処理とみなし、account_deadlineを適用する"""
+        with self._lock:
+            session = self._sessions.get(driver)
+            if session is not None:
+                session.account = account
+                session.account_started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if session is not None:
+                    session.account = session.account_started = session.step = session.step_started = None
+
+    def mark(self, driver, step):
+        """ステップの開始を記録する（WaitPolicyから呼ばれる）"""
+        with self._lock:
+            session = self._sessions.get(driver)
+            if session is not None:
+                session.step = step
+                session.step_started = time.monotonic()
+
+    def _run(self):
+        while not self._stop_event.wait(CHECK_INTERVAL):
+            try:
+                self._check()
+            except Exception:
+                logger.exception("ブラウザの監視中にエラーが発生しました")
+
+    def _check(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for driver, session in list(self._sessions.items()):
+                if not psutil.pid_exists(session.driver_pid):
+                    # ChromeDriverだけが終了し、Chromeが取り残された
+                    expired.append((driver, session, 'orphan'))
+                elif session.account_started is not None and now - session.account_started > self.account_deadline:
+                    expired.append((driver, session, 'account_deadline'))
+                elif session.step_started is not None and now - session.step_started > self.step_deadline:
+                    expired.append((driver, session, 'step_deadline'))
+                else:
+                    # 起動直後に記録できなかったChromeのプロセスを追加する
+                    session.pids.update(_descendants(session.driver_pid))
+            for driver, _, _ in expired:
+                self._sessions.pop(driver, None)
+        for _, session, reason in expired:
+            logger.error(f"ブラウザを強制終了します: reason={reason}, account={session.account}, step={session.step}")
+            BROWSER_KILLS.inc(reason=reason)
+            self._kill(session)
+        if expired:
+            self._save_pids()
+
+    def _kill(self, session):
+        """記録されたプロセスと、ChromeDriverの子孫プロセスを全て終了させて回収する"""
+        procs = {proc.pid: proc for proc in _process_tree(session.driver_pid)}
+        for pid in session.pids:
+            if pid not in procs:
+                try:
+                    procs[pid] = psutil.Process(pid)
+                except psutil.Error:
+                    continue
+        for proc in procs.values():
+            try:
+                proc.kill()
+            except psutil.Error:
+                continue
+        psutil.wait_procs(list(procs.values()), timeout=10)
+
+    def _reap_previous_run(self):
+        """
+        異常終了したプロセスが残したChromeDriverとChromeを終了させる
+
+        記録したプロセスがまだ動いている場合（同時に動いている別のプロセスのブラウザ）は何もしない
+        """
+        reaped = 0
+        for path, recorded in self._pid_files():
+            if _is_alive(recorded.get('owner_pid'), recorded.get('owner_started')):
+                continue
+            for entry in recorded.get('sessions', []):
+                pids = [pid for pid in entry['pids'] if _is_browser_process(pid)]
+                if not pids:
+                    continue
+                session = _Session(entry['driver_pid'])
+                session.pids.update(pids)
+                self._kill(session)
+                reaped += 1
+            _remove(path)
+        if reaped:
+            BROWSER_KILLS.inc(reaped, reason='orphan')
+            logger.warning(f"終了したプロセスが残したブラウザを{reaped}個終了しました")
+
+    def _pid_files(self):
+        """:return: pid_dirの各ファイルの (パス, 記録内容) のリスト"""
+        try:
+            names = [name for name in os.listdir(self.pid_dir) if name.endswith('.json')]
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            path = os.path.join(self.pid_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    files.append((path, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return files
+
+    def _save_pids(self):
+        """このプロセスのブラウザのプロセスIDを、このプロセス専用のファイルに記録する"""
+        with self._save_lock:
+            with self._lock:
+                sessions = [
+                    {'driver_pid': session.driver_pid, 'pids': sorted(session.pids)}
+                    for session in self._sessions.values()
+                ]
+            if not sessions:
+                _remove(self.pid_file)
+                return
+            recorded = {'owner_pid': os.getpid(), 'owner_started': _create_time(os.getpid()), 'sessions': sessions}
+            temp_file = f'{self.pid_file}.tmp'
+            try:
+                os.makedirs(self.pid_dir, exist_ok=True)
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(recorded, f)
+                # 他のプロセスが書きかけのファイルを読まないよう、書き終えてから置き換える
+                os.replace(temp_file, self.pid_file)
+            except OSError as e:
+                logger.warning(f"プロセスIDの記録に失敗しました: {str(e)}")
+
+
+def _driver_pid(driver):
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def _process_tree(pid):
+    if psutil is None:
+        return []
+    try:
+        proc = psutil.Process(pid)
+        return [proc, *proc.children(recursive=True)]
+    except psutil.Error:
+        return []
+
+
+def _tree_rss(driver_pids):
+    total = 0
+    for pid in driver_pids:
+        for proc in _process_tree(pid):
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                continue
+    return total
+
+
+def _descendants(pid):
+    return {proc.pid for proc in _process_tree(pid)[1:]}
+
+
+def _create_time(pid):
+    if psutil is None:
+        return None
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return None
+
+
+def _is_alive(pid, started):
+    """プロセスIDが再利用されている可能性があるため、起動時刻も一致する場合だけ動いているとみなす"""
+    if pid is None:
+        return False
+    create_time = _create_time(pid)
+    return create_time is not None and (started is None or abs(create_time - started) < 1)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _is_browser_process(pid):
+    """プロセスIDが再利用されている可能性があるため、Chrome関連のプロセスかを名前で確かめる"""
+    try:
+        name = psutil.Process(pid).name().lower()
+    except psutil.Error:
+        return False
+    return 'chrome' in name
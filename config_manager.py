@@ -1,174 +1,338 @@
 import json
 import os
 import random
-from datetime import datetime, time
+import threading
+import time
 from logger import setup_logger
-import configparser
-from cryptography.fernet import Fernet
-from cryptography.fernet import Fernet, InvalidToken
+import metrics
+from account_store import IniAccountStore, SQLiteAccountStore
+from post_schedule import Schedule
+from video_catalog import VideoCatalog
 
 logger = setup_logger('config_manager', 'logs/config_manager.log')
 
+ACCOUNT_CACHE_TOTAL = metrics.counter('account_cache_total', 'アカウント情報の参照回数（result: hit/reload）')
+ACCOUNTS_RELOAD_SECONDS = metrics.histogram('accounts_reload_seconds', 'アカウントファイルの読み込みと復号にかかった時間（秒）')
+VIDEO_PICK_SECONDS = metrics.histogram('video_pick_seconds', '動画カタログの更新と動画の選択にかかった時間（秒）')
+
+# アカウントとスケジュールを保存するSQLiteファイルの拡張子（従来のアカウントファイルと同じ場所・名前で作成する）
+ACCOUNTS_DB_SUFFIX = '.db'
+# パスワードとスケジュールの暗号化キーを保存するファイル
+ENCRYPTION_KEY_FILE = 'config_encryption.key'
+
+
+def accounts_db_path(accounts_file):
+    """
+    :param accounts_file: 従来のアカウントファイルのパス
+    :return: 同じディレクトリにある、拡張子を.dbに変えたSQLiteファイルのパス（accounts.ini -> accounts.db）
+    """
+    return os.path.splitext(accounts_file)[0] + ACCOUNTS_DB_SUFFIX
+
+
 class ConfigManager:
-    def __init__(self, accounts_file, schedule_file):
+    def __init__(self, accounts_file, schedule_file, catalog_file='video_catalog.db', store=None):
+        """
+        :param accounts_file: 従来のアカウントファイル（SQLiteのストアを初めて使うときの移行元）
+        :param schedule_file: 従来のスケジュールファイル（同上）
+        :param catalog_file: 動画カタログのSQLiteファイルのパス
+        :param store: アカウントとスケジュールの保存先のAccountStore。
+                      省略時はaccounts_fileの拡張子を.dbに変えたファイルを使うSQLiteAccountStore
+        """
         self.accounts_file = accounts_file
         self.schedule_file = schedule_file
-        logger.info(f"ConfigManagerが初期化されました: accounts_file={accounts_file}, schedule_file={schedule_file}")
+        self.store = store or SQLiteAccountStore(accounts_db_path(accounts_file))
+        self.video_catalog = VideoCatalog(catalog_file)
+        logger.info(f"ConfigManagerが初期化されました: accounts_file={accounts_file}, schedule_file={schedule_file}, "
+                    f"store={type(self.store).__name__}")
+
+        # 暗号化キーは初めて暗号化・復号する時に読み込む（cryptographyの読み込みとキーファイルの作成を遅らせる）
+        self._cipher_lock = threading.Lock()
+        self._cipher_suite = None
 
-        # 暗号化キーの設定
-        key_file = 'config_encryption.key'
-        self.key = Fernet.generate_key()
-        with open(key_file, 'wb') as f:
-            f.write(self.key)
-        self.cipher_suite = Fernet(self.key)
-        logger.info("新しい設定ファイル暗号化キーが生成されました")
+        # アカウント情報のキャッシュ（username -> {'password', 'postFlag'}）
+        self._accounts_lock = threading.RLock()
+        self._accounts = {}
+        self._accounts_stamp = None
+        # 復号済みのスケジュールのキャッシュ (保存先のstamp, Schedule)
+        self._schedule_cache = (None, None)
+
+        if isinstance(self.store, SQLiteAccountStore):
+            self._migrate_files()
 
 
     def get_random_videos(self, video_folder, count=3):
-        """指定されたフォルダからランダムに指定された数の異なる動画を選択する"""
+        """
+        指定されたフォルダから、最近使われていない順に指定された数の異なる動画を選択する
+
+        フォルダの再スキャンはバックグラウンドで行うため、追加・削除したファイルは索引の更新後に反映される
+        """
         if not os.path.exists(video_folder):
             os.makedirs(video_folder)
             logger.info(f"動画フォルダが存在しないため作成しました: {video_folder}")
 
-        video_files = [f for f in os.listdir(video_folder) if f.endswith(('.mp4', '.mov', '.avi'))]
-        if len(video_files) < count:
+        with VIDEO_PICK_SECONDS.time():
+            self.video_catalog.ensure_indexed(video_folder)
+            selected_videos = self.video_catalog.pick(video_folder, count)
+        if len(selected_videos) < count:
             logger.warning(f"フォルダ内の動画ファイルが{count}個未満です。利用可能な全ての動画を返します。")
-            return [os.path.abspath(os.path.join(video_folder, f)) for f in video_files]
+            return selected_videos
 
-        selected_videos = random.sample(video_files, count)
-        logger.info(f"{count}個の動画がランダムに選択されました: {', '.join(selected_videos)}")
-        return [os.path.abspath(os.path.join(video_folder, f)) for f in selected_videos]
+        logger.info("%d個の動画が選択されました: %s", count, selected_videos)
+        return selected_videos
 
     def get_accounts(self):
-        logger.info("全アカウント情報の取得を開始")
-        config = configparser.ConfigParser()
-        config.read(self.accounts_file)
-        accounts = {}
-        for section in config.sections():
-            account = dict(config[section])
-            if 'postflag' not in account:
-                account['postflag'] = 'true'
-                self._update_account_file(section, account)
-            try:
-                decrypted_password = self._decrypt(account['password'])
-            except InvalidToken:
-                # 暗号化されていない場合、そのまま使用
-                decrypted_password = account['password']
-            accounts[section] = {
-                'password': decrypted_password,
-                'postFlag': account['postflag'].lower() == 'true'
-            }
-        logger.info(f"{len(accounts)}個のアカウント情報を取得しました")
-        return accounts
+        """全アカウント情報を返す（保存先が変更された場合のみ再読み込み）"""
+        with self._accounts_lock:
+            self._refresh_accounts()
+            return {username: dict(info) for username, info in self._accounts.items()}
 
     def get_account(self, username):
-        logger.info(f"アカウント {username} の情報取得を開始")
-        accounts = self.get_accounts()
-        account = accounts.get(username)
-        if account:
-            logger.info(f"アカウント情報を取得しました: {username}")
-        else:
-            logger.warning(f"アカウントが見つかりません: {username}")
+        with self._accounts_lock:
+            self._refresh_accounts()
+            account = self._accounts.get(username)
+            account = dict(account) if account else None
+        if not account:
+            logger.warning("アカウントが見つかりません: %s", username)
         return account
 
     def save_account(self, username, password, post_flag):
         """新しいアカウントを保存または既存のアカウントを更新"""
         logger.info(f"アカウント {username} の保存を開始")
-        config = configparser.ConfigParser()
-        config.read(self.accounts_file)
-        
-        if username not in config:
-            config.add_section(username)
-        
-        config[username]['password'] = self._encrypt(password)
-        config[username]['postflag'] = str(post_flag).lower()
-        
-        with open(self.accounts_file, 'w') as configfile:
-            config.write(configfile)
-        
+        self.apply_account_changes(create=[{'username': username, 'password': password, 'postFlag': post_flag}])
         logger.info(f"アカウント {username} が正常に保存されました")
 
+    def update_account(self, username, data):
+        """
+        既存のアカウントのパスワードと投稿フラグを更新する
+
+        :param username: ユーザー名
+        :param data: 更新する項目 {'password', 'postFlag'}（省略した項目は変更しない）
+        :return: アカウントが存在しない場合はFalse
+        :raises ValueError: dataがJSONオブジェクト（辞書）でない場合
+        """
+        if not isinstance(data, dict):
+            raise ValueError("更新内容はJSONオブジェクトで指定してください")
+        if self.get_account(username) is None:
+            return False
+        self.apply_account_changes(update=[dict(data, username=username)])
+        logger.info(f"アカウントを更新しました: {username}")
+        return True
+
     def delete_account(self, username):
+        """:return: アカウントが存在し、削除された場合はTrue"""
         logger.info(f"アカウント {username} の削除を開始")
-        config = configparser.ConfigParser()
-        config.read(self.accounts_file)
-        if username in config:
-            config.remove_section(username)
-            with open(self.accounts_file, 'w') as configfile:
-                config.write(configfile)
+        deleted = self.apply_account_changes(delete=[username])['deleted']
+        if deleted:
             logger.info(f"アカウントを削除しました: {username}")
         else:
             logger.warning(f"削除対象のアカウントが見つかりません: {username}")
+        return bool(deleted)
+
+    def import_accounts(self, accounts, replace=False):
+        """
+        アカウントをまとめて取り込む
+
+        :param accounts: {'username', 'password', 'postFlag'} のリスト
+        :param replace: Trueの場合、accountsに含まれないアカウントを削除する
+        :return: apply_account_changesと同じ形式の結果
+        """
+        return self.apply_account_changes(create=accounts, replace=replace)
 
-    def _update_account_file(self, username, account_data):
-        logger.info(f"アカウント {username} のファイル更新を開始")
-        config = configparser.ConfigParser()
-        config.read(self.accounts_file)
-        config[username] = account_data
-        with open(self.accounts_file, 'w') as configfile:
-            config.write(configfile)
-        logger.info(f"アカウントファイルを更新しました: {username}")
+    def apply_account_changes(self, create=(), update=(), delete=(), replace=False):
+        """
+        アカウントの追加・更新・削除をまとめて検証し、1つのトランザクションで保存する
+
+        :param create: 追加するアカウント {'username', 'password', 'postFlag'} のリスト。既存の場合は上書きする
+        :param update: 更新するアカウント {'username', 'password'（省略可）, 'postFlag'（省略可）} のリスト
+        :param delete: 削除するユーザー名のリスト
+        :param replace: Trueの場合、createとupdateに含まれないアカウントを全て削除する
+        :return: {'saved': 保存したユーザー名のリスト, 'deleted': 削除したユーザー名のリスト}
+        :raises ValueError: ユーザー名やパスワードが無い場合、更新対象のアカウントが存在しない場合
+        """
+        existing = self.get_accounts()
+        upserts = []
+        for account in create:
+            username = _require_username(account)
+            if not account.get('password'):
+                raise ValueError(f"アカウント {username} のパスワードがありません")
+            upserts.append((username, self._encrypt(account['password']).decode(),
+                            _parse_flag(account.get('postFlag', True))))
+        for account in update:
+            username = _require_username(account)
+            if username not in existing:
+                raise ValueError(f"更新対象のアカウントが見つかりません: {username}")
+            password = account.get('password')
+            upserts.append((username, self._encrypt(password).decode() if password else None,
+                            _parse_flag(account['postFlag']) if 'postFlag' in account else None))
+
+        with self._accounts_lock:
+            deleted = self.store.write_accounts(upserts=upserts, deletes=list(delete), replace=replace)
+            # キャッシュは次回参照時に保存先から読み直す
+            self._accounts_stamp = None
+        saved = [username for username, _, _ in upserts]
+        logger.info(f"アカウントを一括で保存しました: 保存{len(saved)}件, 削除{len(deleted)}件")
+        return {'saved': saved, 'deleted': deleted}
+
+    def _refresh_accounts(self):
+        """保存先が変更されていればキャッシュを再構築する（ロック取得済みで呼ぶこと）"""
+        stamp = self.store.stamp()
+        if stamp == self._accounts_stamp:
+            ACCOUNT_CACHE_TOTAL.inc(result='hit')
+            return
+        ACCOUNT_CACHE_TOTAL.inc(result='reload')
+        with ACCOUNTS_RELOAD_SECONDS.time():
+            self._load_accounts(stamp)
+
+    def _load_accounts(self, stamp):
+        """保存先からアカウントを読み込み、パスワードを復号してキャッシュに格納する"""
+        logger.debug("アカウント情報の読み込みを開始")
+        accounts = {}
+        for username, account in self.store.load_accounts().items():
+            decrypted_password = self._try_decrypt(account['password'])
+            if decrypted_password is None:
+                # 暗号化されていない場合、そのまま使用
+                decrypted_password = account['password']
+            accounts[username] = {
+                'password': decrypted_password,
+                'postFlag': account['post_flag']
+            }
+
+        self._accounts = accounts
+        self._accounts_stamp = stamp
+        logger.info("%d個のアカウント情報を読み込みました", len(accounts))
+
+    def _migrate_files(self):
+        """従来のaccounts.iniとschedule.jsonの内容を、初回のみSQLiteのストアに移す"""
+        if self.store.get_meta('migrated_at') is not None:
+            if os.path.exists(self.accounts_file):
+                logger.info(f"{self.accounts_file} は移行済みのため読み込みません（アカウントの変更はWeb画面かAPIで行ってください）")
+            return
+        legacy = IniAccountStore(self.accounts_file, self.schedule_file)
+        accounts = []
+        for username, account in legacy.load_accounts().items():
+            password = self._try_decrypt(account['password'])
+            if password is None:
+                password = account['password']
+            accounts.append((username, self._encrypt(password).decode(), account['post_flag']))
+        if accounts:
+            self.store.write_accounts(upserts=accounts)
+
+        schedule = legacy.load_schedule()
+        if schedule and self.store.load_schedule() is None:
+            decrypted = self._try_decrypt(schedule)
+            # 復号できない場合は平文のJSONで保存されている
+            schedule = decrypted if decrypted is not None else schedule.decode('utf-8')
+            try:
+                json.loads(schedule)
+                self.store.save_schedule(self._encrypt(schedule))
+            except ValueError:
+                logger.error("スケジュールファイルの形式が不正なため、移行しませんでした")
+
+        self.store.set_meta('migrated_at', str(time.time()))
+        logger.info(f"{self.accounts_file} と {self.schedule_file} の内容を移行しました: アカウント{len(accounts)}件"
+                    f"（以降、{self.accounts_file} の変更は反映されません）")
 
     def save_schedule(self, schedule_data):
         """
         新しいスケジュール設定を保存する。
         
-        :param schedule_data: 辞書形式のスケジュールデータ
+        :param schedule_data: Schedule、またはSchedule.from_dictが受け付ける辞書形式のスケジュールデータ
+        :raises ValueError: スケジュールの内容が不正な場合
         """
         logger.info("新しいスケジュールの保存を開始")
         try:
-            encrypted_data = self._encrypt(json.dumps({
-                'post_times': [time.strftime('%H:%M') for time in schedule_data['post_times']],
-                'accounts': schedule_data['accounts'],
-                'caption': schedule_data['caption']
-            }))
-            with open(self.schedule_file, 'wb') as file:
-                file.write(encrypted_data)
-            logger.info(f"新しいスケジュールを保存しました: 投稿時刻 {schedule_data['post_times']}, アカウント数 {len(schedule_data['accounts'])}")
+            schedule = schedule_data if isinstance(schedule_data, Schedule) else Schedule.from_dict(schedule_data)
+            schedule.validate()
+            encrypted_data = self._encrypt(json.dumps(schedule.to_dict()))
+            self.store.save_schedule(encrypted_data)
+            logger.info(f"新しいスケジュールを保存しました: エントリー {[entry.label() for entry in schedule.entries]}, アカウント数 {len(schedule.accounts)}")
         except Exception as e:
             logger.error(f"スケジュールの保存中にエラーが発生しました: {str(e)}")
             raise
 
     def load_schedule(self):
-        """スケジュール設定を読み込む"""
-        logger.info("スケジュールの読み込みを開始")
-        try:
-            if not os.path.exists(self.schedule_file):
-                logger.warning("スケジュールファイルが見つかりません")
-                return None
-
-            with open(self.schedule_file, 'rb') as file:
-                encrypted_data = file.read()
-
-            decrypted_data = self._decrypt(encrypted_data)
-            data = json.loads(decrypted_data)
-            schedule = {
-                'post_times': [datetime.strptime(t, '%H:%M').time() for t in data['post_times']],
-                'accounts': data['accounts'],
-                'caption': data['caption']
-            }
-            logger.info(f"スケジュールを読み込みました: {schedule}")
+        """スケジュール設定を読み込む（保存先が変更された場合のみ復号し直す）"""
+        stamp = self.store.stamp()
+        cached_stamp, schedule = self._schedule_cache
+        if cached_stamp is not None and cached_stamp == stamp:
             return schedule
+
+        logger.debug("スケジュールの読み込みを開始")
+        try:
+            encrypted_data = self.store.load_schedule()
+            if encrypted_data is None:
+                logger.warning("スケジュールが設定されていません")
+                schedule = None
+            else:
+                decrypted_data = self._decrypt(encrypted_data)
+                schedule = Schedule.from_dict(json.loads(decrypted_data))
+                logger.debug("スケジュールを読み込みました: %s", schedule.to_dict())
         except json.JSONDecodeError:
             logger.error("スケジュールファイルの形式が不正です")
             return None
         except Exception as e:
             logger.error(f"スケジュールの読み込み中にエラーが発生しました: {str(e)}")
             return None
+        self._schedule_cache = (stamp, schedule)
+        return schedule
         
     def get_random_wait_time(self):
         """1分から60分の間でランダムな待機時間（秒）を生成する"""
         wait_time = random.randint(60, 3600)  # 60秒（1分）から3600秒（60分）の間
-        logger.info(f"ランダムな待機時間を生成しました: {wait_time}秒")
+        logger.debug("ランダムな待機時間を生成しました: %d秒", wait_time)
         return wait_time
 
+    def _cipher(self):
+        """暗号化に使うFernetを返す。初めて呼ばれた時にキーを読み込み、無ければ生成して保存する"""
+        if self._cipher_suite is None:
+            with self._cipher_lock:
+                if self._cipher_suite is None:
+                    from cryptography.fernet import Fernet
+
+                    # 保存済みのパスワードを復号できるよう、既存のキーがあれば使う
+                    if os.path.exists(ENCRYPTION_KEY_FILE):
+                        with open(ENCRYPTION_KEY_FILE, 'rb') as f:
+                            key = f.read()
+                        logger.info("設定ファイル暗号化キーを読み込みました")
+                    else:
+                        key = Fernet.generate_key()
+                        with open(ENCRYPTION_KEY_FILE, 'wb') as f:
+                            f.write(key)
+                        logger.info("新しい設定ファイル暗号化キーが生成されました")
+                    self._cipher_suite = Fernet(key)
+        return self._cipher_suite
+
     def _encrypt(self, data):
         """データを暗号化する"""
-        return self.cipher_suite.encrypt(data.encode())
+        return self._cipher().encrypt(data.encode())
 
     def _decrypt(self, encrypted_data):
         """暗号化されたデータを復号化する"""
-        return self.cipher_suite.decrypt(encrypted_data).decode()
+        return self._cipher().decrypt(encrypted_data).decode()
+
+    def _try_decrypt(self, data):
+        """
+        :return: 復号したデータ。このキーで暗号化されていない場合はNone
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return self._decrypt(data)
+        except InvalidToken:
+            return None
+
+
+
+def _require_username(account):
+    if not isinstance(account, dict):
+        raise ValueError("アカウントはJSONオブジェクトで指定してください")
+    username = account.get('username')
+    if not isinstance(username, str) or not username.strip():
+        raise ValueError("ユーザー名がありません")
+    return username.strip()
+
 
-# ConfigManagerのインスタンスを作成
-config_manager = ConfigManager('accounts.ini', 'schedule.json')
\ No newline at end of file
+def _parse_flag(value):
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
@@ -0,0 +1,14 @@
+# gunicornの設定（gunicornは作業ディレクトリのgunicorn.conf.pyを自動で読み込む）
+#
+# /metricsの値とブラウザの事前起動はワーカーのプロセスごとのため、Webサーバーは1つのワーカーで動かす。
+# ジョブの状態、アカウントのロック、ブラウザのメモリの予算はプロセス間で共有されるが、
+# メトリクスをワーカーごとに集計する仕組みが無いため、-w で2以上を指定した場合は起動しない
+bind = '0.0.0.0:5001'
+workers = 1
+# SSE（/api/jobs/<id>/events）で接続を保持するため、1つのワーカーで複数のリクエストを処理する
+threads = 8
+
+
+def on_starting(server):
+    if server.cfg.workers != 1:
+        raise RuntimeError(f"Webサーバーは1つのワーカーで起動してください（指定されたワーカー数: {server.cfg.workers}）")
@@ -1,81 +1,387 @@
 import os
 import time
-from selenium import webdriver
+from collections import deque
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.common.exceptions import TimeoutException
 import traceback
 from logger import setup_logger
-import random
-from session_manager import session_manager
+import metrics
+from session_manager import get_session_manager
+from browser_pool import create_driver
+from network_monitor import NetworkMonitor, ShareFailed
+from wait_policy import WaitPolicy
+from ui_selectors import SelectorResolver
+from video_catalog import content_hash
 
 logger = setup_logger('instagram_uploader', 'logs/instagram_uploader.log')
 
+INSTAGRAM_URL = 'https://www.instagram.com'
+
+# 1つの動画のアップロードを同じブラウザで試行する回数（「シェア」ボタンを押す前に失敗した場合だけ再試行する）
+VIDEO_ATTEMPTS = 2
+
+LOGIN_TOTAL = metrics.counter('login_total', 'ログイン回数（mode: session/password, outcome: success/failure）')
+LOGIN_SECONDS = metrics.histogram('login_seconds', 'ログインにかかった時間（秒）')
+VIDEO_UPLOAD_SECONDS = metrics.histogram('video_upload_seconds', '動画1件のアップロードからシェア完了までの時間（秒）')
+UPLOAD_STEP_SECONDS = metrics.histogram('upload_step_seconds', 'アップロードの各ステップの所要時間（秒）')
+SHARE_CONFIRMATIONS = metrics.counter('share_confirmations_total', 'シェア完了を検知した方法（source: network/dom）')
+SHARE_SERVER_SECONDS = metrics.histogram('share_server_seconds', '投稿の確定リクエストのサーバー応答時間（秒）')
+UPLOADED_BYTES = metrics.counter('uploaded_bytes_total', 'アップロードした動画の合計バイト数')
+CAPTION_INPUTS = metrics.counter('caption_inputs_total', 'キャプションの入力方法（method: insert_text/send_keys）')
+
 class InstagramUploader:
-    def __init__(self):
+    def __init__(self, driver=None, wait_policy=None, base_url=INSTAGRAM_URL, max_in_flight=1, profile=None, history=None):
+        """
+        :param driver: BrowserPoolから貸し出されたChromeDriver。省略時は専用のブラウザを起動する
+        :param wait_policy: UI操作の待機に使うWaitPolicy。省略時は既定の設定を使う
+        :param base_url: InstagramのURL（ベンチマークでは模擬サーバーのURLを指定する）
+        :param max_in_flight: シェア処理の完了を待たずに進める動画の数。2以上の場合は動画ごとにタブを開いて並行して進める
+        :param profile: ブラウザの起動に使ったBrowserProfile。新しいタブにもリソースの遮断を設定するために使う
+        :param history: 動画ごとの投稿結果を記録するPostHistory。省略時は記録しない
+        """
         logger.info("InstagramUploaderの初期化を開始")
+        self.base_url = base_url.rstrip('/')
+        self.wait_policy = wait_policy or WaitPolicy()
+        self.max_in_flight = max(1, max_in_flight)
+        self.profile = profile
+        self.history = history
+        self.selectors = SelectorResolver()
+        # シェア完了のダイアログが開いたままかどうか（次の動画の前に閉じる）
+        self._share_dialog_open = False
+        if driver is not None:
+            # 貸し出されたブラウザは呼び出し側がプールに返却する
+            self.driver = driver
+            self.owns_driver = False
+            self.network = NetworkMonitor(driver)
+            logger.info("貸し出されたChromeDriverを使用します")
+            return
         try:
-            self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
-            self.driver.delete_all_cookies()
+            self.driver = create_driver()
+            self.owns_driver = True
+            self.network = NetworkMonitor(self.driver)
             logger.info("ChromeDriverが正常に初期化されました")
         except Exception as e:
             logger.error(f"ChromeDriverの初期化中にエラーが発生しました: {str(e)}")
             logger.error(traceback.format_exc())
             raise
 
-    def upload_to_instagram(self, video_paths, user_input_text, login_user_name, login_password):
-        logger.info(f"ユーザー {login_user_name} の3つの動画アップロードプロセスを開始します")
+    def upload_to_instagram(self, video_paths, user_input_text, login_user_name, login_password, progress=None,
+                            completed=None, on_shared=None, slot=None, run_id=None, unconfirmed=None,
+                            on_unconfirmed=None, sources=None):
+        """
+        ログインして動画を順番にアップロードする
+
+        シェア済みの動画は飛ばし、「シェア」ボタンを押す前に失敗した動画は同じブラウザで再ログインせずに再試行する。
+        ボタンを押した後に失敗した動画は、投稿されている可能性があるため再試行しない
+        max_in_flightが2以上の場合は、動画ごとのタブでシェア処理の完了を待たずに次の動画を進める
+
+        :param video_paths: アップロードする動画のパスのリスト
+        :param user_input_text: 投稿のキャプション
+        :param login_user_name: ユーザー名
+        :param login_password: パスワード
+        :param progress: 進捗の通知を受け取る関数 progress(state, **details)
+        :param completed: 前回までにシェア済みの動画番号（1始まり）の集合
+        :param on_shared: 動画のシェアが完了するたびに呼ばれる関数 on_shared(index, video_path)
+        :param unconfirmed: 前回までに「シェア」ボタンを押した後の結果が分からなかった動画番号の集合（再投稿しない）
+        :param on_unconfirmed: 「シェア」ボタンを押した後に結果を確認できなかった時に呼ばれる関数
+                               on_unconfirmed(index, video_path)
+        :param sources: 動画ごとの変換前のファイル {'source', 'source_hash'} のリスト（投稿履歴に記録する）。
+                        省略時はアップロードしたファイルを元のファイルとみなす
+        :param slot: スケジュールの投稿枠（投稿履歴に記録する）
+        :param run_id: 実行の識別子（投稿履歴に記録する）
+        :return: {'success': bool, 'videos': [{'path', 'status', 'error'}], 'error': str|None}
+                 statusは 'shared' / 'failed' / 'unconfirmed'（シェアを押した後に結果を確認できなかった） /
+                 'pending'（未着手）のいずれか
+                 （並行処理中に中断した場合は 'uploading' / 'processing' が残ることがある）
+                 シェア済みの動画には転送量 bytes_uploaded とサーバー応答時間 server_seconds が付く
+        """
+        logger.info("ユーザー %s の3つの動画アップロードプロセスを開始します", login_user_name)
+        report = progress or (lambda state, **details: None)
+        completed = set(completed or ())
+        unconfirmed = set(unconfirmed or ()) - completed
+        videos = [
+            {'path': path, 'status': 'shared' if i in completed else 'unconfirmed' if i in unconfirmed else 'pending',
+             'error': None, 'source': source.get('source') or path, 'source_hash': source.get('source_hash')}
+            for i, (path, source) in enumerate(zip(video_paths, sources or [{}] * len(video_paths)), 1)
+        ]
+        if completed or unconfirmed:
+            logger.info("シェア済みの動画 %s と結果不明の動画 %s を飛ばして再開します", sorted(completed), sorted(unconfirmed))
+
         try:
+            report('logging_in')
             # セッション情報を取得
+            session_manager = get_session_manager()
             session_data = session_manager.load_session(login_user_name)
             
-            if session_data and session_manager.is_session_valid(session_data):
-                logger.info(f"有効なセッションが見つかりました: {login_user_name}")
-                self._restore_session(session_data)
+            login_started = time.monotonic()
+            if session_data and session_manager.is_session_valid(session_data) and self._restore_session(session_data):
+                logger.info("保存されたセッションでログイン済みです: %s", login_user_name)
+                LOGIN_TOTAL.inc(mode='session', outcome='success')
+                LOGIN_SECONDS.observe(time.monotonic() - login_started, mode='session')
             else:
-                logger.info(f"有効なセッションが見つからないため、ログインを実行します: {login_user_name}")
-                self._login(login_user_name, login_password)
-                
-                # 新しいセッション情報を保存
-                #new_session_data = self._get_current_session()
-                #session_manager.save_session(login_user_name, new_session_data)
-
-            # 3つの動画をアップロード
-            for i, video_path in enumerate(video_paths, 1):
-                logger.info(f"{i}つ目の動画アップロードを開始します")
-                self._upload_single_video(video_path, user_input_text)
-                logger.info(f"{i}つ目の動画アップロードが完了しました")
-
-                # 最後の動画以外の場合、次の動画アップロードのために少し待機
-                if i < 3:
-                    time.sleep(10)
-                    logger.info("次の動画アップロードのために10秒待機します")
-
-            logger.info(f"ユーザー {login_user_name} の3つの動画投稿が完了しました")
-            return True
+                logger.info("有効なセッションが見つからないため、ログインを実行します: %s", login_user_name)
+                login_started = time.monotonic()
+                try:
+                    self._login(login_user_name, login_password)
+                except Exception:
+                    LOGIN_TOTAL.inc(mode='password', outcome='failure')
+                    raise
+                LOGIN_TOTAL.inc(mode='password', outcome='success')
+                LOGIN_SECONDS.observe(time.monotonic() - login_started, mode='password')
+                self._save_session(login_user_name)
+
+            if self.max_in_flight > 1:
+                self._upload_pipelined(videos, user_input_text, report, on_shared, login_user_name, on_unconfirmed)
+            else:
+                for i, video in enumerate(videos, 1):
+                    if video['status'] != 'pending':
+                        continue
+                    if not self._upload_with_retry(i, video, user_input_text, report, len(videos)):
+                        if video['status'] == 'unconfirmed' and on_unconfirmed:
+                            on_unconfirmed(i, video['path'])
+                        break
+                    if on_shared:
+                        on_shared(i, video['path'])
+                    self._save_session(login_user_name)
+
+                    # 最後の動画以外の場合、次の動画アップロードのために少し待機
+                    if i < len(videos):
+                        self.wait_policy.pace('between_videos')
         except Exception as e:
             logger.error(f"アップロードプロセス中にエラーが発生しました: {str(e)}")
             logger.error(traceback.format_exc())
-            return False
+            self._record_history(videos, login_user_name, user_input_text, slot, run_id, str(e))
+            return {'success': False, 'videos': videos, 'error': str(e)}
         finally:
-            self.driver.quit()
-            logger.info("WebDriverを終了しました")
+            if self.owns_driver:
+                self.driver.quit()
+                logger.info("WebDriverを終了しました")
+
+        self._record_history(videos, login_user_name, user_input_text, slot, run_id)
+        failed = next((video for video in videos if video['status'] != 'shared'), None)
+        if failed:
+            return {'success': False, 'videos': videos, 'error': failed['error']}
+        logger.info("ユーザー %s の3つの動画投稿が完了しました", login_user_name)
+        return {'success': True, 'videos': videos, 'error': None}
+
+    def _upload_with_retry(self, index, video, user_input_text, report, total):
+        """
+        1つの動画をアップロードし、「シェア」ボタンを押す前に失敗した場合はページを読み込み直して再試行する
+
+        ボタンを押した後に失敗した場合は、投稿されている可能性があるため再試行しない
+
+        :return: シェアに成功した場合はTrue
+        """
+        for attempt in range(1, VIDEO_ATTEMPTS + 1):
+            logger.info("%dつ目の動画アップロードを開始します (%d/%d回目)", index, attempt, VIDEO_ATTEMPTS)
+            report('uploading', current=index, total=total)
+            _begin_attempt(video)
+            started = time.monotonic()
+            try:
+                self._start_video(video['path'], user_input_text)
+            except Exception as e:
+                VIDEO_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome='failure')
+                video['error'] = str(e)
+                logger.error(f"{index}つ目の動画アップロードに失敗しました: {str(e)}")
+                if attempt < VIDEO_ATTEMPTS:
+                    self.driver.get(self.base_url)
+                    self._share_dialog_open = False
+                continue
+            try:
+                completion = self._await_share()
+            except Exception as e:
+                VIDEO_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome='failure')
+                _settle_after_share(index, video, e)
+                report(video['status'], current=index, total=total)
+                return False
+            self._record_shared(index, video, completion, started)
+            report('shared', current=index, total=total)
+            return True
+        video['status'] = 'failed'
+        return False
+
+    def _upload_pipelined(self, videos, user_input_text, report, on_shared, username, on_unconfirmed=None):
+        """
+        動画ごとに新しいタブを開き、前の動画のシェア処理の完了を待たずに次の動画の転送と編集を進める
+
+        ログイン状態（Cookie）はタブ間で共有される。シェアを押した後の動画は最大max_in_flight件まで同時に処理中にし、
+        古いものから完了を確認する。シェアを押す前に失敗した動画は新しいタブで再試行し、再試行も失敗した場合や、
+        シェアを押した後に失敗した場合（再試行すると重複して投稿される可能性がある）は以降の動画を始めない
+
+        :param videos: 動画ごとの結果の辞書のリスト（statusを更新する）
+        """
+        total = len(videos)
+        primary = self.driver.current_window_handle
+        pending = deque(i for i, video in enumerate(videos, 1) if video['status'] == 'pending')
+        in_flight = deque()
+        attempts = {}
+        started_any = False
+
+        def notify(state, index):
+            report(state, current=index, total=total, videos=[video['status'] for video in videos])
+
+        def give_up_or_retry(index, error):
+            video = videos[index - 1]
+            video['error'] = str(error)
+            logger.error(f"{index}つ目の動画アップロードに失敗しました: {str(error)}")
+            if attempts[index] < VIDEO_ATTEMPTS:
+                video['status'] = 'pending'
+                pending.appendleft(index)
+            else:
+                video['status'] = 'failed'
+                pending.clear()
+                notify('failed', index)
+
+        while pending or in_flight:
+            if pending and len(in_flight) < self.max_in_flight:
+                index = pending.popleft()
+                video = videos[index - 1]
+                attempts[index] = attempts.get(index, 0) + 1
+                if started_any:
+                    self.wait_policy.pace('between_videos')
+                started_any = True
+                logger.info("%dつ目の動画アップロードを新しいタブで開始します (%d/%d回目, 処理中: %d件)",
+                            index, attempts[index], VIDEO_ATTEMPTS, len(in_flight))
+                video['status'] = 'uploading'
+                _begin_attempt(video)
+                notify('uploading', index)
+                started = time.monotonic()
+                handle = self._open_tab()
+                try:
+                    self._start_video(video['path'], user_input_text)
+                except Exception as e:
+                    VIDEO_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome='failure')
+                    self._close_tab(handle, primary)
+                    give_up_or_retry(index, e)
+                    continue
+                video['status'] = 'processing'
+                notify('processing', index)
+                in_flight.append((index, handle, started))
+                continue
+
+            # 処理中の動画が上限に達したか、残りが無い場合は、最も古い動画の完了を待つ
+            index, handle, started = in_flight.popleft()
+            video = videos[index - 1]
+            self.driver.switch_to.window(handle)
+            try:
+                completion = self._await_share(tab=handle)
+            except Exception as e:
+                VIDEO_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome='failure')
+                _settle_after_share(index, video, e)
+                pending.clear()
+                notify(video['status'], index)
+                if video['status'] == 'unconfirmed' and on_unconfirmed:
+                    on_unconfirmed(index, video['path'])
+            else:
+                self._record_shared(index, video, completion, started)
+                notify('shared', index)
+                if on_shared:
+                    on_shared(index, video['path'])
+                self._save_session(username)
+            finally:
+                self._close_tab(handle, primary)
+
+    def _open_tab(self):
+        """ログイン済みのブラウザで新しいタブを開き、ホーム画面を表示する"""
+        self.driver.switch_to.new_window('tab')
+        if self.profile is not None:
+            self.profile.apply(self.driver)
+        self.driver.get(self.base_url)
+        return self.driver.current_window_handle
+
+    def _close_tab(self, handle, primary):
+        try:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        except Exception as e:
+            logger.warning(f"タブを閉じられませんでした: {str(e)}")
+        self.driver.switch_to.window(primary)
+        self._share_dialog_open = False
+
+    def _record_shared(self, index, video, completion, started):
+        """シェアが完了した動画の結果とメトリクスを記録する"""
+        VIDEO_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome='success')
+        # ネットワークイベントで転送量が分からなかった場合はファイルサイズで代用する
+        bytes_uploaded = completion['bytes_uploaded'] or os.path.getsize(video['path'])
+        UPLOADED_BYTES.inc(bytes_uploaded)
+        video.update(status='shared', error=None, bytes_uploaded=bytes_uploaded,
+                     server_seconds=completion['server_seconds'], finished_at=time.time())
+        logger.info("%dつ目の動画アップロードが完了しました (%sバイト)", index, bytes_uploaded)
+
+    def _record_history(self, videos, username, caption, slot, run_id, error=None):
+        """
+        今回アップロードを試みた動画の結果を投稿履歴に記録する（記録に失敗しても投稿処理は続ける）
+
+        変換した動画でも動画カタログと突き合わせられるよう、動画フォルダの元のファイルのパスと内容ハッシュを記録する
+        """
+        if self.history is None:
+            return
+        entries = []
+        for video in videos:
+            if not video.get('attempts'):
+                continue
+            video_hash = video['source_hash']
+            if video_hash is None:
+                try:
+                    video_hash = content_hash(video['source'], os.path.getsize(video['source']))
+                except OSError:
+                    video_hash = None
+            outcome = video['status'] if video['status'] in ('shared', 'unconfirmed') else 'failed'
+            entries.append({
+                'account': username,
+                'video_path': video['source'],
+                'video_hash': video_hash,
+                'caption': caption,
+                'slot': slot,
+                'run_id': run_id,
+                'outcome': outcome,
+                'error': None if outcome == 'shared' else video['error'] or error,
+                'attempts': video['attempts'],
+                'started_at': video['started_at'],
+                'finished_at': video.get('finished_at'),
+                'bytes_uploaded': video.get('bytes_uploaded'),
+                'server_seconds': video.get('server_seconds'),
+            })
+        try:
+            self.history.record(entries)
+        except Exception as e:
+            logger.error(f"投稿履歴の記録中にエラーが発生しました: {str(e)}")
 
     def _restore_session(self, session_data):
         """
-        保存されたセッション情報を復元
+        保存されたセッション情報を復元し、ログイン状態を確認
         
         :param session_data: 復元するセッションデータ
+        :return: ログイン状態が確認できた場合はTrue、それ以外はFalse
         """
         logger.info("保存されたセッション情報を復元します")
-        self.driver.get('https://www.instagram.com')
+        # CDPで全てのCookieを一括設定するため、事前にページを開く必要はない
+        cookies = []
         for cookie in session_data['cookies']:
-            self.driver.add_cookie(cookie)
-        self.driver.refresh()
+            cdp_cookie = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite') if key in cookie}
+            if 'expiry' in cookie:
+                cdp_cookie['expires'] = cookie['expiry']
+            cookies.append(cdp_cookie)
+        self.driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+        self.driver.get(self.base_url)
+
+        # 新規投稿アイコンかログインフォームのどちらかが表示されるまで待つ
+        try:
+            self.wait_policy.until(self.driver, 'session_check', EC.any_of(
+                EC.presence_of_element_located((By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]')),
+                EC.presence_of_element_located((By.NAME, "username"))
+            ))
+        except TimeoutException:
+            logger.warning("セッションの有効性を確認できませんでした")
+            return False
+
+        if not self.driver.find_elements(By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]'):
+            logger.info("保存されたセッションは無効になっていました")
+            return False
         logger.info("セッション情報が正常に復元されました")
+        return True
 
     def _login(self, username, password):
         """
@@ -84,23 +390,22 @@ class InstagramUploader:
         :param username: ユーザー名
         :param password: パスワード
         """
-        logger.info(f"ユーザー {username} のログインを開始します")
-        self.driver.get('https://www.instagram.com/accounts/login/')
-        
-        wait = WebDriverWait(self.driver, 10)
+        logger.info("ユーザー %s のログインを開始します", username)
+        self.driver.get(f'{self.base_url}/accounts/login/')
         
-        username_input = wait.until(EC.presence_of_element_located((By.NAME, "username")))
+        username_input = self.wait_policy.until(self.driver, 'login_form', EC.presence_of_element_located((By.NAME, "username")))
         username_input.send_keys(username)
         logger.info("ユーザー名を入力しました")
 
-        password_input = wait.until(EC.presence_of_element_located((By.NAME, "password")))
+        password_input = self.wait_policy.until(self.driver, 'login_form', EC.presence_of_element_located((By.NAME, "password")))
         password_input.send_keys(password)
         password_input.submit()
         logger.info("パスワードを入力し、ログインを試みました")
         
         # ログイン成功の確認
         try:
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]')))
+            self.wait_policy.until(self.driver, 'login_result',
+                                   EC.presence_of_element_located((By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]')))
             logger.info("ログインに成功しました")
         except TimeoutException:
             logger.error("ログインに失敗しました")
@@ -113,139 +418,232 @@ class InstagramUploader:
         :return: セッションデータ（辞書形式）
         """
         cookies = self.driver.get_cookies()
-        expiry = time.time() + 3600 * 24  # 24時間後に有効期限切れ
+        # ログインセッションのCookieの有効期限を優先し、無ければ最も早く切れるCookieに合わせる
+        session_cookie = next((c for c in cookies if c['name'] == 'sessionid' and 'expiry' in c), None)
+        if session_cookie:
+            expiry = session_cookie['expiry']
+        else:
+            expiries = [c['expiry'] for c in cookies if 'expiry' in c]
+            expiry = min(expiries) if expiries else time.time() + 3600 * 24  # 24時間後に有効期限切れ
         return {
             'cookies': cookies,
             'expiry': expiry
         }
 
+    def _save_session(self, username):
+        """現在のCookieをセッションとして保存する（失敗しても投稿処理は続行する）"""
+        try:
+            get_session_manager().save_session(username, self._get_current_session())
+        except Exception as e:
+            logger.warning(f"セッションの保存に失敗しました: {str(e)}")
+
     def _upload_single_video(self, video_path, user_input_text):
         """
-        単一の動画をアップロード
+        単一の動画をアップロードし、シェアの完了を待つ
         
         :param video_path: アップロードする動画のパス
         :param user_input_text: 投稿のキャプション
+        :return: {'source': 'network'|'dom', 'bytes_uploaded', 'upload_seconds', 'server_seconds'}
+                 画面表示で完了を確認した場合、転送量は0、時間はNone
         """
-        logger.info(f"動画のアップロードを開始します: {video_path}")
-        
-        wait = WebDriverWait(self.driver, 10)
+        self._start_video(video_path, user_input_text)
+        return self._await_share()
 
-        self.random_wait()  # UIの読み込みを待つ
+    def _start_video(self, video_path, user_input_text):
+        """
+        現在のタブで動画を選択・編集し、「シェア」ボタンを押すところまで進める
 
-        # 「後で」ボタンを探してクリック
-        try:
-            later_button = WebDriverWait(self.driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, '//button[contains(@class, "_a9--") and contains(@class, "ap36") and contains(@class, "a9_1") and contains(text(), "後で")]'))
-            )
-            later_button.click()
-            logger.info("「後で」ボタンをクリックしました")
-        except TimeoutException:
+        :param video_path: アップロードする動画のパス
+        :param user_input_text: 投稿のキャプション
+        """
+        logger.info("動画のアップロードを開始します: %s", video_path)
+        if self._share_dialog_open:
+            self._close_share_dialog()
+
+        # 「後で」ダイアログと新規投稿ボタンを同時に探し、ダイアログが無ければ待たずに進む
+        found = self._wait_for('later', ['later_button', 'new_post'])
+        if 'later_button' in found:
+            try:
+                found['later_button'].click()
+                logger.info("「後で」ボタンをクリックしました")
+            except Exception as e:
+                logger.error(f"「後で」ボタンのクリック中にエラーが発生しました: {str(e)}")
+            found = self._wait_for('new_post', ['new_post'])
+        else:
             logger.info("「後で」ボタンが見つかりませんでした。処理を続行します。")
-        except Exception as e:
-            logger.error(f"「後で」ボタンのクリック中にエラーが発生しました: {str(e)}")
 
-        self.random_wait()  # UIの読み込みを待つ
-        
         # 新規投稿ボタンをクリック
-        new_post_btn = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]')))
-        new_post_btn.click()
+        found['new_post'].click()
         logger.info("新規投稿ボタンをクリックしました")
 
-        self.random_wait()  # UIの読み込みを待つ
-
-        # 投稿ボタンを探してクリック
+        # 投稿メニューが表示された場合はクリックし、直接ファイル選択になった場合はそのまま進む
         try:
-            post_button = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, '//div[contains(@class, "x9f619") and contains(@class, "xjbqb8w")]//span[contains(text(), "Post") or contains(text(), "投稿")]'))
-            )
-            post_button.click()
-            logger.info("投稿ボタンをクリックしました")
+            found = self._wait_for('post_menu', ['post_menu', 'file_input'])
+            if 'post_menu' in found:
+                found['post_menu'].click()
+                logger.info("投稿ボタンをクリックしました")
         except TimeoutException:
             logger.warning("投稿ボタンが見つかりませんでした。処理を続行します。")
         except Exception as e:
             logger.error(f"投稿ボタンのクリック中にエラーが発生しました: {str(e)}")
 
-        self.random_wait()  # UIの読み込みを待つ
-
         # ファイルをアップロード
         absolute_file_path = os.path.abspath(video_path)
-        logger.info(f"ファイルをアップロードします: {absolute_file_path}")
-        file_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'input[type="file"]._ac69')))
-        file_input.send_keys(absolute_file_path)
-
-        self.random_wait()  # ファイルのアップロードを待つ
+        logger.info("ファイルをアップロードします: %s", absolute_file_path)
+        file_input = self._wait_for('file_input', ['file_input'])['file_input']
+        self.network.start(tab=self._current_tab())
+        with UPLOAD_STEP_SECONDS.time(step='file_send'):
+            file_input.send_keys(absolute_file_path)
 
-        # 次へボタンをクリック
+        # 次へボタンをクリック（ファイルの読み込みが終わると表示される。無い場合はトリミング画面に進む）
         try:
-            button_element = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button._acan._acap._acaq._acas._acav._aj1-[type="button"]')))
-            button_element.click()
-            logger.info("「次へ」ボタンをクリックしました")
-        except (TimeoutException, NoSuchElementException):
+            found = self._wait_for('upload_next', ['upload_next', 'crop'], timeout=30)
+            if 'upload_next' in found:
+                found['upload_next'].click()
+                logger.info("「次へ」ボタンをクリックしました")
+        except TimeoutException:
             logger.warning("「次へ」ボタンが見つからないか、クリックできませんでした。この手順をスキップします。")
 
-        self.random_wait()  # 次の画面の読み込みを待つ
-
-        # トリミングオプションを選択
-        crop_selector = "div.x9f619.xjbqb8w.x78zum5.x168nmei.x13lgxp2.x5pf9jr.xo71vjh.x1y1aw1k.x1sxyh0.xwib8y2.xurb0ha.x1n2onr6.x1plvlek.xryxfnj.x1c4vz4f.x2lah0s.x1q0g3np.xqjyukv.x6s0dn4.x1oa3qoh.xl56j7k svg[aria-label='切り取りを選択']"
-        div_element = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, crop_selector)))
-        div_element.click()
-        logger.info("トリミングオプションを選択しました")
-
-        self.random_wait()  # トリミングオプションの適用を待つ
-
-        # 縦型トリミングを選択
-        vertical_crop_selector = "div.x9f619.xjbqb8w.x78zum5.x168nmei.x13lgxp2.x5pf9jr.xo71vjh.xz9dl7a.xn6708d.xsag5q8.x1ye3gou.x1n2onr6.x1plvlek.xryxfnj.x1c4vz4f.x2lah0s.xdt5ytf.xqjyukv.x1qjc9v5.x1oa3qoh.x1nhvcw1 svg[aria-label='縦型トリミングアイコン']"
-        div_element = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, vertical_crop_selector)))
-        div_element.click()
-        logger.info("縦型トリミングを選択しました")
+        # トリミングオプションを選択し、縦型トリミングを選ぶ
+        try:
+            self._wait_for('crop', ['crop'], timeout=30)['crop'].click()
+            logger.info("トリミングオプションを選択しました")
+            self._wait_for('vertical_crop', ['vertical_crop'])['vertical_crop'].click()
+            logger.info("縦型トリミングを選択しました")
+        except TimeoutException:
+            logger.warning("トリミングのボタンが見つかりませんでした。元の比率のまま処理を続行します。")
 
-        # 「次へ」ボタンを2回クリック
+        # 「次へ」ボタンを2回クリック（クリック後、ボタンが画面遷移で置き換わるのを待つ）
         for _ in range(2):
-            self.random_wait()  # UIの更新を待つ
-            next_button = wait.until(EC.presence_of_element_located((By.XPATH, '//div[text()="次へ"]')))
+            next_button = self._wait_for('next', ['next'])['next']
             next_button.click()
             logger.info("「次へ」ボタンをクリックしました")
-
-        self.random_wait()  # 最終画面の読み込みを待つ
+            self.wait_policy.until(self.driver, 'next_transition', EC.staleness_of(next_button))
 
         # キャプションを入力
-        caption_area = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div[aria-label="キャプションを入力…"]')))
+        caption_area = self._wait_for('caption', ['caption'])['caption']
         caption_text = f'{user_input_text}'
-        caption_area.send_keys(caption_text)
-        logger.info("キャプションを入力しました")
-
-        self.random_wait()  # キャプションの入力を待つ
+        with UPLOAD_STEP_SECONDS.time(step='caption_input'):
+            method = self._input_caption(caption_area, caption_text)
+        CAPTION_INPUTS.inc(method=method)
+        logger.info("キャプションを入力しました (%d文字, %s)", len(caption_text), method)
 
         # 共有ボタンをクリック
-        share_button = wait.until(EC.presence_of_element_located((By.XPATH, '//div[text()="シェア"]')))
+        share_button = self._wait_for('share', ['share'])['share']
         share_button.click()
         logger.info("「シェア」ボタンをクリックしました")
 
+    def _input_caption(self, caption_area, text):
+        """
+        キャプションを一括で挿入し、入力欄の内容を読み戻して確認する。一致しない場合は1文字ずつ入力し直す
+
+        CDPのInput.insertTextはIMEの確定入力と同じ扱いになるため、日本語や絵文字もエディタにそのまま反映される
+
+        :param caption_area: キャプションの入力欄
+        :param text: キャプション
+        :return: 使用した入力方法（'insert_text' / 'send_keys'）
+        """
         try:
-            self.random_wait(30, 60)  # 投稿完了を待つ時間を長めに設定
-            element = WebDriverWait(self.driver, 180).until(
-                EC.presence_of_element_located((By.XPATH, '//div[text()="リール動画がシェアされました"]'))
-            )
-            logger.info("リール動画が正常にシェアされました")
+            caption_area.click()
+            self.driver.execute_cdp_cmd('Input.insertText', {'text': text})
+            if self._caption_matches(caption_area, text):
+                return 'insert_text'
+            logger.warning("一括入力したキャプションが一致しないため、1文字ずつ入力し直します")
+        except Exception as e:
+            logger.warning(f"キャプションを一括入力できませんでした。1文字ずつ入力します: {str(e)}")
 
-            # ページをリロード
-            logger.info("ページをリロードします")
-            self.driver.refresh()
-            
-            # リロード後のページ読み込み完了を待機
-            WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            logger.info("ページのリロードが完了しました")
+        caption_area.send_keys(Keys.CONTROL, 'a')
+        caption_area.send_keys(Keys.DELETE)
+        caption_area.send_keys(text)
+        return 'send_keys'
+
+    def _caption_matches(self, caption_area, text):
+        # エディタは改行を段落に変換するため、空白の違いは無視して比べる
+        entered = self.driver.execute_script('return arguments[0].innerText;', caption_area) or ''
+        return ' '.join(entered.split()) == ' '.join(text.split())
+
+    def _await_share(self, tab=None):
+        """
+        現在のタブでシェアの完了を待つ
+
+        投稿の確定リクエストの応答を完了とみなし、ネットワークイベントが取れない場合は画面表示で確認する
 
+        :param tab: 並行処理中のタブのウィンドウハンドル。そのタブのネットワークイベントだけを見る
+        :return: _upload_single_videoと同じ形式の完了情報
+        """
+        try:
+            completion = self.wait_policy.until(
+                self.driver, 'share_confirm', lambda driver: self._share_completed(driver, tab), timeout=180
+            )
         except TimeoutException:
-            logger.error("リール動画がシェアされましたの要素が3分以内に見つかりませんでした")
+            logger.error("リール動画のシェア完了を3分以内に確認できませんでした")
             raise
+        self._share_dialog_open = True
+        SHARE_CONFIRMATIONS.inc(source=completion['source'])
+        if completion['server_seconds'] is not None:
+            SHARE_SERVER_SECONDS.observe(completion['server_seconds'])
+            logger.info("リール動画が正常にシェアされました (サーバー応答: %.2f秒)", completion['server_seconds'])
+        else:
+            logger.info("リール動画が正常にシェアされました")
+        return completion
+
+    def _share_completed(self, driver, tab=None):
+        """シェア完了の待機条件。完了していれば完了情報を、未完了ならFalseを返す"""
+        completion = self.network.poll(tab=tab)
+        if completion:
+            return dict(completion, source='network')
+        if 'share_done' in self.selectors.probe(driver, ['share_done']):
+            return {'source': 'dom', 'bytes_uploaded': 0, 'upload_seconds': None, 'server_seconds': None}
+        return False
+
+    def _close_share_dialog(self):
+        """前の動画のシェア完了ダイアログを閉じる。閉じるボタンが無い場合はページを開き直す"""
+        self._share_dialog_open = False
+        found = self.selectors.probe(self.driver, ['close_dialog'])
+        if 'close_dialog' in found:
+            try:
+                found['close_dialog'].click()
+                logger.info("シェア完了のダイアログを閉じました")
+                return
+            except Exception as e:
+                logger.warning(f"ダイアログを閉じられませんでした: {str(e)}")
+        logger.info("ページを開き直します")
+        with UPLOAD_STEP_SECONDS.time(step='reload'):
+            self.driver.get(self.base_url)
+
+    def _current_tab(self):
+        # 並行処理ではタブごとにイベントを区別し、1つのタブだけを使う場合は全てのイベントを見る
+        return self.driver.current_window_handle if self.max_in_flight > 1 else None
+
+    def _wait_for(self, step, names, required=None, timeout=None):
+        """
+        セレクタ候補をまとめて評価し、いずれかが見つかるまで待機する
+
+        :param step: WaitPolicyのステップ名
+        :param names: 調べるターゲット名のリスト
+        :param required: このいずれかが見つかった時点で待機を終える。省略時はnamesのいずれか
+        :param timeout: タイムアウト（秒）
+        :return: 見つかったターゲット名から要素への辞書
+        """
+        return self.wait_policy.until(self.driver, step, self.selectors.wait_for(names, required), timeout=timeout)
+
+def _begin_attempt(video):
+    """動画のアップロードの試行回数と、最初に試行を始めた時刻を記録する"""
+    video['attempts'] = video.get('attempts', 0) + 1
+    video.setdefault('started_at', time.time())
+
+
+def _settle_after_share(index, video, error):
+    """
+    「シェア」ボタンを押した後に失敗した動画の結果を確定する（再試行はしない）
+
+    サーバーが投稿を拒否した場合は失敗、完了を確認できなかった場合は投稿されている可能性があるため結果不明とする
+    """
+    video['status'] = 'failed' if isinstance(error, ShareFailed) else 'unconfirmed'
+    video['error'] = str(error)
+    video['finished_at'] = time.time()
+    logger.error(f"{index}つ目の動画は「シェア」ボタンを押した後に失敗したため、再試行しません "
+                 f"(status={video['status']}): {str(error)}")
 
-    def random_wait(self, min_time=10, max_time=30):
-        """指定された範囲内でランダムな秒数待機する"""
-        wait_time = random.uniform(min_time, max_time)
-        logger.info(f"{wait_time:.2f}秒間待機します")
-        time.sleep(wait_time)
 
 # インスタンスの作成部分は削除し、必要に応じて他のファイルで作成するように変更
\ No newline at end of file
@@ -0,0 +1,251 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logger import setup_logger
+
+logger = setup_logger('job_manager', 'logs/job_manager.log')
+
+# メモリとJobStoreに保持する完了済みジョブの上限
+MAX_FINISHED_JOBS = 100
+# 他のプロセスが実行しているジョブの変更を確認する間隔（秒）
+STORED_JOB_POLL_INTERVAL = 0.5
+
+
+def summarize_results(accounts, results):
+    """
+    アカウントごとの投稿結果を /upload の応答形式にまとめる
+
+    :param accounts: 投稿先として指定されたユーザー名のリスト
+    :param results: UploadPool.post_accounts の戻り値
+    :return: (応答の辞書, HTTPステータスコード)
+    """
+    success_count = sum(1 for account in accounts if results[account]['status'] == 'success')
+    error_messages = [result['error'] for result in results.values() if result['error']]
+
+    if success_count == len(accounts):
+        message = f'全ての選択されたアカウント ({success_count}個) に3つずつ動画をアップロードしました'
+        logger.info(message)
+        return {'message': message}, 200
+    elif success_count > 0:
+        message = f'{success_count}個のアカウントに3つずつ動画をアップロードしました。エラー: {"; ".join(error_messages)}'
+        logger.warning(message)
+        return {'message': message}, 207
+    else:
+        message = f'動画のアップロードに失敗しました。エラー: {"; ".join(error_messages)}'
+        logger.error(message)
+        return {'error': message}, 500
+
+
+class Job:
+    """アップロードジョブの状態。進捗が更新されるたびにversionが増える"""
+
+    def __init__(self, accounts, caption, on_change=None):
+        """
+        :param accounts: 投稿先のユーザー名のリスト
+        :param caption: 投稿のキャプション
+        :param on_change: 状態が変わるたびにto_dict()の値で呼び出す関数（JobStoreへの保存に使う）
+        """
+        self.id = uuid.uuid4().hex
+        self.accounts = list(accounts)
+        self.caption = caption
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = {account: {'state': 'queued'} for account in self.accounts}
+        self.result = None
+        self.status_code = None
+        self.version = 0
+        self.changed = threading.Condition()
+        self.on_change = on_change
+
+    def update(self, **fields):
+        with self.changed:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.version += 1
+            self.changed.notify_all()
+        self._notify()
+
+    def report(self, account, state, **details):
+        """アカウントごとの進捗を更新する（UploadPoolから呼ばれる）"""
+        with self.changed:
+            self.progress[account] = dict(details, state=state)
+            self.version += 1
+            self.changed.notify_all()
+        self._notify()
+
+    def _notify(self):
+        if self.on_change is not None:
+            try:
+                self.on_change(self.to_dict())
+            except Exception as e:
+                logger.error(f"ジョブ {self.id} の状態の保存に失敗しました: {str(e)}")
+
+    def wait_for_change(self, version, timeout):
+        """versionより新しい状態になるか、タイムアウトするまで待つ"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version > version, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self.changed:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'accounts': self.accounts,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'progress': {account: dict(progress) for account, progress in self.progress.items()},
+                'result': self.result,
+                'status_code': self.status_code,
+                'version': self.version,
+            }
+
+
+class StoredJob:
+    """
+    別のプロセス（Webのワーカー）が実行しているジョブ。状態はJobStoreから読み込む
+
+    Jobと同じto_dict・wait_for_changeを持つため、状態の取得とSSEの配信は実行しているワーカーに関係なく行える
+    """
+
+    def __init__(self, store, state):
+        self.store = store
+        self.id = state['job_id']
+        self._state = state
+
+    def to_dict(self):
+        self._state = self.store.load(self.id) or self._state
+        return self._state
+
+    def wait_for_change(self, version, timeout):
+        """versionより新しい状態になるか、タイムアウトするまでJobStoreを確認する"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.to_dict()['version']
+            remaining = deadline - time.monotonic()
+            if current > version or remaining <= 0:
+                return current
+            time.sleep(min(STORED_JOB_POLL_INTERVAL, remaining))
+
+
+class JobStore:
+    """ジョブの状態をSQLiteに保存し、どのプロセスからでも参照できるようにする"""
+
+    def __init__(self, db_path='jobs.db'):
+        """
+        :param db_path: ジョブを保存するSQLiteファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+        ''')
+        self._conn.commit()
+        logger.info(f"JobStoreが初期化されました: {db_path}")
+
+    def save(self, state):
+        """ジョブの状態を保存する。保存済みのものより古いversionの状態は無視する"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO jobs (id, status, version, state, created_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    status = excluded.status, version = excluded.version, state = excluded.state
+                WHERE excluded.version > jobs.version
+            ''', (state['job_id'], state['status'], state['version'], json.dumps(state, ensure_ascii=False),
+                  state['created_at']))
+
+    def load(self, job_id):
+        """:return: Job.to_dictと同じ形式の状態。見つからない場合はNone"""
+        with self._lock:
+            row = self._conn.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune(self, keep_finished=MAX_FINISHED_JOBS):
+        """完了済みのジョブを新しいものからkeep_finished件だけ残して削除する"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                DELETE FROM jobs WHERE status = 'finished' AND id NOT IN (
+                    SELECT id FROM jobs WHERE status = 'finished' ORDER BY created_at DESC LIMIT ?
+                )
+            ''', (keep_finished,))
+
+
+class JobManager:
+    """
+    /upload のジョブを受け付け、バックグラウンドで UploadPool に実行させる
+
+    ジョブの状態はJobStoreにも保存するため、ジョブを受け付けたものとは別のWebワーカーからも状態を取得できる
+    """
+
+    def __init__(self, upload_pool, max_concurrent_jobs=2, store=None):
+        """
+        :param upload_pool: 投稿処理を行うUploadPool
+        :param max_concurrent_jobs: 同時に実行するジョブ数の上限
+        :param store: ジョブの状態を保存するJobStore。省略時は既定の設定で作成する
+        """
+        self.upload_pool = upload_pool
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info(f"JobManagerが初期化されました: max_concurrent_jobs={max_concurrent_jobs}")
+
+    def submit(self, accounts, caption):
+        """
+        アップロードジョブを登録し、すぐにジョブを返す
+
+        :param accounts: 投稿先のユーザー名のリスト
+        :param caption: 投稿のキャプション
+        :return: 登録されたJob
+        """
+        job = Job(accounts, caption, on_change=self.store.save)
+        self.store.save(job.to_dict())
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self.store.prune()
+        self._executor.submit(self._run, job)
+        logger.info(f"ジョブ {job.id} を登録しました: アカウント数 {len(job.accounts)}")
+        return job
+
+    def get(self, job_id):
+        """
+        :return: このプロセスで実行しているJob、別のプロセスのジョブであればStoredJob。見つからない場合はNone
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        state = self.store.load(job_id)
+        return StoredJob(self.store, state) if state else None
+
+    def _run(self, job):
+        job.update(status='running')
+        try:
+            results = self.upload_pool.post_accounts(job.accounts, job.caption, check_post_flag=True, progress=job.report,
+                                                     run_id=job.id)
+            result, status_code = summarize_results(job.accounts, results)
+        except Exception as e:
+            logger.exception(f"ジョブ {job.id} の実行中にエラーが発生しました: {str(e)}")
+            result, status_code = {'error': f'動画のアップロードに失敗しました。エラー: {str(e)}'}, 500
+        job.update(status='finished', result=result, status_code=status_code, finished_at=time.time())
+        logger.info(f"ジョブ {job.id} が完了しました: status_code={status_code}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status == 'finished']
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
@@ -0,0 +1,27 @@
+import functools
+import threading
+
+
+def lazy_instance(factory):
+    """
+    初めて呼ばれた時にfactoryでインスタンスを作成し、以降は同じインスタンスを返す関数にする
+
+    モジュールの読み込み時にはインスタンスを作らないため、ファイルの作成やライブラリの読み込みは実際に使われるまで行われない。
+    作成済みかどうかは is_created() で調べられる
+
+    :param factory: 引数無しでインスタンスを作成する関数
+    :return: インスタンスを返す関数
+    """
+    lock = threading.Lock()
+    instances = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instances:
+            with lock:
+                if not instances:
+                    instances.append(factory())
+        return instances[0]
+
+    get.is_created = lambda: bool(instances)
+    return get
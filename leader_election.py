@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from logger import setup_logger
+import metrics
+
+logger = setup_logger('leader_election', 'logs/leader_election.log')
+
+# リーダーのリース期間（秒）。リーダーのプロセスが停止して延長されなくなると、この時間の後に他のプロセスが引き継ぐ
+LEASE_SECONDS = 30
+# アカウントのロックのリース期間（秒）。保持している間は1/3の間隔で延長する
+ACCOUNT_LOCK_SECONDS = 120
+
+LEADER_CHANGES_TOTAL = metrics.counter('leader_changes_total', 'このプロセスがリーダーになった・リーダーでなくなった回数')
+
+
+class LeaderLease:
+    """SQLiteのリース行を使い、同じ名前のリースを持てるプロセスを1つに限定する"""
+
+    def __init__(self, name, db_path='post_queue.db', lease_seconds=LEASE_SECONDS):
+        """
+        :param name: リースの名前（例: 'scheduler'）
+        :param db_path: リースを保存するSQLiteファイルのパス（リーダーを争う全てのプロセスで同じファイルを使う）
+        :param lease_seconds: リース期間（秒）
+        """
+        self.name = name
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                acquired_at REAL NOT NULL,
+                info TEXT
+            );
+        ''')
+        self._conn.commit()
+        logger.info(f"LeaderLeaseが初期化されました: name={name}, owner={self.owner}, db_path={db_path}")
+
+    def acquire(self, info=None):
+        """
+        リースを取得する。自分が持っている場合は延長し、他のプロセスのリースが切れている場合は引き継ぐ
+
+        :param info: リースと一緒に保存する情報（JSONに変換できる値）
+        :return: リースを持っている場合はTrue
+        """
+        return self._acquire(self.name, info)
+
+    def release(self):
+        """リースを持っていれば手放し、他のプロセスがすぐに引き継げるようにする"""
+        if self._release(self.name):
+            logger.info(f"リース {self.name} を解放しました")
+
+    def _acquire(self, name, info=None):
+        now = time.time()
+        with self._lock, self._conn:
+            # 1つのUPSERT文で判定と書き込みを行うため、複数のプロセスが同時に取得することはない
+            cursor = self._conn.execute('''
+                INSERT INTO leases (name, owner, expires_at, acquired_at, info) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    owner = excluded.owner,
+                    expires_at = excluded.expires_at,
+                    acquired_at = CASE WHEN leases.owner = excluded.owner THEN leases.acquired_at ELSE excluded.acquired_at END,
+                    info = excluded.info
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            ''', (name, self.owner, now + self.lease_seconds, now, json.dumps(info, default=str), now))
+        return cursor.rowcount == 1
+
+    def _release(self, name):
+        with self._lock, self._conn:
+            cursor = self._conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, self.owner))
+        return cursor.rowcount == 1
+
+    def holder(self):
+        """
+        :return: 有効なリースの {'owner', 'expires_at', 'acquired_at', 'info'}。リーダーがいない場合はNone
+        """
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT owner, expires_at, acquired_at, info FROM leases WHERE name = ? AND expires_at >= ?
+            ''', (self.name, time.time())).fetchone()
+        if not row:
+            return None
+        return {'owner': row[0], 'expires_at': row[1], 'acquired_at': row[2], 'info': json.loads(row[3] or 'null')}
+
+
+
+class AccountLocks:
+    """
+    アカウントごとのリース行（名前は 'account:<ユーザー名>'）で、同じアカウントを操作するプロセスを1つに限定する
+
+    Webのワーカーとscheduler_service.pyが同じアカウントに同時にログイン・投稿しないようにする。
+    保持しているロックはバックグラウンドのスレッドで延長し、プロセスが停止した場合はリース期間の後に他のプロセスが取得できる
+    """
+
+    def __init__(self, db_path='post_queue.db', lease_seconds=ACCOUNT_LOCK_SECONDS):
+        """
+        :param db_path: リースを保存するSQLiteファイルのパス（全てのプロセスで同じファイルを使う）
+        :param lease_seconds: リース期間（秒）
+        """
+        self._lease = LeaderLease('account', db_path, lease_seconds)
+        self._held = set()
+        self._lock = threading.Lock()
+        self._renewer = None
+
+    def acquire(self, account):
+        """
+        :return: ロックを取得した場合はTrue。他のプロセスが有効なロックを持っている場合はFalse
+        """
+        if not self._lease._acquire(f'account:{account}', {'pid': os.getpid()}):
+            return False
+        with self._lock:
+            self._held.add(account)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, name='account-locks', daemon=True)
+                self._renewer.start()
+        return True
+
+    def release(self, account):
+        with self._lock:
+            self._held.discard(account)
+        self._lease._release(f'account:{account}')
+
+    def _renew(self):
+        while True:
+            time.sleep(self._lease.lease_seconds / 3)
+            with self._lock:
+                held = list(self._held)
+                if not held:
+                    self._renewer = None
+                    return
+            for account in held:
+                try:
+                    renewed = self._lease._acquire(f'account:{account}', {'pid': os.getpid()})
+                except sqlite3.Error as e:
+                    logger.error(f"アカウント {account} のロックの延長中にエラーが発生しました: {str(e)}")
+                    continue
+                if not renewed:
+                    logger.error(f"アカウント {account} のロックを他のプロセスに取得されました")
+
+class LeaderElection:
+    """
+    LeaderLeaseを定期的に取得・延長し、リーダーになった時と外れた時に処理を呼び出す
+
+    リーダーのプロセスが停止するとリースが切れ、待機している他のプロセスが自動的に引き継ぐ
+    """
+
+    def __init__(self, lease, on_elected, on_deposed, on_tick=None, info=None, interval=None):
+        """
+        :param lease: LeaderLease
+        :param on_elected: リーダーになった時に呼び出す関数
+        :param on_deposed: リーダーでなくなった時（停止時を含む）に呼び出す関数
+        :param on_tick: リーダーである間、リースを延長するたびに呼び出す関数
+        :param info: リースと一緒に保存する情報を返す関数
+        :param interval: リースの取得・延長の間隔（秒）。省略時はリース期間の1/3
+        """
+        self.lease = lease
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.on_tick = on_tick
+        self.info = info
+        self.interval = interval or lease.lease_seconds / 3
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f'leader-{self.lease.name}', daemon=True)
+            self._thread.start()
+            logger.info(f"リース {self.lease.name} のリーダー選出を開始しました")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            logger.info(f"リース {self.lease.name} のリーダー選出を停止しました")
+
+    def run_forever(self):
+        """現在のスレッドでリーダー選出を行う（stopが呼ばれるか割り込まれるまで戻らない）"""
+        self._stop.clear()
+        self._run()
+
+    def _run(self):
+        try:
+            self._elect()
+        finally:
+            # 停止時はリーダーを降り、他のプロセスがリース期間を待たずに引き継げるようにする
+            if self.is_leader:
+                self._change(False)
+                self.lease.release()
+
+    def _elect(self):
+        while not self._stop.is_set():
+            try:
+                acquired = self.lease.acquire(self.info() if self.info else None)
+            except sqlite3.Error as e:
+                # 延長できなかった場合はリースが切れている可能性があるため、リーダーを降りる
+                logger.error(f"リース {self.lease.name} の取得中にエラーが発生しました: {str(e)}")
+                acquired = False
+
+            if acquired and not self.is_leader:
+                self._change(True)
+            elif not acquired and self.is_leader:
+                logger.warning(f"リース {self.lease.name} を失いました")
+                self._change(False)
+
+            if self.is_leader and self.on_tick:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    logger.exception(f"リーダーの定期処理中にエラーが発生しました: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def _change(self, leader):
+        self.is_leader = leader
+        LEADER_CHANGES_TOTAL.inc(name=self.lease.name, event='elected' if leader else 'deposed')
+        logger.info(f"リース {self.lease.name} のリーダー{'になりました' if leader else 'ではなくなりました'}: {self.lease.owner}")
+        try:
+            (self.on_elected if leader else self.on_deposed)()
+        except Exception as e:
+            logger.exception(f"リーダーの切り替え処理中にエラーが発生しました: {str(e)}")
+            if leader:
+                # 処理を開始できなかった場合は、他のプロセスに引き継ぐ
+                self.is_leader = False
+                self.lease.release()
@@ -1,30 +1,213 @@
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+from contextlib import contextmanager
 
-def setup_logger(name, log_file, level=logging.INFO):
-    # ログディレクトリが存在しない場合は作成
-    log_dir = os.path.dirname(log_file)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+# ログファイルのローテーション設定（configure_loggingで変更できる）
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+# 構造化ログに出力するコンテキストの項目
+CONTEXT_FIELDS = ('account', 'job', 'step')
+
+_settings = {
+    'max_bytes': LOG_MAX_BYTES,
+    'backup_count': LOG_BACKUP_COUNT,
+    'when': None,
+    'json_format': False,
+    'process_name': None,
+}
+_context = contextvars.ContextVar('log_context', default={})
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_router = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON形式で出力するフォーマッター"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _ContextFilter(logging.Filter):
+    """log_contextで設定された項目をレコードに付与する（ログを出したスレッドで実行される）"""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class _RoutingHandler(logging.Handler):
+    """
+    リスナースレッドで、ロガー名に対応するファイルとコンソールにレコードを振り分ける
+
+    ログファイルはそのファイルに最初のレコードが書き込まれる時に作成する
+    """
+
+    def __init__(self):
+        super().__init__()
+        # ロガー名 -> ログファイルの絶対パス
+        self.routes = {}
+        # ログファイルの絶対パス -> ハンドラー（同じファイルに書き込むロガーはハンドラーを共有する）
+        self.files = {}
+        self.console = logging.StreamHandler()
+
+    def emit(self, record):
+        log_path = self.routes.get(record.name)
+        if log_path is not None:
+            handler = self.files.get(log_path) or self._open(log_path)
+            handler.handle(record)
+        self.console.handle(record)
+
+    def _open(self, log_path):
+        with _lock:
+            if log_path not in self.files:
+                # ログディレクトリが存在しない場合は作成
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                self.files[log_path] = _create_file_handler(_process_log_path(log_path))
+            return self.files[log_path]
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """最初のレコードをキューに入れる時にリスナースレッドを開始するQueueHandler"""
+
+    def enqueue(self, record):
+        if _listener is None:
+            _start_listener()
+        super().enqueue(record)
 
-    # フォーマッターの設定
-    formatter = logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s')
 
-    # ファイルハンドラーの設定
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
+def _formatter():
+    return JsonFormatter() if _settings['json_format'] else logging.Formatter(TEXT_FORMAT)
 
-    # コンソールハンドラーの設定
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
 
-    # ロガーの設定
+def _process_log_path(log_path):
+    """process_nameが設定されている場合は、ファイル名に付けて他のプロセスと別のファイルにする（logs/app.log -> logs/app.scheduler.log）"""
+    if not _settings['process_name']:
+        return log_path
+    base, ext = os.path.splitext(log_path)
+    return f"{base}.{_settings['process_name']}{ext}"
+
+
+def _create_file_handler(log_file):
+    if _settings['when']:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=_settings['when'], backupCount=_settings['backup_count'], encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=_settings['max_bytes'], backupCount=_settings['backup_count'], encoding='utf-8'
+        )
+    handler.setFormatter(_formatter())
+    return handler
+
+
+def _ensure_queue():
+    """キューと振り分け用のハンドラーを初回のみ作成する（_lockを取得して呼ぶこと）"""
+    global _queue_handler, _router
+    if _queue_handler is not None:
+        return
+    _router = _RoutingHandler()
+    _router.console.setFormatter(_formatter())
+    _queue_handler = _QueueHandler(queue.Queue(-1))
+    _queue_handler.addFilter(_ContextFilter())
+
+
+def _start_listener():
+    """リスナースレッドを初回のみ開始する（モジュールの読み込みだけではスレッドを作らない）"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        listener = logging.handlers.QueueListener(_queue_handler.queue, _router)
+        listener.start()
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+def configure_logging(max_bytes=None, backup_count=None, when=None, json_format=None, process_name=None):
+    """
+    ログ出力の設定を変更する。ローテーション設定とprocess_nameはこれ以降に作成されるログファイルに適用される
+
+    :param max_bytes: サイズによるローテーションの上限（バイト）
+    :param backup_count: 保持する過去ログファイルの数
+    :param when: 指定した場合は時間によるローテーションを行う（例: 'midnight'）
+    :param json_format: Trueの場合、1行1レコードのJSON形式で出力する
+    :param process_name: ログファイル名に付ける名前。同時に動く複数のプロセスが同じファイルをローテーションしないよう、
+                         Webサーバー以外のプロセスで指定する
+    """
+    with _lock:
+        if max_bytes is not None:
+            _settings['max_bytes'] = max_bytes
+        if backup_count is not None:
+            _settings['backup_count'] = backup_count
+        if when is not None:
+            _settings['when'] = when
+        if process_name is not None:
+            _settings['process_name'] = process_name
+        if json_format is not None:
+            _settings['json_format'] = json_format
+            if _router is not None:
+                for handler in [_router.console, *_router.files.values()]:
+                    handler.setFormatter(_formatter())
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    このブロック内で出力されるログにaccount/job/stepなどの項目を付与する
+
+    :param fields: 付与する項目
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def setup_logger(name, log_file, level=logging.INFO):
+    """
+    非同期に書き込むロガーを取得する。同じ名前で複数回呼ばれても同じロガーを返す
+
+    :param name: ロガー名
+    :param log_file: ログファイルのパス
+    :param level: ログレベル
+    :return: logging.Logger
+    """
     logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    with _lock:
+        _ensure_queue()
+        if name in _router.routes:
+            return logger
+
+        # ログファイルとリスナースレッドは最初のレコードが出力される時に作成する
+        _router.routes[name] = os.path.abspath(log_file)
+        logger.setLevel(level)
+        logger.addHandler(_queue_handler)
 
-    logger.info(f"ロガー '{name}' がセットアップされました。ログファイル: {log_file}")
+    logger.debug("ロガー '%s' がセットアップされました。ログファイル: %s", name, log_file)
 
     return logger
 
@@ -39,6 +222,6 @@ def set_log_level(logger, level):
 
     if level.upper() in level_map:
         logger.setLevel(level_map[level.upper()])
-        logger.info(f"ログレベルを {level.upper()} に設定しました")
+        logger.info("ログレベルを %s に設定しました", level.upper())
     else:
-        logger.warning(f"無効なログレベル: {level}。ログレベルは変更されません。")
\ No newline at end of file
+        logger.warning("無効なログレベル: %s。ログレベルは変更されません。", level)
@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ヒストグラムの既定のバケット（秒）。ブラウザ操作は数十ミリ秒から数十分までかかる
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """ラベルごとに増加するだけのカウンター"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """ラベルごとに観測値の分布（バケットごとの件数、合計、件数）を集計するヒストグラム"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """ブロックの所要時間を観測するコンテキストマネージャー"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def snapshot(self):
+        """ラベルごとの件数と合計を返す"""
+        with self._lock:
+            return {key: {'count': count, 'sum': total} for key, (_, total, count) in self._values.items()}
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {repr(float(total))}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class Registry:
+    """メトリクスを保持し、Prometheusのテキスト形式で出力するレジストリ"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _get_or_create(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+
+registry = Registry()
+
+
+def counter(name, help_text):
+    """既定のレジストリのカウンターを取得する（同じ名前では同じオブジェクトを返す）"""
+    return registry.counter(name, help_text)
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """既定のレジストリのヒストグラムを取得する（同じ名前では同じオブジェクトを返す）"""
+    return registry.histogram(name, help_text, buckets)
+
+
+def serve(port, host='127.0.0.1', target=None):
+    """
+    既定のレジストリを /metrics で公開するHTTPサーバーをバックグラウンドのスレッドで開始する
+
+    Flaskを使わないプロセス（scheduler_service.py）のメトリクスを収集するために使う
+
+    :param port: 待ち受けるポート番号
+    :param host: 待ち受けるアドレス
+    :param target: 公開するRegistry。省略時は既定のレジストリ
+    :return: 開始したThreadingHTTPServer（shutdownで停止する）
+    """
+    target = target or registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = target.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
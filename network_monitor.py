@@ -0,0 +1,139 @@
+import json
+from logger import setup_logger
+
+logger = setup_logger('network_monitor', 'logs/network_monitor.log')
+
+# 監視するリクエストのURLの一部。upload: 動画の転送, configure: 投稿の確定（シェア）
+REQUEST_PATTERNS = {
+    'upload': ('/rupload_igvideo/', '/rupload_igphoto/'),
+    'configure': ('/media/configure_to_clips', '/media/configure'),
+}
+
+
+class ShareFailed(Exception):
+    """投稿の確定リクエストがエラーを返した"""
+
+
+class NetworkMonitor:
+    """
+    ChromeのパフォーマンスログからCDPのNetworkイベントを読み、動画の転送と投稿の確定を追跡する
+
+    ブラウザはBrowserProfileでネットワークイベントの記録を有効にして起動しておく必要がある
+    """
+
+    def __init__(self, driver, patterns=None):
+        """
+        :param driver: ChromeDriver
+        :param patterns: 監視するリクエストの種類からURLの一部への辞書。省略時はREQUEST_PATTERNS
+        """
+        self.driver = driver
+        self.patterns = patterns or REQUEST_PATTERNS
+        self.enabled = True
+        self._requests = {}
+
+    def start(self, tab=None):
+        """
+        これまでのイベントを捨てて、新しい動画の追跡を始める
+
+        :param tab: 追跡するタブのウィンドウハンドル。省略時は全てのタブ
+        """
+        self._ingest()
+        self._requests = {
+            key: request for key, request in self._requests.items() if tab is not None and request['tab'] != tab
+        }
+
+    def poll(self, tab=None):
+        """
+        新しいイベントを取り込み、投稿の確定が完了していれば結果を返す
+
+        :param tab: 対象のタブのウィンドウハンドル。省略時は全てのタブ
+        :return: 完了した場合は {'bytes_uploaded', 'upload_seconds', 'server_seconds'}、未完了の場合はNone
+        :raises ShareFailed: 投稿の確定リクエストがエラーを返した場合
+        """
+        self._ingest()
+        requests = [request for request in self._requests.values() if tab is None or request['tab'] == tab]
+        configure = [r for r in requests if r['kind'] == 'configure' and r['finished']]
+        failed = next((r for r in configure if r['failed'] or r['status'] >= 400), None)
+        if failed:
+            raise ShareFailed(f"投稿の確定に失敗しました: status={failed['status']}, error={failed['failed'] or ''}")
+        if not configure:
+            return None
+
+        uploads = [r for r in requests if r['kind'] == 'upload' and r['finished'] and not r['failed']]
+        done = configure[-1]
+        return {
+            'bytes_uploaded': sum(r['bytes'] for r in uploads),
+            'upload_seconds': sum(r['response_at'] - r['sent_at'] for r in uploads),
+            'server_seconds': done['response_at'] - done['sent_at'],
+        }
+
+    def _ingest(self):
+        """パフォーマンスログを読み出して取り込む（ログは全てのタブで共有され、読み出すと消える）"""
+        if not self.enabled:
+            return
+        try:
+            entries = self.driver.get_log('performance')
+        except Exception as e:
+            # ネットワークイベントを記録していないブラウザでは、画面表示による確認だけを行う
+            logger.warning(f"ネットワークイベントを取得できないため、画面表示で完了を確認します: {str(e)}")
+            self.enabled = False
+            return
+        for entry in entries:
+            event = json.loads(entry['message'])
+            message = event['message']
+            if message['method'].startswith('Network.'):
+                # webviewはイベントが発生したタブのターゲットID（ChromeDriverのウィンドウハンドルと同じ）
+                self._handle(event.get('webview'), message['method'], message['params'])
+
+    def _handle(self, tab, method, params):
+        key = (tab, params.get('requestId'))
+        if method == 'Network.requestWillBeSent':
+            request = params['request']
+            kind = self._kind(request['url'], request['method'])
+            if kind:
+                self._requests[key] = {
+                    'tab': tab,
+                    'kind': kind,
+                    'url': request['url'],
+                    'sent_at': params['timestamp'],
+                    'response_at': params['timestamp'],
+                    'bytes': _header_int(request.get('headers', {}), 'content-length', 'x-entity-length'),
+                    'status': 0,
+                    'finished': False,
+                    'failed': None,
+                }
+            return
+
+        tracked = self._requests.get(key)
+        if tracked is None:
+            return
+        if method == 'Network.requestWillBeSentExtraInfo':
+            # 実際に送信されたヘッダーにはブラウザが付けたContent-Length（分割送信では1回分のサイズ）が含まれる
+            tracked['bytes'] = _header_int(params.get('headers', {}), 'content-length') or tracked['bytes']
+        elif method == 'Network.responseReceived':
+            tracked['status'] = params['response']['status']
+            tracked['response_at'] = params['timestamp']
+        elif method == 'Network.loadingFinished':
+            tracked['finished'] = True
+        elif method == 'Network.loadingFailed':
+            tracked['finished'] = True
+            tracked['failed'] = params.get('errorText') or 'failed'
+
+    def _kind(self, url, method):
+        if method != 'POST':
+            return None
+        for kind, fragments in self.patterns.items():
+            if any(fragment in url for fragment in fragments):
+                return kind
+        return None
+
+
+def _header_int(headers, *names):
+    """ヘッダーの値を数値で返す。namesを優先順に調べ、見つからない場合は0"""
+    lowered = {name.lower(): value for name, value in headers.items()}
+    for name in names:
+        try:
+            return int(lowered[name])
+        except (KeyError, ValueError):
+            continue
+    return 0
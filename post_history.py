@@ -0,0 +1,236 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from logger import setup_logger
+
+logger = setup_logger('post_history', 'logs/post_history.log')
+
+# /api/history で1回に返す件数の上限
+MAX_PAGE_SIZE = 500
+# 動画の使用状況を調べる際に、1回のクエリで渡すハッシュの数
+_LOOKUP_CHUNK = 500
+
+
+def caption_hash(caption):
+    """キャプションの本文を保存せずに同じキャプションかどうかを調べるためのハッシュ"""
+    return hashlib.sha256((caption or '').encode('utf-8')).hexdigest()[:16]
+
+
+class PostHistory:
+    """
+    動画ごとの投稿結果を追記していく履歴をSQLiteに保存する
+
+    集計用に日別・アカウント別・結果別の件数と動画ごとの投稿回数を同じトランザクションで更新するため、
+    行数が増えても一覧（キーセットページング）と集計はインデックスを引くだけで返せる
+    """
+
+    def __init__(self, db_path='post_history.db'):
+        """
+        :param db_path: 履歴を保存するSQLiteファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recorded_at REAL NOT NULL,
+                account TEXT NOT NULL,
+                video_path TEXT NOT NULL,
+                video_hash TEXT,
+                caption_hash TEXT NOT NULL,
+                slot TEXT,
+                run_id TEXT,
+                outcome TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                started_at REAL,
+                finished_at REAL,
+                duration_seconds REAL,
+                bytes_uploaded INTEGER,
+                server_seconds REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_posts_account ON posts (account, id);
+            CREATE INDEX IF NOT EXISTS idx_posts_account_outcome ON posts (account, outcome, id);
+            CREATE INDEX IF NOT EXISTS idx_posts_outcome ON posts (outcome, id);
+            CREATE INDEX IF NOT EXISTS idx_posts_recorded ON posts (recorded_at);
+            CREATE INDEX IF NOT EXISTS idx_posts_video ON posts (video_hash, id);
+            CREATE INDEX IF NOT EXISTS idx_posts_slot ON posts (slot, id);
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT NOT NULL,
+                account TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                posts INTEGER NOT NULL,
+                bytes_uploaded INTEGER NOT NULL,
+                duration_seconds REAL NOT NULL,
+                PRIMARY KEY (day, account, outcome)
+            );
+            CREATE TABLE IF NOT EXISTS video_usage (
+                video_hash TEXT PRIMARY KEY,
+                video_path TEXT NOT NULL,
+                shared INTEGER NOT NULL,
+                failed INTEGER NOT NULL,
+                last_posted_at REAL
+            );
+        ''')
+        self._conn.commit()
+        logger.info(f"PostHistoryが初期化されました: {db_path}")
+
+    def record(self, entries):
+        """
+        投稿結果をまとめて追記する
+
+        :param entries: 辞書のリスト。account, video_path, caption, outcome（'shared'/'failed'/'unconfirmed'）は必須で、
+                        video_hash, slot, run_id, error, attempts, started_at, finished_at, bytes_uploaded, server_seconds は任意
+        :return: 追記した行数
+        """
+        now = time.time()
+        rows = []
+        for entry in entries:
+            started_at = entry.get('started_at')
+            finished_at = entry.get('finished_at') or now
+            rows.append((
+                now, entry['account'], entry['video_path'], entry.get('video_hash'), caption_hash(entry.get('caption')),
+                entry.get('slot'), entry.get('run_id'), entry['outcome'], entry.get('error'), entry.get('attempts', 1),
+                started_at, finished_at, finished_at - started_at if started_at else None,
+                entry.get('bytes_uploaded'), entry.get('server_seconds'),
+            ))
+        if not rows:
+            return 0
+
+        day = datetime.fromtimestamp(now).strftime('%Y-%m-%d')
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO posts (recorded_at, account, video_path, video_hash, caption_hash, slot, run_id, outcome, error,
+                                   attempts, started_at, finished_at, duration_seconds, bytes_uploaded, server_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self._conn.executemany('''
+                INSERT INTO daily_stats (day, account, outcome, posts, bytes_uploaded, duration_seconds)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (day, account, outcome) DO UPDATE SET
+                    posts = posts + 1,
+                    bytes_uploaded = bytes_uploaded + excluded.bytes_uploaded,
+                    duration_seconds = duration_seconds + excluded.duration_seconds
+            ''', [(day, row[1], row[7], row[13] or 0, row[12] or 0) for row in rows])
+            self._conn.executemany('''
+                INSERT INTO video_usage (video_hash, video_path, shared, failed, last_posted_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (video_hash) DO UPDATE SET
+                    video_path = excluded.video_path,
+                    shared = shared + excluded.shared,
+                    failed = failed + excluded.failed,
+                    last_posted_at = COALESCE(excluded.last_posted_at, last_posted_at)
+            ''', [
+                (row[3], row[2], int(row[7] == 'shared'), int(row[7] != 'shared'), now if row[7] == 'shared' else None)
+                for row in rows if row[3]
+            ])
+        logger.info(f"投稿履歴を{len(rows)}件記録しました")
+        return len(rows)
+
+    def query(self, account=None, outcome=None, slot=None, video_hash=None, since=None, until=None,
+              limit=50, cursor=None):
+        """
+        投稿履歴を新しい順に返す
+
+        :param since: この日時（UNIX時刻）以降に記録された履歴だけを返す
+        :param until: この日時（UNIX時刻）より前に記録された履歴だけを返す
+        :param limit: 返す件数（MAX_PAGE_SIZEまで）
+        :param cursor: 前のページのnext_cursor。指定するとその続きを返す
+        :return: {'items': 履歴の辞書のリスト, 'next_cursor': 次のページのカーソル（最後のページではNone）}
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conditions, params = [], []
+        for column, value in (('account', account), ('outcome', outcome), ('slot', slot), ('video_hash', video_hash)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('recorded_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('recorded_at < ?')
+            params.append(until)
+        if cursor is not None:
+            # idの降順でたどるキーセットページング（OFFSETと違い、深いページでも読み飛ばしが発生しない）
+            conditions.append('id < ?')
+            params.append(int(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._lock:
+            cursor_rows = self._conn.execute(f'''
+                SELECT id, recorded_at, account, video_path, video_hash, caption_hash, slot, run_id, outcome, error,
+                       attempts, started_at, finished_at, duration_seconds, bytes_uploaded, server_seconds
+                FROM posts {where}
+                ORDER BY id DESC
+                LIMIT ?
+            ''', params + [limit + 1])
+            columns = [description[0] for description in cursor_rows.description]
+            rows = cursor_rows.fetchall()
+        items = [dict(zip(columns, row)) for row in rows[:limit]]
+        return {'items': items, 'next_cursor': items[-1]['id'] if len(rows) > limit else None}
+
+    def stats(self, since_day=None, until_day=None, account=None):
+        """
+        日別・アカウント別・結果別の件数を集計する
+
+        :param since_day: 集計を始める日（'YYYY-MM-DD'）
+        :param until_day: 集計を終える日（'YYYY-MM-DD'、この日を含む）
+        :param account: 指定した場合はこのアカウントだけを集計する
+        :return: {'totals': {結果: 件数}, 'accounts': {アカウント: {結果: 件数}}, 'days': [{'day', 結果: 件数}],
+                  'bytes_uploaded': 合計転送量, 'avg_duration_seconds': 1件あたりの平均所要時間}
+        """
+        conditions, params = [], []
+        for condition, value in (('day >= ?', since_day), ('day <= ?', until_day), ('account = ?', account)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT day, account, outcome, posts, bytes_uploaded, duration_seconds FROM daily_stats {where}
+                ORDER BY day
+            ''', params).fetchall()
+
+        totals, accounts, days = {}, {}, {}
+        total_bytes = total_duration = 0
+        for day, row_account, outcome, posts, bytes_uploaded, duration in rows:
+            totals[outcome] = totals.get(outcome, 0) + posts
+            account_stats = accounts.setdefault(row_account, {})
+            account_stats[outcome] = account_stats.get(outcome, 0) + posts
+            day_stats = days.setdefault(day, {'day': day})
+            day_stats[outcome] = day_stats.get(outcome, 0) + posts
+            total_bytes += bytes_uploaded
+            total_duration += duration
+        count = sum(totals.values())
+        return {
+            'totals': totals,
+            'accounts': accounts,
+            'days': list(days.values()),
+            'bytes_uploaded': total_bytes,
+            'avg_duration_seconds': total_duration / count if count else None,
+        }
+
+    def unused_videos(self, videos):
+        """
+        一度もシェアされていない動画を返す
+
+        :param videos: {'path', 'content_hash'} のリスト（VideoCatalog.videosの戻り値）
+        :return: videosのうち、シェアされた履歴が無いもの
+        """
+        shared = set()
+        hashes = [video['content_hash'] for video in videos]
+        with self._lock:
+            for start in range(0, len(hashes), _LOOKUP_CHUNK):
+                chunk = hashes[start:start + _LOOKUP_CHUNK]
+                shared.update(video_hash for video_hash, in self._conn.execute(f'''
+                    SELECT video_hash FROM video_usage WHERE shared > 0 AND video_hash IN ({','.join('?' * len(chunk))})
+                ''', chunk))
+        return [video for video in videos if video['content_hash'] not in shared]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
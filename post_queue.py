@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from logger import setup_logger
+
+logger = setup_logger('post_queue', 'logs/post_queue.log')
+
+# 再試行の間隔（秒）は RETRY_BASE_DELAY * 2^(試行回数-1)、上限 RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+MAX_ATTEMPTS = 4
+
+# 実行中のタスクのリース期間（秒）。ハートビートで延長されない場合、他のワーカーが再取得できる
+LEASE_SECONDS = 300
+
+
+class PostQueue:
+    """(投稿枠, アカウント) ごとの投稿タスクをSQLiteに永続化するキュー"""
+
+    def __init__(self, db_path='post_queue.db'):
+        """
+        :param db_path: キューを保存するSQLiteファイルのパス
+        """
+        self.db_path = db_path
+        # このプロセスが取得したリースの識別子
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slot TEXT NOT NULL,
+                account TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (slot, account)
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks (state, next_attempt_at);
+        ''')
+        self._conn.commit()
+        logger.info(f"PostQueueが初期化されました: {db_path}")
+
+    def enqueue_slot(self, slot, accounts, caption, not_before=None):
+        """
+        投稿枠の各アカウントをタスクとして登録する。登録済みの (slot, account) は無視する
+
+        :param slot: 投稿枠を表す文字列（例: '2024-01-01 20:00'）
+        :param accounts: ユーザー名のリスト
+        :param caption: 投稿のキャプション
+        :param not_before: アカウントごとの実行を始める日時（UNIX時刻）の辞書。省略したアカウントはすぐに実行できる
+        :return: 新たに登録されたタスクの数
+        """
+        now = time.time()
+        not_before = not_before or {}
+        with self._lock, self._conn:
+            cursor = self._conn.executemany('''
+                INSERT OR IGNORE INTO tasks (slot, account, caption, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(slot, account, caption, not_before.get(account, now), now, now) for account in accounts])
+            added = cursor.rowcount
+        logger.info(f"投稿枠 {slot} のタスクを{added}件登録しました")
+        return added
+
+    def claim(self, limit=1):
+        """
+        実行可能なタスク（待機中で再試行時刻を過ぎたもの、またはリースが切れたもの）を取得する
+
+        停止したプロセスが実行中のまま残したタスクは、リースが切れてから取得される
+        （リースが有効な間は、他のプロセスがまだ投稿している可能性があるため）
+
+        :param limit: 取得するタスクの最大数
+        :return: タスクの辞書のリスト
+        """
+        now = time.time()
+        claimed = []
+        with self._lock, self._conn:
+            # 他のプロセス（Webサーバーとscheduler_service.py）が同じタスクを選ばないよう、
+            # 選択から更新までを1つの書き込みトランザクションで行う
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute('''
+                SELECT id, slot, account, caption, attempts FROM tasks
+                WHERE (state = 'pending' AND next_attempt_at <= ?)
+                   OR (state = 'running' AND lease_expires < ?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, now, limit)).fetchall()
+            for row in rows:
+                # 更新の条件でも取得できる状態かを確かめ、実際に更新できたタスクだけを返す
+                cursor = self._conn.execute('''
+                    UPDATE tasks SET state = 'running', attempts = attempts + 1,
+                        lease_owner = ?, lease_expires = ?, updated_at = ?
+                    WHERE id = ? AND ((state = 'pending' AND next_attempt_at <= ?)
+                                      OR (state = 'running' AND lease_expires < ?))
+                ''', (self.owner, now + LEASE_SECONDS, now, row[0], now, now))
+                if cursor.rowcount == 1:
+                    claimed.append(row)
+        return [
+            {'id': row[0], 'slot': row[1], 'account': row[2], 'caption': row[3], 'attempt': row[4] + 1}
+            for row in claimed
+        ]
+
+    def heartbeat(self, task_ids):
+        """実行中のタスクのリースを延長する"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                UPDATE tasks SET lease_expires = ?, updated_at = ?
+                WHERE id = ? AND state = 'running' AND lease_owner = ?
+            ''', [(now + LEASE_SECONDS, now, task_id, self.owner) for task_id in task_ids])
+
+    def complete(self, task_id):
+        """
+        タスクの成功を記録する
+
+        :return: 記録した場合はTrue。リースを失っていた（他のプロセスに取得されていた）場合はFalse
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute('''
+                UPDATE tasks SET state = 'succeeded', lease_owner = NULL, lease_expires = NULL,
+                    last_error = NULL, updated_at = ?
+                WHERE id = ? AND state = 'running' AND lease_owner = ?
+            ''', (now, task_id, self.owner))
+        if not cursor.rowcount:
+            logger.warning(f"タスク {task_id} のリースを失っていたため、成功を記録しませんでした")
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, error):
+        """
+        タスクの失敗を記録し、試行回数が上限未満なら指数バックオフで再試行を予約する
+
+        :return: 再試行が予約された場合はTrue。リースを失っていた場合は何も記録せずにFalse
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute('''
+                SELECT attempts FROM tasks WHERE id = ? AND state = 'running' AND lease_owner = ?
+            ''', (task_id, self.owner)).fetchone()
+            if row is None:
+                logger.warning(f"タスク {task_id} のリースを失っていたため、失敗を記録しませんでした: {error}")
+                return False
+            attempts = row[0]
+            retry = attempts < MAX_ATTEMPTS
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            self._conn.execute('''
+                UPDATE tasks SET state = ?, next_attempt_at = ?, lease_owner = NULL, lease_expires = NULL,
+                    last_error = ?, updated_at = ?
+                WHERE id = ?
+            ''', ('pending' if retry else 'failed', now + delay, error, now, task_id))
+        if retry:
+            logger.warning(f"タスク {task_id} を{delay}秒後に再試行します ({attempts}/{MAX_ATTEMPTS}回目の失敗): {error}")
+        else:
+            logger.error(f"タスク {task_id} は再試行回数の上限に達しました: {error}")
+        return retry
+
+    def release(self, task_id):
+        """実行を始める前に取り消したタスクを、試行回数を戻して待機状態に戻す"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('''
+                UPDATE tasks SET state = 'pending', attempts = attempts - 1, lease_owner = NULL, lease_expires = NULL,
+                    updated_at = ?
+                WHERE id = ? AND state = 'running' AND lease_owner = ?
+            ''', (now, task_id, self.owner))
+
+    def next_due_in(self):
+        """次に実行可能になるタスクまでの秒数。待機中のタスクが無い場合はNone"""
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT MIN(t) FROM (
+                    SELECT MIN(next_attempt_at) AS t FROM tasks WHERE state = 'pending'
+                    UNION ALL
+                    SELECT MIN(lease_expires) AS t FROM tasks WHERE state = 'running' AND lease_owner != ?
+                )
+            ''', (self.owner,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
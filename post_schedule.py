@@ -0,0 +1,459 @@
+import heapq
+import itertools
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+# 1アカウントあたりの1日の投稿数の上限
+MAX_POSTS_PER_DAY = 10
+# タイムラインに計算しておく日数
+TIMELINE_DAYS = 7
+# アカウントごとの投稿時刻のずらし幅の上限（分）
+MAX_OFFSET_MINUTES = 24 * 60 - 1
+
+# cron式の各項目の名前と範囲（曜日は0と7が日曜日）
+_CRON_FIELDS = (('分', 0, 59), ('時', 0, 23), ('日', 1, 31), ('月', 1, 12), ('曜日', 0, 7))
+
+# 1つのアカウント枠（エントリーとアカウントの組）の投稿規則。値が変わらない枠はタイムラインを計算し直さない
+SlotRule = namedtuple('SlotRule', ['cron', 'offset_minutes', 'caption'])
+
+
+class CronExpression:
+    """cron形式（分 時 日 月 曜日）の投稿時刻の指定。数値、*、範囲（1-5）、間隔（*/15）、列挙（0,30）に対応する"""
+
+    def __init__(self, expression):
+        """
+        :param expression: cron式（例: '0 9,18 * * 1-5' は平日の9時と18時）
+        :raises ValueError: cron式の形式が不正な場合
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron式は5つの項目（分 時 日 月 曜日）で指定してください: {expression}")
+        self.expression = ' '.join(fields)
+        minutes, hours, self.days, self.months, weekdays = [
+            _parse_cron_field(field, name, low, high) for field, (name, low, high) in zip(fields, _CRON_FIELDS)
+        ]
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # cronと同じく、日と曜日の両方が指定された場合はどちらかに一致する日が対象になる
+        self._any_day = fields[2].startswith('*')
+        self._any_weekday = fields[4].startswith('*')
+        self._times = sorted(time(hour, minute) for hour in hours for minute in minutes)
+
+    def matches_day(self, day):
+        """:param day: date"""
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def times_per_day(self):
+        """対象の日の投稿回数"""
+        return len(self._times)
+
+    def times(self):
+        """対象の日の投稿時刻（time）のリスト"""
+        return list(self._times)
+
+    def occurrences(self, start, end):
+        """
+        :return: startより後、end以前の投稿時刻（datetime）を昇順に返すイテレーター
+        """
+        day = start.date()
+        while day <= end.date():
+            if self.matches_day(day):
+                for post_time in self._times:
+                    occurrence = datetime.combine(day, post_time)
+                    if start < occurrence <= end:
+                        yield occurrence
+            day += timedelta(days=1)
+
+    def daily_time(self):
+        """毎日1回の指定（例: '0 20 * * *'）であればその時刻を返す。それ以外はNone"""
+        if len(self._times) == 1 and self._any_day and self._any_weekday and len(self.months) == 12:
+            return self._times[0]
+        return None
+
+
+class ScheduleEntry:
+    """スケジュールの1つのエントリー（cron式と対象アカウント）"""
+
+    def __init__(self, entry_id, cron, accounts, caption=None):
+        """
+        :param entry_id: エントリーの識別子（スケジュール内で一意）
+        :param cron: cron式
+        :param accounts: 対象アカウントのユーザー名のリスト
+        :param caption: このエントリーのキャプション。省略時はスケジュールのキャプションを使う
+        """
+        self.id = entry_id
+        self.cron = CronExpression(cron)
+        self.accounts = list(dict.fromkeys(accounts))
+        self.caption = caption
+
+    def label(self):
+        """表示用の文字列。毎日1回の指定は 'HH:MM'、それ以外はcron式"""
+        daily_time = self.cron.daily_time()
+        return daily_time.strftime('%H:%M') if daily_time else self.cron.expression
+
+    def to_dict(self):
+        data = {'id': self.id, 'cron': self.cron.expression, 'accounts': self.accounts}
+        if self.caption is not None:
+            data['caption'] = self.caption
+        return data
+
+
+class Schedule:
+    """
+    自動投稿のスケジュール
+
+    cron式と対象アカウントからなるエントリーと、アカウントごとの上書き設定
+    （offset_minutes: 投稿時刻のずらし幅（分）, caption: キャプション, enabled: Falseで投稿しない）で構成する
+    """
+
+    def __init__(self, entries, caption='', overrides=None):
+        self.entries = list(entries)
+        self.caption = caption
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        辞書からスケジュールを作成する。従来の形式（post_times, accounts, caption）も受け付ける
+
+        :raises ValueError: 形式が不正な場合
+        """
+        if not isinstance(data, dict):
+            raise ValueError("スケジュールはオブジェクトで指定してください")
+        caption = _optional_string(data.get('caption'), "キャプション") or ''
+        if 'entries' not in data:
+            post_times = []
+            for post_time in _list(data.get('post_times', []), "投稿時刻"):
+                if not isinstance(post_time, time):
+                    try:
+                        post_time = datetime.strptime(post_time, '%H:%M').time()
+                    except (TypeError, ValueError):
+                        raise ValueError(f"投稿時刻はHH:MMの形式で指定してください: {post_time}") from None
+                post_times.append(post_time)
+            accounts = _accounts(data.get('accounts', []), "対象アカウント")
+            entries = [
+                ScheduleEntry(f'time-{index}', f'{post_time.minute} {post_time.hour} * * *', accounts)
+                for index, post_time in enumerate(post_times, start=1)
+            ]
+            return cls(entries, caption)
+
+        entries = []
+        for index, entry in enumerate(_list(data['entries'], "エントリー"), start=1):
+            if not isinstance(entry, dict):
+                raise ValueError(f"エントリー {index} はオブジェクトで指定してください")
+            if 'cron' not in entry:
+                raise ValueError(f"エントリー {index} のcron式がありません")
+            if not isinstance(entry['cron'], str):
+                raise ValueError(f"エントリー {index} のcron式は文字列で指定してください")
+            entries.append(ScheduleEntry(str(entry.get('id') or f'entry-{index}'), entry['cron'],
+                                         _accounts(entry.get('accounts', []), f"エントリー {index} の対象アカウント"),
+                                         _optional_string(entry.get('caption'), f"エントリー {index} のキャプション")))
+        return cls(entries, caption, _overrides(data.get('overrides')))
+
+    def to_dict(self):
+        return {
+            'version': 2,
+            'caption': self.caption,
+            'entries': [entry.to_dict() for entry in self.entries],
+            'overrides': self.overrides,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, Schedule) and self.to_dict() == other.to_dict()
+
+    @property
+    def accounts(self):
+        """いずれかのエントリーの対象になっているアカウント"""
+        return list(dict.fromkeys(account for entry in self.entries for account in entry.accounts))
+
+    def slots(self):
+        """
+        :return: (エントリーID, ユーザー名) からSlotRuleへの辞書。投稿しないアカウントは含まない
+        """
+        slots = {}
+        for entry in self.entries:
+            for account in entry.accounts:
+                override = self.overrides.get(account, {})
+                if override.get('enabled', True) is False:
+                    continue
+                caption = override.get('caption') or entry.caption or self.caption
+                slots[(entry.id, account)] = SlotRule(entry.cron.expression, int(override.get('offset_minutes', 0)), caption)
+        return slots
+
+    def validate(self, today=None):
+        """
+        :raises ValueError: エントリーやアカウントの指定が不正な場合、1日の投稿数がMAX_POSTS_PER_DAYを超えるアカウントがある場合、
+                            同じアカウントの投稿時刻が複数のエントリーで重なる場合
+        """
+        if not self.entries:
+            raise ValueError("少なくとも1つの投稿時刻を指定してください")
+        entry_ids = [entry.id for entry in self.entries]
+        if len(set(entry_ids)) != len(entry_ids):
+            raise ValueError("エントリーのIDが重複しています")
+        for entry in self.entries:
+            if not entry.accounts:
+                raise ValueError(f"エントリー {entry.id} の対象アカウントがありません")
+            if entry.cron.times_per_day() > MAX_POSTS_PER_DAY:
+                raise ValueError(f"エントリー {entry.id} の1日の投稿数が上限（{MAX_POSTS_PER_DAY}回）を超えています")
+        for account, override in self.overrides.items():
+            if abs(int(override.get('offset_minutes', 0))) > MAX_OFFSET_MINUTES:
+                raise ValueError(f"アカウント {account} の投稿時刻のずらし幅が大きすぎます")
+
+        # 曜日や日の指定によって投稿数が変わるため、1週間分の各日について数える
+        today = today or datetime.now().date()
+        for offset in range(7):
+            day = today + timedelta(days=offset)
+            posts = {}
+            # 投稿キューは (投稿枠の時刻, アカウント) を一意とするため、同じ分の投稿は1つにまとめられてしまう
+            taken = {}
+            for entry in self.entries:
+                if entry.cron.matches_day(day):
+                    for account in entry.accounts:
+                        posts[account] = posts.get(account, 0) + entry.cron.times_per_day()
+                        for post_time in entry.cron.times():
+                            other = taken.setdefault((account, post_time), entry.id)
+                            if other != entry.id:
+                                raise ValueError(f"アカウント {account} の投稿時刻 {post_time:%H:%M} が"
+                                                 f"エントリー {other} と {entry.id} で重なっています")
+            over = sorted(account for account, count in posts.items() if count > MAX_POSTS_PER_DAY)
+            if over:
+                raise ValueError(f"1日の投稿数が上限（{MAX_POSTS_PER_DAY}回）を超えるアカウントがあります: {', '.join(over)}")
+
+
+class Timeline:
+    """
+    スケジュールから今後N日分の投稿予定を計算して保持するタイムライン
+
+    投稿予定は投稿時刻のヒープで持ち、次の投稿時刻の参照はO(1)、取り出しはO(log n)で行う。
+    発火時刻（投稿時刻にランダムな待機時間を加えたもの）は、投稿時刻に投稿キューへ登録する際の実行開始時刻として使う。
+    スケジュールの更新時は投稿規則が変わったアカウント枠だけを計算し直し、古い予定は取り出す時に読み飛ばす
+    """
+
+    def __init__(self, horizon_days=TIMELINE_DAYS, jitter=None):
+        """
+        :param horizon_days: 投稿予定を計算しておく日数
+        :param jitter: 投稿時刻に加えるランダムな待機時間（秒）を返す関数。省略時は待機しない
+        """
+        self.horizon_days = horizon_days
+        self.jitter = jitter
+        # (投稿時刻, 連番, 発火時刻, アカウント枠, 世代) のヒープ
+        self._heap = []
+        self._sequence = itertools.count()
+        self._generations = itertools.count(1)
+        # アカウント枠 -> [投稿規則, 世代, ヒープ内の有効な予定の数]
+        self._slots = {}
+        self._live = 0
+        self._crons = {}
+        self._horizon = None
+
+    def __len__(self):
+        """有効な投稿予定の数"""
+        return self._live
+
+    def update(self, schedule, now=None):
+        """
+        スケジュールの変更をタイムラインに反映する
+
+        :param schedule: Schedule。Noneの場合は全ての予定を削除する
+        :return: 計算し直したアカウント枠（追加・変更・削除）の数
+        """
+        now = now or datetime.now()
+        if self._horizon is None:
+            self._horizon = now + timedelta(days=self.horizon_days)
+        rules = schedule.slots() if schedule else {}
+
+        changed = set()
+        for key in [key for key, (rule, _, _) in self._slots.items() if rules.get(key) != rule]:
+            self._live -= self._slots.pop(key)[2]
+            changed.add(key)
+        for key, rule in rules.items():
+            if key not in self._slots:
+                self._slots[key] = [rule, next(self._generations), 0]
+                self._add(key, now, self._horizon)
+                changed.add(key)
+        self._crons = {expression: cron for expression, cron in self._crons.items()
+                       if any(rule.cron == expression for rule, _, _ in self._slots.values())}
+        self._compact()
+        return len(changed)
+
+    def extend(self, now=None):
+        """計算済みの範囲を、nowからhorizon_days日後まで広げる"""
+        now = now or datetime.now()
+        if self._horizon is None:
+            self._horizon = now
+        target = now + timedelta(days=self.horizon_days)
+        # 1時間に1回程度にまとめて広げる
+        if target - self._horizon < timedelta(hours=1):
+            return
+        for key in self._slots:
+            self._add(key, self._horizon, target)
+        self._horizon = target
+
+    def next_post_time(self):
+        """:return: 次の投稿時刻。予定が無い場合はNone"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """
+        投稿時刻を過ぎた投稿予定を取り出す（発火時刻はまだ先のことがある）
+
+        :return: {'fire_time', 'post_time', 'entry', 'account', 'caption'} のリスト（投稿時刻順）
+        """
+        now = now or datetime.now()
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            post_time, _, fire_time, key, _ = heapq.heappop(self._heap)
+            slot = self._slots[key]
+            slot[2] -= 1
+            self._live -= 1
+            due.append(_occurrence(fire_time, post_time, key, slot[0]))
+
+    def drop_missed(self, before):
+        """
+        投稿時刻がbeforeより前の投稿予定を、投稿キューに登録せずに破棄する
+
+        リーダーの交代や停止の後に再開する際、待機中のプロセスで計算してあった古い予定をまとめて投稿しないために使う
+
+        :param before: この日時より前の予定を破棄する
+        :return: 破棄した投稿予定の数
+        """
+        dropped = 0
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] >= before:
+                return dropped
+            key = heapq.heappop(self._heap)[3]
+            self._slots[key][2] -= 1
+            self._live -= 1
+            dropped += 1
+
+    def upcoming(self, limit=20):
+        """:return: 投稿時刻が早い順にlimit件の投稿予定（pop_dueと同じ形式）"""
+        live = (item for item in self._heap if self._is_live(item))
+        return [
+            _occurrence(fire_time, post_time, key, self._slots[key][0])
+            for post_time, _, fire_time, key, _ in heapq.nsmallest(limit, live, key=lambda item: (item[0], item[1]))
+        ]
+
+    def upcoming_post_times(self, limit=5):
+        """:return: 今後の投稿時刻（重複なし）を早い順にlimit件"""
+        post_times = []
+        for occurrence in self.upcoming(limit * 50):
+            if occurrence['post_time'] not in post_times:
+                post_times.append(occurrence['post_time'])
+                if len(post_times) == limit:
+                    break
+        return post_times
+
+    def _add(self, key, start, end):
+        rule, generation, _ = self._slots[key]
+        cron = self._crons.get(rule.cron)
+        if cron is None:
+            cron = self._crons[rule.cron] = CronExpression(rule.cron)
+        offset = timedelta(minutes=rule.offset_minutes)
+        added = 0
+        for occurrence in cron.occurrences(start - offset, end - offset):
+            post_time = occurrence + offset
+            fire_time = post_time + timedelta(seconds=self.jitter()) if self.jitter else post_time
+            heapq.heappush(self._heap, (post_time, next(self._sequence), fire_time, key, generation))
+            added += 1
+        self._slots[key][2] += added
+        self._live += added
+
+    def _is_live(self, item):
+        slot = self._slots.get(item[3])
+        return slot is not None and slot[1] == item[4]
+
+    def _drop_stale(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        """削除された予定がヒープの半分を超えたら作り直す"""
+        if len(self._heap) > 2 * self._live + 64:
+            self._heap = [item for item in self._heap if self._is_live(item)]
+            heapq.heapify(self._heap)
+
+
+def _occurrence(fire_time, post_time, key, rule):
+    return {'fire_time': fire_time, 'post_time': post_time, 'entry': key[0], 'account': key[1], 'caption': rule.caption}
+
+
+def _list(value, name):
+    if not isinstance(value, list):
+        raise ValueError(f"{name}はリストで指定してください")
+    return value
+
+
+def _accounts(value, name):
+    """文字列が渡されると1文字ずつのアカウントとして扱われてしまうため、ユーザー名のリストであることを確かめる"""
+    accounts = _list(value, name)
+    if not all(isinstance(account, str) and account for account in accounts):
+        raise ValueError(f"{name}はユーザー名のリストで指定してください")
+    return accounts
+
+
+def _optional_string(value, name):
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name}は文字列で指定してください")
+    return value
+
+
+def _overrides(value):
+    """
+    アカウントごとの上書き設定の形式を確かめる
+
+    :return: offset_minutesを整数にそろえた上書き設定
+    """
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError("アカウントごとの設定はオブジェクトで指定してください")
+    overrides = {}
+    for account, override in value.items():
+        if not isinstance(override, dict):
+            raise ValueError(f"アカウント {account} の設定はオブジェクトで指定してください")
+        override = dict(override)
+        if 'offset_minutes' in override:
+            offset = override['offset_minutes']
+            if isinstance(offset, str) and offset.strip().lstrip('+-').isdigit():
+                offset = int(offset)
+            # boolはintのサブクラスのため、明示的に除く
+            if not isinstance(offset, int) or isinstance(offset, bool):
+                raise ValueError(f"アカウント {account} の投稿時刻のずらし幅（分）は整数で指定してください: {override['offset_minutes']}")
+            override['offset_minutes'] = offset
+        if 'enabled' in override and not isinstance(override['enabled'], bool):
+            raise ValueError(f"アカウント {account} のenabledはtrueかfalseで指定してください")
+        _optional_string(override.get('caption'), f"アカウント {account} のキャプション")
+        overrides[account] = override
+    return overrides
+
+
+def _parse_cron_field(field, name, low, high):
+    values = set()
+    try:
+        for part in field.split(','):
+            body, _, step = part.partition('/')
+            if body == '*':
+                first, last = low, high
+            elif '-' in body:
+                first, last = (int(value) for value in body.split('-', 1))
+            else:
+                first = int(body)
+                last = high if step else first
+            step = int(step) if step else 1
+            if not low <= first <= last <= high or step < 1:
+                raise ValueError
+            values.update(range(first, last + 1, step))
+    except ValueError:
+        raise ValueError(f"cron式の{name}の指定が不正です: {field}（{low}〜{high}）") from None
+    return values
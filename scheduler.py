@@ -1,113 +1,252 @@
 import threading
-import time
 from datetime import datetime, timedelta
-from instagram_uploader import InstagramUploader
+from upload_pool import UploadPool
+from post_queue import PostQueue
+from post_schedule import TIMELINE_DAYS, Timeline
 from logger import setup_logger
+import metrics
 
 logger = setup_logger('scheduler', 'logs/scheduler.log')
 
+# 実行中タスクのリースを延長する間隔（秒）
+HEARTBEAT_INTERVAL = 60
+# 投稿予定が無い場合も、タイムラインの計算範囲を広げるために起床する間隔（秒）
+TIMELINE_EXTEND_INTERVAL = 3600
+# 画面に表示する次回の投稿時間の数
+NEXT_POST_TIMES_SHOWN = 5
+# 開始時（リーダーに選ばれた時）に、投稿時刻を過ぎていても投稿キューに登録する猶予（秒）。
+# これより古い予定は、停止中や前のリーダーが動いていた間のものとして破棄する
+MISSED_SLOT_GRACE_SECONDS = 600
+
+SCHEDULER_SLOT_LAG_SECONDS = metrics.histogram('scheduler_slot_lag_seconds', '投稿時刻から投稿キューに登録するまでの遅れ（秒）')
+SCHEDULER_SLOTS_TOTAL = metrics.counter('scheduler_slots_total', '投稿キューに登録した投稿枠の数')
+POST_TASKS_TOTAL = metrics.counter('post_tasks_total', '投稿キューのタスクの実行結果')
+
 class Scheduler:
-    def __init__(self, config_manager, video_folder):
+    def __init__(self, config_manager, video_folder, upload_pool=None, post_queue=None):
         self.config_manager = config_manager
         self.video_folder = video_folder
+        self.upload_pool = upload_pool or UploadPool(config_manager, video_folder)
+        self.post_queue = post_queue or PostQueue()
         self.running = False
         self.thread = None
         self.next_post_times = []
+        # 最後に読み込んだスケジュール（別のプロセスでの変更を検知するため）
+        self._loaded_schedule = None
+        # 今後の投稿予定。発火時刻は投稿時刻にランダムな待機時間を加えたもの
+        self.timeline = Timeline(horizon_days=TIMELINE_DAYS, jitter=config_manager.get_random_wait_time)
+        self._condition = threading.Condition()
+        # 投稿キューのワーカー
+        self._queue_thread = None
+        self._queue_wakeup = threading.Event()
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # 実行中のタスクの結果を記録し終えた時に通知する
+        self._in_flight_changed = threading.Condition(self._in_flight_lock)
         logger.info("スケジューラーが初期化されました")
 
 
     def get_status(self):
         status = "running" if self.running else "stopped"
-        logger.info(f"現在のスケジューラーステータス: {status}")
+        logger.debug("現在のスケジューラーステータス: %s", status)
         return status
 
     def get_next_post_times(self):
         if self.next_post_times:
             times_str = ", ".join(t.strftime("%Y-%m-%d %H:%M:%S") for t in self.next_post_times)
-            logger.info(f"次回の投稿時間: {times_str}")
+            logger.debug("次回の投稿時間: %s", times_str)
             return times_str
-        logger.info("次回の投稿時間が設定されていません")
+        logger.debug("次回の投稿時間が設定されていません")
         return None
 
     def start(self):
         if not self.running:
             self.running = True
+            if self._loaded_schedule is None:
+                self.update_schedule()
+            with self._condition:
+                dropped = self.timeline.drop_missed(datetime.now() - timedelta(seconds=MISSED_SLOT_GRACE_SECONDS))
+            if dropped:
+                logger.warning("投稿時刻から%d秒以上過ぎた投稿予定%d件を破棄しました", MISSED_SLOT_GRACE_SECONDS, dropped)
             self.thread = threading.Thread(target=self.run)
             self.thread.start()
+            self._queue_thread = threading.Thread(target=self._process_queue)
+            self._queue_thread.start()
             logger.info("スケジューラーが開始されました")
 
     def stop(self):
         if self.running:
-            self.running = False
+            with self._condition:
+                self.running = False
+                self._condition.notify_all()
+            self._queue_wakeup.set()
             if self.thread:
                 self.thread.join()
+            if self._queue_thread:
+                self._queue_thread.join()
+            self._drain_in_flight()
             logger.info("スケジューラーが停止されました")
 
+    def _drain_in_flight(self):
+        """
+        実行を始めていないタスクを取り消し、実行中のタスクの完了を待つ
+
+        リーダーを降りる前に呼び、新しいリーダーが同じタスクを取得して重複して投稿しないようにする。
+        Futureの完了ではなく結果の記録（_finish_task）を待ち、待っている間もリースを延長し続ける
+        """
+        with self._in_flight_lock:
+            futures = list(self._in_flight.values())
+        for future in futures:
+            future.cancel()
+        with self._in_flight_changed:
+            if self._in_flight:
+                logger.info("実行中の投稿タスク%d件の完了を待ちます", len(self._in_flight))
+            while self._in_flight:
+                self.post_queue.heartbeat(list(self._in_flight))
+                self._in_flight_changed.wait(HEARTBEAT_INTERVAL)
+
+    def refresh_schedule(self):
+        """
+        保存されているスケジュールが最後に読み込んだものから変わっていれば、投稿時刻を計算し直す
+
+        Webのプロセスで設定されたスケジュールを、別のプロセスで動くスケジューラーに反映するために使う
+        """
+        if self.config_manager.load_schedule() != self._loaded_schedule:
+            logger.info("スケジュールの変更を検知しました")
+            self.update_schedule()
+
     def update_schedule(self):
         logger.info("スケジュールの更新を開始")
-        self.next_post_times = self.calculate_next_post_times()
-        logger.info(f"次回の投稿時間を更新しました: {self.next_post_times}")
+        schedule = self.config_manager.load_schedule()
+        if not schedule:
+            logger.warning("スケジュールが見つかりません")
+        with self._condition:
+            self._loaded_schedule = schedule
+            # 投稿規則が変わったアカウント枠だけを計算し直す
+            changed = self.timeline.update(schedule)
+            self.next_post_times = self.timeline.upcoming_post_times(NEXT_POST_TIMES_SHOWN)
+            self._condition.notify_all()
+        logger.info("次回の投稿時間を更新しました: %s (計算し直したアカウント枠 %d件, 投稿予定 %d件)",
+                    self.next_post_times, changed, len(self.timeline))
+
+    def upcoming(self, limit=20):
+        """:return: 今後の投稿予定（Timeline.upcomingと同じ形式）"""
+        with self._condition:
+            return self.timeline.upcoming(limit)
 
     def run(self):
         logger.info("スケジューラーのメインループを開始")
-        while self.running:
-            now = datetime.now()
-            for post_time in self.next_post_times:
-                if now >= post_time:
-                    wait_time = self.config_manager.get_random_wait_time()
-                    logger.info(f"投稿時刻 {post_time} に達しました。{wait_time}秒後に投稿を開始します。")
-                    time.sleep(wait_time)
-                    self.post_content()
-                    self.update_schedule()
-                    break
-            time.sleep(60)  # 1分ごとにチェック
+        with self._condition:
+            while self.running:
+                now = datetime.now()
+                self.timeline.extend(now)
+                post_time = self.timeline.next_post_time()
+                delay = TIMELINE_EXTEND_INTERVAL if post_time is None else (post_time - now).total_seconds()
+                if delay > 0:
+                    # 次の投稿時刻まで待機（update_schedule/stop で即座に起床する）
+                    self._condition.wait(min(delay, TIMELINE_EXTEND_INTERVAL))
+                    continue
+
+                # 投稿時刻になった時点で投稿キューに登録し、ランダムな待機はキューの実行開始時刻として永続化する
+                # （待機中にプロセスが停止したりリーダーが交代したりしても、投稿枠が失われない）。
+                # 投稿時刻とキャプションが同じアカウントは、1つの投稿枠としてまとめて登録する
+                slots = {}
+                for occurrence in self.timeline.pop_due(now):
+                    SCHEDULER_SLOT_LAG_SECONDS.observe((now - occurrence['post_time']).total_seconds())
+                    fire_times = slots.setdefault((occurrence['post_time'], occurrence['caption']), {})
+                    fire_times[occurrence['account']] = occurrence['fire_time']
+                SCHEDULER_SLOTS_TOTAL.inc(len(slots))
+                self.next_post_times = self.timeline.upcoming_post_times(NEXT_POST_TIMES_SHOWN)
+                logger.info("%d件の投稿枠の投稿時刻になりました。投稿キューに登録します。", len(slots))
+                threading.Thread(target=self._run_slots, args=(slots,), daemon=True).start()
         logger.info("スケジューラーのメインループを終了")
 
-    def calculate_next_post_times(self):
-        logger.info("次回の投稿時間を計算")
-        schedule = self.config_manager.load_schedule()
-        if not schedule:
-            logger.warning("スケジュールが見つかりません")
-            return []
-        
-        now = datetime.now()
-        next_times = []
-        for post_time in schedule['post_times']:
-            next_time = now.replace(hour=post_time.hour, minute=post_time.minute, second=0, microsecond=0)
-            if next_time <= now:
-                next_time += timedelta(days=1)
-            next_times.append(next_time)
-        
-        next_times.sort()
-        logger.info(f"次回の投稿時間を計算しました: {next_times}")
-        return next_times
-    
-    def post_content(self):
-        logger.info("スケジュールされたコンテンツの投稿を開始")
-        schedule = self.config_manager.load_schedule()
-        if not schedule:
-            logger.error("スケジュールが見つかりません")
+    def _process_queue(self):
+        """投稿キューから実行可能なタスクを取得し、UploadPoolの空きに応じて実行する"""
+        logger.info("投稿キューの処理を開始")
+        while self.running:
+            self._queue_wakeup.clear()
+            with self._in_flight_lock:
+                capacity = self.upload_pool.max_workers - len(self._in_flight)
+            if capacity > 0:
+                for task in self.post_queue.claim(capacity):
+                    logger.info("アカウント %s の投稿タスクを開始します (投稿枠 %s, %d回目)", task['account'], task['slot'], task['attempt'])
+                    future = self.upload_pool.submit(task['account'], task['caption'], run_id=f"task-{task['id']}",
+                                                     slot=task['slot'])
+                    with self._in_flight_lock:
+                        self._in_flight[task['id']] = future
+                    future.add_done_callback(lambda f, task=task: self._finish_task(task, f))
+
+            with self._in_flight_lock:
+                in_flight = list(self._in_flight)
+            if in_flight:
+                self.post_queue.heartbeat(in_flight)
+
+            due = self.post_queue.next_due_in()
+            self._queue_wakeup.wait(HEARTBEAT_INTERVAL if due is None else min(due, HEARTBEAT_INTERVAL))
+        logger.info("投稿キューの処理を終了")
+
+    def _finish_task(self, task, future):
+        account = task['account']
+        if future.cancelled():
+            # 実行を始める前に停止したため、他のプロセスがすぐに取得できるように戻す
+            self.post_queue.release(task['id'])
+            with self._in_flight_changed:
+                self._in_flight.pop(task['id'], None)
+                self._in_flight_changed.notify_all()
             return
 
-        for account in schedule['accounts']:
-            logger.info(f"アカウント {account} の投稿処理を開始")
-            video_paths = self.config_manager.get_random_videos(self.video_folder, 3)
-            if len(video_paths) < 3:
-                logger.error(f"アカウント {account} の投稿に失敗しました: 十分な数の動画ファイルが見つかりません")
-                continue
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'status': 'failed', 'error': f"アカウント {account} での投稿中にエラーが発生しました: {str(e)}"}
+
+        if result['status'] == 'failed':
+            logger.error(f"アカウント {account} への投稿に失敗しました: {result['error']}")
+            retry = self.post_queue.fail(task['id'], result['error'])
+            POST_TASKS_TOTAL.inc(outcome='retry' if retry else 'failed')
+        elif result['status'] == 'unconfirmed':
+            # 再試行すると同じ動画が重複して投稿される可能性があるため、完了として扱う
+            logger.warning(f"アカウント {account} の投稿結果を確認できなかったため、再試行しません: {result['error']}")
+            self.post_queue.complete(task['id'])
+            POST_TASKS_TOTAL.inc(outcome='unconfirmed')
+        else:
+            logger.info("アカウント %s への3つの動画投稿が成功しました", account)
+            self.post_queue.complete(task['id'])
+            POST_TASKS_TOTAL.inc(outcome=result['status'])
 
+        with self._in_flight_changed:
+            self._in_flight.pop(task['id'], None)
+            self._in_flight_changed.notify_all()
+        self._queue_wakeup.set()
+
+    def _run_slots(self, slots):
+        for (post_time, caption), fire_times in slots.items():
             try:
-                uploader = InstagramUploader()
-                account_info = self.config_manager.get_account(account)
-                if not account_info:
-                    logger.error(f"アカウント {account} の情報が見つかりません")
-                    continue
-                success = uploader.upload_to_instagram(video_paths, schedule['caption'], account, account_info['password'])
-                if success:
-                    logger.info(f"アカウント {account} への3つの動画投稿が成功しました")
-                else:
-                    logger.error(f"アカウント {account} への投稿に失敗しました")
+                self.post_content(post_time, list(fire_times), caption, fire_times)
             except Exception as e:
-                logger.exception(f"アカウント {account} での投稿中にエラーが発生しました: {str(e)}")
+                logger.exception(f"投稿時刻 {post_time} の投稿処理中にエラーが発生しました: {str(e)}")
+
+    def post_content(self, post_time=None, accounts=None, caption=None, fire_times=None):
+        """
+        投稿枠のアカウントを投稿キューに登録する
+
+        :param post_time: 投稿枠の時刻。同じ投稿枠のタスクは一度しか登録されない
+        :param accounts: 投稿するアカウント。省略時はスケジュールの全てのアカウント
+        :param caption: 投稿のキャプション。省略時はスケジュールのキャプション
+        :param fire_times: アカウントごとの投稿を始める日時の辞書。省略したアカウントはすぐに投稿する
+        """
+        logger.info("スケジュールされたコンテンツの投稿を開始")
+        if accounts is None or caption is None:
+            schedule = self.config_manager.load_schedule()
+            if not schedule:
+                logger.error("スケジュールが見つかりません")
+                return
+            accounts = schedule.accounts if accounts is None else accounts
+            caption = schedule.caption if caption is None else caption
 
-        logger.info("全てのアカウントの投稿処理が完了しました")
\ No newline at end of file
+        slot = (post_time or datetime.now()).strftime('%Y-%m-%d %H:%M')
+        not_before = {account: fire_time.timestamp() for account, fire_time in (fire_times or {}).items()}
+        self.post_queue.enqueue_slot(slot, accounts, caption, not_before)
+        self._queue_wakeup.set()
+        logger.info(f"投稿枠 {slot} の{len(accounts)}個のアカウントを投稿キューに登録しました")
@@ -0,0 +1,72 @@
+import argparse
+import os
+import signal
+import threading
+from leader_election import LEASE_SECONDS, LeaderElection, LeaderLease
+from logger import configure_logging, setup_logger
+import metrics
+
+logger = setup_logger('scheduler_service', 'logs/scheduler_service.log')
+
+# メトリクスを公開するポート（Webサーバーの/metricsはWebのプロセスのメトリクスだけを返すため、別に公開する）
+DEFAULT_METRICS_PORT = 5002
+
+
+def create_election(scheduler, lease=None):
+    """
+    スケジューラーをリーダーのプロセスでだけ動かすLeaderElectionを作成する
+
+    :param scheduler: Scheduler
+    :param lease: LeaderLease。省略時は 'scheduler' という名前のリースを使う
+    :return: LeaderElection（startまたはrun_foreverで選出を開始する）
+    """
+    def on_elected():
+        # 前のリーダーが動いていた間にスケジュールが変わっている可能性があるため、計算し直してから開始する
+        scheduler.update_schedule()
+        scheduler.start()
+
+    return LeaderElection(
+        lease or LeaderLease('scheduler'),
+        on_elected=on_elected,
+        on_deposed=scheduler.stop,
+        on_tick=scheduler.refresh_schedule,
+        info=lambda: {'pid': os.getpid(), 'next_post_times': scheduler.get_next_post_times()},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='自動投稿のスケジューラーをWebサーバーとは別のプロセスで起動する')
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS,
+                        help='リーダーのリース期間（秒）。リーダーが停止すると、この時間の後に他のプロセスが引き継ぐ')
+    parser.add_argument('--metrics-port', type=int, default=DEFAULT_METRICS_PORT,
+                        help='メトリクスを http://127.0.0.1:<port>/metrics で公開するポート（0の場合は公開しない）')
+    parser.add_argument('--log-name', default='scheduler',
+                        help='ログファイル名に付ける名前（logs/scheduler.<log-name>.log）。同じホストで複数起動する場合は別の名前にする')
+    args = parser.parse_args()
+    # Webサーバーと同じログファイルをローテーションしないよう、このプロセスのログは別のファイルに書き込む
+    configure_logging(process_name=args.log_name)
+
+    # Webのプロセスと同じ設定のインスタンスを使う
+    from app import get_browser_pool, get_browser_supervisor, get_scheduler
+
+    election = create_election(get_scheduler(), LeaderLease('scheduler', lease_seconds=args.lease_seconds))
+    signal.signal(signal.SIGTERM, lambda signum, frame: election.stop())
+
+    logger.info("スケジューラーのプロセスを起動します")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logger.info(f"メトリクスを公開しました: http://127.0.0.1:{args.metrics_port}/metrics")
+    get_browser_supervisor().start()
+    threading.Thread(target=get_browser_pool().warm, daemon=True).start()
+    try:
+        election.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        get_browser_pool().close()
+        get_browser_supervisor().stop()
+    logger.info("スケジューラーのプロセスを終了します")
+
+
+if __name__ == '__main__':
+    main()
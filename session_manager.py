@@ -1,7 +1,8 @@
 import os
 import json
+import threading
 import time
-from cryptography.fernet import Fernet
+from lazy import lazy_instance
 from logger import setup_logger
 
 logger = setup_logger('session_manager', 'logs/session_manager.log')
@@ -19,6 +20,8 @@ class SessionManager:
         logger.info(f"SessionManager initialized with session directory: {session_dir}")
         
         # 暗号化キーの設定
+        from cryptography.fernet import Fernet
+
         key_file = os.path.join(session_dir, 'encryption_key.key')
         if os.path.exists(key_file):
             with open(key_file, 'rb') as f:
@@ -30,6 +33,10 @@ class SessionManager:
         self.cipher_suite = Fernet(self.key)
         logger.info("Encryption key set up successfully")
 
+        # 復号済みセッションのメモリキャッシュ
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
     def save_session(self, username, session_data):
         """
         セッション情報を暗号化して保存
@@ -41,6 +48,8 @@ class SessionManager:
         encrypted_data = self.cipher_suite.encrypt(json.dumps(session_data).encode())
         with open(filename, 'wb') as f:
             f.write(encrypted_data)
+        with self._cache_lock:
+            self._cache[username] = session_data
         logger.info(f"Session saved for user: {username}")
 
     def load_session(self, username):
@@ -50,6 +59,10 @@ class SessionManager:
         :param username: ユーザー名
         :return: セッションデータ（辞書形式）、存在しない場合はNone
         """
+        with self._cache_lock:
+            if username in self._cache:
+                return self._cache[username]
+
         filename = os.path.join(self.session_dir, f"{username}.session")
         if not os.path.exists(filename):
             logger.info(f"No saved session found for user: {username}")
@@ -61,6 +74,8 @@ class SessionManager:
         try:
             decrypted_data = self.cipher_suite.decrypt(encrypted_data)
             session_data = json.loads(decrypted_data.decode())
+            with self._cache_lock:
+                self._cache[username] = session_data
             logger.info(f"Session loaded successfully for user: {username}")
             return session_data
         except Exception as e:
@@ -73,6 +88,8 @@ class SessionManager:
         
         :param username: ユーザー名
         """
+        with self._cache_lock:
+            self._cache.pop(username, None)
         filename = os.path.join(self.session_dir, f"{username}.session")
         if os.path.exists(filename):
             os.remove(filename)
@@ -98,5 +115,7 @@ class SessionManager:
         logger.info("Session is valid")
         return True
 
-# セッションマネージャーのインスタンスを作成
-session_manager = SessionManager()
\ No newline at end of file
+@lazy_instance
+def get_session_manager():
+    """既定の設定（sessionsディレクトリ）のSessionManagerを返す。初めて呼ばれた時に作成する"""
+    return SessionManager()
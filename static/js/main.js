@@ -31,6 +31,17 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         }
 
+        // cron式の処理（1行に1つ）。指定された場合は投稿時刻と合わせてエントリーの形式で送信する
+        const cronExpressions = (formData.get('cron') || '').split('\n').map(line => line.trim()).filter(line => line);
+        if (cronExpressions.length > 0) {
+            const timeEntries = scheduleData.post_times.map((time, index) => {
+                const [hour, minute] = time.split(':');
+                return {id: `time-${index + 1}`, cron: `${Number(minute)} ${Number(hour)} * * *`, accounts: scheduleData.accounts};
+            });
+            const cronEntries = cronExpressions.map((cron, index) => ({id: `cron-${index + 1}`, cron: cron, accounts: scheduleData.accounts}));
+            scheduleData.entries = timeEntries.concat(cronEntries);
+        }
+
         console.log('送信するスケジュールデータ:', scheduleData); // デバッグ用ログ
 
         submitJson('/set_schedule', scheduleData);
@@ -46,7 +57,7 @@ document.addEventListener('DOMContentLoaded', function() {
         submitJson('/api/auto_post_status', { status: 'stop' });
     });
 
-    // フォームデータを送信する関数
+    // 動画アップロードのジョブを登録し、進捗を表示する関数
     function submitForm(url, formData) {
         fetch(url, {
             method: 'POST',
@@ -55,8 +66,9 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => response.json())
         .then(data => {
             resultDiv.textContent = data.message || data.error;
-            updateAutoPostStatus();
-            updateNextPostTime();
+            if (data.events_url) {
+                watchJob(data.events_url);
+            }
         })
         .catch(error => {
             console.error('エラー:', error);
@@ -64,6 +76,47 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // ジョブの進捗をServer-Sent Eventsで受け取って表示する関数
+    function watchJob(eventsUrl) {
+        const stateLabels = {
+            queued: '待機中',
+            pending: '未着手',
+            preparing: '動画を準備中',
+            waiting_browser: 'ブラウザを待機中',
+            logging_in: 'ログイン中',
+            uploading: 'アップロード中',
+            processing: 'シェア処理中',
+            shared: 'シェア済み',
+            success: '完了',
+            failed: '失敗',
+            unconfirmed: '結果不明',
+            skipped: 'スキップ'
+        };
+        const source = new EventSource(eventsUrl);
+        source.onmessage = function(event) {
+            const job = JSON.parse(event.data);
+            if (job.status === 'finished') {
+                resultDiv.textContent = job.result.message || job.result.error;
+                source.close();
+                updateAutoPostStatus();
+                updateNextPostTime();
+                return;
+            }
+            resultDiv.textContent = Object.entries(job.progress).map(([account, progress]) => {
+                const count = progress.total ? ` ${progress.current}/${progress.total}` : '';
+                // 動画を並行して投稿している場合は動画ごとの状態も表示する
+                const videos = progress.videos
+                    ? ` [${progress.videos.map(state => stateLabels[state] || state).join(', ')}]`
+                    : '';
+                return `${account}: ${stateLabels[progress.state] || progress.state}${count}${videos}`;
+            }).join(' / ');
+        };
+        source.onerror = function() {
+            console.error('ジョブの進捗の取得に失敗しました');
+            source.close();
+        };
+    }
+
     // JSONデータを送信する関数
     function submitJson(url, data) {
         console.log('送信するデータ:', data); // デバッグ用ログ
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# ログファイルや既定のパスのSQLiteファイルをリポジトリ内に作らないよう、一時ディレクトリで実行する
+os.chdir(tempfile.mkdtemp(prefix='insta_tests_'))
+
+
+class FakeClock:
+    """time.time()の代わりに使う、advanceで進めるまで止まっている時計"""
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def clock(request, monkeypatch, fake_clock):
+    """テストモジュールのCLOCK_MODULESに挙げたモジュールのtimeをfake_clockに置き換える"""
+    for module in request.module.CLOCK_MODULES:
+        monkeypatch.setattr(module, 'time', fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """キューとリースを保存するSQLiteファイルのパス"""
+    return str(tmp_path / 'post_queue.db')
@@ -0,0 +1,86 @@
+import os
+import pytest
+from account_store import AccountStore, IniAccountStore, SQLiteAccountStore
+from config_manager import ConfigManager, accounts_db_path
+
+
+def test_write_and_load_accounts(tmp_path):
+    store = SQLiteAccountStore(str(tmp_path / 'accounts.db'))
+    store.write_accounts(upserts=[('alice', 'secret-a', True), ('bob', 'secret-b', False)])
+
+    assert store.load_accounts() == {
+        'alice': {'password': 'secret-a', 'post_flag': True},
+        'bob': {'password': 'secret-b', 'post_flag': False},
+    }
+    assert store.get_account('bob') == {'password': 'secret-b', 'post_flag': False}
+    assert store.get_account('carol') is None
+
+
+def test_upsert_without_password_only_updates_existing_flag(tmp_path):
+    store = SQLiteAccountStore(str(tmp_path / 'accounts.db'))
+    store.write_accounts(upserts=[('alice', 'secret-a', True)])
+    store.write_accounts(upserts=[('alice', None, False), ('carol', None, True)])
+
+    assert store.load_accounts() == {'alice': {'password': 'secret-a', 'post_flag': False}}
+
+
+def test_replace_removes_missing_accounts(tmp_path):
+    store = SQLiteAccountStore(str(tmp_path / 'accounts.db'))
+    store.write_accounts(upserts=[('alice', 'a', True), ('bob', 'b', True)])
+
+    removed = store.write_accounts(upserts=[('bob', 'b2', None)], replace=True)
+
+    assert removed == ['alice']
+    assert store.load_accounts() == {'bob': {'password': 'b2', 'post_flag': True}}
+
+
+def test_stamp_changes_on_write_from_another_connection(tmp_path):
+    path = str(tmp_path / 'accounts.db')
+    reader = SQLiteAccountStore(path)
+    writer = SQLiteAccountStore(path)
+    before = reader.stamp()
+
+    writer.save_schedule(b'encrypted')
+
+    assert reader.stamp() != before
+    assert reader.load_schedule() == b'encrypted'
+
+
+def test_accounts_db_path_follows_accounts_file(tmp_path):
+    assert accounts_db_path('accounts.ini') == 'accounts.db'
+    assert accounts_db_path(os.path.join('conf', 'users.ini')) == os.path.join('conf', 'users.db')
+
+    manager = ConfigManager(str(tmp_path / 'accounts.ini'), str(tmp_path / 'schedule.json'),
+                            catalog_file=str(tmp_path / 'video_catalog.db'))
+
+    assert manager.store.db_path == str(tmp_path / 'accounts.db')
+    assert os.path.exists(tmp_path / 'accounts.db')
+
+
+def test_account_store_requires_every_method():
+    class Partial(AccountStore):
+        def load_accounts(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_ini_store_keeps_meta_next_to_accounts_file(tmp_path):
+    store = IniAccountStore(str(tmp_path / 'accounts.ini'), str(tmp_path / 'schedule.json'))
+    assert store.get_meta('migrated_at') is None
+
+    store.set_meta('migrated_at', '1')
+
+    assert IniAccountStore(str(tmp_path / 'accounts.ini'), str(tmp_path / 'schedule.json')).get_meta('migrated_at') == '1'
+    assert os.path.exists(tmp_path / 'accounts.meta.json')
+
+
+def test_update_account_rejects_non_object_data(tmp_path):
+    manager = ConfigManager(str(tmp_path / 'accounts.ini'), str(tmp_path / 'schedule.json'),
+                            catalog_file=str(tmp_path / 'video_catalog.db'))
+    for data in (None, ['password'], 'secret'):
+        with pytest.raises(ValueError):
+            manager.update_account('alice', data)
+    with pytest.raises(ValueError):
+        manager.apply_account_changes(update=['alice'])
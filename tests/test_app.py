@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip('flask')
+
+import app as app_module
+from job_manager import JobManager, JobStore
+
+
+class FakeUploadPool:
+    def post_accounts(self, accounts, caption, check_post_flag=False, progress=None, run_id=None):
+        return {account: {'status': 'success', 'error': None} for account in accounts}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    manager = JobManager(FakeUploadPool(), store=JobStore(str(tmp_path / 'jobs.db')))
+    monkeypatch.setattr(app_module, 'get_job_manager', lambda: manager)
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+def test_upload_returns_202_with_job_urls(client):
+    response = client.post('/upload', data={'account': ['alice'], 'caption': 'caption'})
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status_url'] == f"/api/jobs/{body['job_id']}"
+    job = client.get(body['status_url'])
+    assert job.status_code == 200
+    assert job.get_json()['job_id'] == body['job_id']
+
+
+def test_unknown_job_returns_404(client):
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/events').status_code == 404
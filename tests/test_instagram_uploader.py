@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('selenium')
+
+from selenium.common.exceptions import TimeoutException
+import instagram_uploader
+from instagram_uploader import VIDEO_ATTEMPTS, InstagramUploader
+from network_monitor import ShareFailed
+
+
+class FakeDriver:
+    def __init__(self):
+        self.visited = []
+
+    def get(self, url):
+        self.visited.append(url)
+
+
+def make_uploader(monkeypatch, start_errors=(), share_error=None):
+    """「シェア」ボタンまでの操作とシェア完了の待機を置き換えたInstagramUploaderを作る"""
+    uploader = InstagramUploader.__new__(InstagramUploader)
+    uploader.driver = FakeDriver()
+    uploader.base_url = instagram_uploader.INSTAGRAM_URL
+    uploader._share_dialog_open = False
+    uploader.calls = {'start': 0, 'await': 0}
+    start_errors = list(start_errors)
+
+    def start_video(video_path, user_input_text):
+        uploader.calls['start'] += 1
+        if start_errors:
+            raise start_errors.pop(0)
+
+    def await_share(tab=None):
+        uploader.calls['await'] += 1
+        if share_error is not None:
+            raise share_error
+        return {'source': 'network', 'bytes_uploaded': 1000, 'server_seconds': 0.5}
+
+    monkeypatch.setattr(uploader, '_start_video', start_video, raising=False)
+    monkeypatch.setattr(uploader, '_await_share', await_share, raising=False)
+    return uploader
+
+
+def upload(uploader):
+    video = {'path': '/videos/a.mp4', 'status': 'pending', 'error': None}
+    reports = []
+    shared = uploader._upload_with_retry(1, video, 'caption', lambda state, **details: reports.append(state), 3)
+    return shared, video, reports
+
+
+def test_failure_before_the_share_click_is_retried(monkeypatch):
+    uploader = make_uploader(monkeypatch, start_errors=[RuntimeError('file input not found')])
+
+    shared, video, _ = upload(uploader)
+
+    assert shared is True
+    assert video['status'] == 'shared'
+    assert video['attempts'] == 2
+    assert uploader.calls == {'start': 2, 'await': 1}
+    assert uploader.driver.visited == [instagram_uploader.INSTAGRAM_URL]
+
+
+def test_timeout_after_the_share_click_is_unconfirmed_and_not_retried(monkeypatch):
+    uploader = make_uploader(monkeypatch, share_error=TimeoutException('share not confirmed'))
+
+    shared, video, reports = upload(uploader)
+
+    assert shared is False
+    assert video['status'] == 'unconfirmed'
+    assert video['attempts'] == 1
+    assert uploader.calls == {'start': 1, 'await': 1}
+    assert uploader.driver.visited == []
+    assert reports[-1] == 'unconfirmed'
+
+
+def test_rejected_share_is_failed_and_not_retried(monkeypatch):
+    uploader = make_uploader(monkeypatch, share_error=ShareFailed('configure returned 400'))
+
+    shared, video, _ = upload(uploader)
+
+    assert shared is False
+    assert video['status'] == 'failed'
+    assert uploader.calls == {'start': 1, 'await': 1}
+
+
+def test_gives_up_after_the_attempt_limit(monkeypatch):
+    uploader = make_uploader(monkeypatch, start_errors=[RuntimeError('error')] * VIDEO_ATTEMPTS)
+
+    shared, video, _ = upload(uploader)
+
+    assert shared is False
+    assert video['status'] == 'failed'
+    assert uploader.calls == {'start': VIDEO_ATTEMPTS, 'await': 0}
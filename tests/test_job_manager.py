@@ -0,0 +1,90 @@
+import threading
+import pytest
+from job_manager import JobManager, JobStore
+
+
+class FakeUploadPool:
+    def __init__(self, statuses=None, error=None):
+        """
+        :param statuses: アカウントごとの投稿結果のstatus。省略したアカウントはsuccess
+        :param error: 指定した場合はpost_accountsでこの例外を送出する
+        """
+        self.release = threading.Event()
+        self.statuses = statuses or {}
+        self.error = error
+
+    def post_accounts(self, accounts, caption, check_post_flag=False, progress=None, run_id=None):
+        for account in accounts:
+            progress(account, 'uploading', current=1, total=3)
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        results = {}
+        for account in accounts:
+            status = self.statuses.get(account, 'success')
+            results[account] = {'status': status, 'error': None if status == 'success' else f'{account} failed'}
+        return results
+
+
+def wait_until_finished(job):
+    version = job.to_dict()['version']
+    while job.to_dict()['status'] != 'finished':
+        new_version = job.wait_for_change(version, timeout=5)
+        assert new_version != version, 'job did not change within the timeout'
+        version = new_version
+    return job.to_dict()
+
+
+def test_job_moves_from_queued_to_running_to_finished(tmp_path):
+    pool = FakeUploadPool()
+    manager = JobManager(pool, store=JobStore(str(tmp_path / 'jobs.db')))
+
+    job = manager.submit(['alice', 'bob'], 'caption')
+    assert job.to_dict()['status'] in ('queued', 'running')
+    job.wait_for_change(0, timeout=5)
+    while job.to_dict()['progress']['bob']['state'] != 'uploading':
+        job.wait_for_change(job.to_dict()['version'], timeout=5)
+    assert job.to_dict()['status'] == 'running'
+
+    pool.release.set()
+    state = wait_until_finished(job)
+
+    assert state['status_code'] == 200
+    assert state['finished_at'] is not None
+    assert state['progress']['alice'] == {'state': 'uploading', 'current': 1, 'total': 3}
+
+
+@pytest.mark.parametrize('pool, status_code', [
+    (FakeUploadPool(statuses={'bob': 'failed'}), 207),
+    (FakeUploadPool(statuses={'alice': 'failed', 'bob': 'failed'}), 500),
+    (FakeUploadPool(error=RuntimeError('browser crashed')), 500),
+])
+def test_job_result_reflects_account_outcomes(tmp_path, pool, status_code):
+    manager = JobManager(pool, store=JobStore(str(tmp_path / 'jobs.db')))
+    pool.release.set()
+
+    state = wait_until_finished(manager.submit(['alice', 'bob'], 'caption'))
+
+    assert state['status_code'] == status_code
+    assert ('error' in state['result']) == (status_code == 500)
+
+
+def test_job_is_visible_from_another_manager(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    pool = FakeUploadPool()
+    worker, other = JobManager(pool, store=JobStore(db_path)), JobManager(pool, store=JobStore(db_path))
+
+    job = worker.submit(['alice'], 'caption')
+    stored = other.get(job.id)
+    version = stored.wait_for_change(0, timeout=5)
+
+    assert stored.to_dict()['progress']['alice']['state'] in ('queued', 'uploading')
+    pool.release.set()
+    for _ in range(10):
+        if stored.to_dict()['status'] == 'finished':
+            break
+        version = stored.wait_for_change(version, timeout=1)
+
+    assert stored.to_dict()['status_code'] == 200
+    assert stored.to_dict() == job.to_dict()
+    assert other.get('missing') is None
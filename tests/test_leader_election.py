@@ -0,0 +1,39 @@
+import time
+import leader_election
+from leader_election import LeaderElection, LeaderLease
+
+# clockフィクスチャで時計を置き換えるモジュール
+CLOCK_MODULES = (leader_election,)
+
+
+def test_leader_lease_is_exclusive_until_it_expires(clock, db_path):
+    first = LeaderLease('scheduler', db_path, lease_seconds=30)
+    second = LeaderLease('scheduler', db_path, lease_seconds=30)
+
+    assert first.acquire({'host': 'a'}) is True
+    assert second.acquire() is False
+    assert second.holder()['owner'] == first.owner
+
+    clock.advance(31)
+    assert second.acquire() is True
+    assert first.acquire() is False
+
+    second.release()
+    assert first.holder() is None
+    assert first.acquire() is True
+
+
+def test_election_calls_back_on_elected_and_deposed(db_path):
+    events = []
+    lease = LeaderLease('scheduler', db_path, lease_seconds=30)
+    election = LeaderElection(lease, lambda: events.append('elected'), lambda: events.append('deposed'), interval=0.01)
+
+    election.start()
+    for _ in range(500):
+        if election.is_leader:
+            break
+        time.sleep(0.01)
+    election.stop()
+
+    assert events == ['elected', 'deposed']
+    assert lease.holder() is None
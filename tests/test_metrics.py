@@ -0,0 +1,23 @@
+import urllib.error
+import urllib.request
+import pytest
+import metrics
+
+
+def test_serve_exposes_the_registry_over_http():
+    registry = metrics.Registry()
+    registry.counter('slots_total', 'slots').inc(2, outcome='queued')
+    registry.histogram('lag_seconds', 'lag', buckets=(1, 10)).observe(3)
+    server = metrics.serve(0, target=registry)
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        with urllib.request.urlopen(f'{base}/metrics') as response:
+            body = response.read().decode('utf-8')
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{base}/other')
+    finally:
+        server.shutdown()
+
+    assert 'slots_total{outcome="queued"} 2' in body
+    assert 'lag_seconds_bucket{le="10"} 1' in body
+    assert 'lag_seconds_count 1' in body
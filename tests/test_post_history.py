@@ -0,0 +1,124 @@
+import os
+import pytest
+from post_history import PostHistory, caption_hash
+from video_catalog import VideoCatalog, content_hash
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = PostHistory(str(tmp_path / 'post_history.db'))
+    yield history
+    history.close()
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    folder = tmp_path / 'videos'
+    folder.mkdir()
+    for name in ('a.mp4', 'b.mp4', 'c.mov'):
+        (folder / name).write_bytes(name.encode() * 100)
+    catalog = VideoCatalog(str(tmp_path / 'video_catalog.db'))
+    catalog.refresh(str(folder))
+    yield catalog, str(folder)
+    catalog.close()
+
+
+def entry(video_path, video_hash, outcome='shared', account='alice', **extra):
+    return dict(account=account, video_path=video_path, video_hash=video_hash, caption='caption', outcome=outcome, **extra)
+
+
+def test_catalog_hashes_match_file_contents(catalog):
+    catalog, folder = catalog
+    path = os.path.join(folder, 'a.mp4')
+
+    hashes = catalog.content_hashes([path, os.path.join(folder, 'missing.mp4')])
+
+    assert hashes == {path: content_hash(path, os.path.getsize(path))}
+
+
+def test_shared_videos_are_matched_by_catalog_hash(history, catalog):
+    catalog, folder = catalog
+    videos = catalog.videos(folder)
+    shared, failed, unconfirmed = videos
+
+    history.record([
+        entry(shared['path'], shared['content_hash']),
+        entry(failed['path'], failed['content_hash'], outcome='failed', error='error'),
+        entry(unconfirmed['path'], unconfirmed['content_hash'], outcome='unconfirmed'),
+    ])
+
+    assert history.unused_videos(videos) == [failed, unconfirmed]
+
+
+def test_hash_matches_a_renamed_source(history, catalog, tmp_path):
+    catalog, folder = catalog
+    original = catalog.videos(folder)[0]
+    history.record([entry(original['path'], original['content_hash'])])
+
+    renamed = os.path.join(folder, 'renamed.mp4')
+    os.rename(original['path'], renamed)
+    catalog.refresh(folder, force=True)
+
+    assert renamed not in [video['path'] for video in history.unused_videos(catalog.videos(folder))]
+
+
+def test_query_filters_and_pages_newest_first(history):
+    history.record([entry(f'/videos/{index}.mp4', f'hash-{index}', slot='2024-01-01 20:00') for index in range(5)])
+    history.record([entry('/videos/other.mp4', 'hash-other', account='bob')])
+
+    first = history.query(account='alice', limit=3)
+    second = history.query(account='alice', limit=3, cursor=first['next_cursor'])
+
+    assert [item['video_path'] for item in first['items']] == ['/videos/4.mp4', '/videos/3.mp4', '/videos/2.mp4']
+    assert [item['video_path'] for item in second['items']] == ['/videos/1.mp4', '/videos/0.mp4']
+    assert second['next_cursor'] is None
+    assert first['items'][0]['caption_hash'] == caption_hash('caption')
+    assert history.query(video_hash='hash-other')['items'][0]['account'] == 'bob'
+
+
+def test_stats_count_outcomes_per_account(history):
+    history.record([
+        entry('/videos/a.mp4', 'hash-a', started_at=100.0, finished_at=110.0, bytes_uploaded=1000),
+        entry('/videos/b.mp4', 'hash-b', outcome='failed', started_at=100.0, finished_at=130.0),
+        entry('/videos/c.mp4', 'hash-c', account='bob', outcome='unconfirmed'),
+    ])
+
+    stats = history.stats()
+
+    assert stats['totals'] == {'shared': 1, 'failed': 1, 'unconfirmed': 1}
+    assert stats['accounts'] == {'alice': {'shared': 1, 'failed': 1}, 'bob': {'unconfirmed': 1}}
+    assert stats['bytes_uploaded'] == 1000
+    assert stats['avg_duration_seconds'] == pytest.approx(40 / 3)
+
+
+def test_prepared_videos_carry_the_source_hash(catalog, tmp_path):
+    from upload_pool import UploadPool
+
+    catalog, folder = catalog
+
+    class ConfigManager:
+        video_catalog = catalog
+
+        def get_random_videos(self, video_folder, count):
+            return catalog.pick(video_folder, count)
+
+    class Preprocessor:
+        def prepare(self, paths):
+            # 変換後のファイルは動画フォルダの外に作られる
+            return [{'source': path, 'path': str(tmp_path / f'converted-{os.path.basename(path)}')} for path in paths], []
+
+        def shutdown(self):
+            pass
+
+    pool = UploadPool(ConfigManager(), folder, browser_pool=object(), preprocessor=Preprocessor(),
+                      checkpoints=object(), history=object())
+    try:
+        prepared = pool._prepare_videos()
+    finally:
+        pool._executor.shutdown()
+
+    hashes = {video['path']: video['content_hash'] for video in catalog.videos(folder)}
+    assert len(prepared) == 3
+    for video in prepared:
+        assert video['path'] != video['source']
+        assert video['source_hash'] == hashes[video['source']]
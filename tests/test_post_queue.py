@@ -0,0 +1,107 @@
+import threading
+import post_queue
+from post_queue import PostQueue
+
+# clockフィクスチャで時計を置き換えるモジュール
+CLOCK_MODULES = (post_queue,)
+
+
+def test_live_lease_is_not_claimed_by_another_worker(clock, db_path):
+    first, second = PostQueue(db_path), PostQueue(db_path)
+    first.enqueue_slot('2024-01-01 20:00', ['alice'], 'caption')
+
+    [task] = first.claim()
+    clock.advance(post_queue.LEASE_SECONDS - 1)
+
+    assert second.claim() == []
+    assert second.complete(task['id']) is False
+    assert second.fail(task['id'], 'error') is False
+    assert first.complete(task['id']) is True
+
+
+def test_heartbeat_keeps_the_lease(clock, db_path):
+    first, second = PostQueue(db_path), PostQueue(db_path)
+    first.enqueue_slot('2024-01-01 20:00', ['alice'], 'caption')
+    [task] = first.claim()
+
+    clock.advance(post_queue.LEASE_SECONDS - 1)
+    first.heartbeat([task['id']])
+    clock.advance(post_queue.LEASE_SECONDS - 1)
+
+    assert second.claim() == []
+
+
+def test_expired_lease_is_taken_over_and_the_old_owner_loses_it(clock, db_path):
+    first, second = PostQueue(db_path), PostQueue(db_path)
+    first.enqueue_slot('2024-01-01 20:00', ['alice'], 'caption')
+    [task] = first.claim()
+
+    clock.advance(post_queue.LEASE_SECONDS + 1)
+    [taken] = second.claim()
+
+    assert taken['id'] == task['id']
+    assert taken['attempt'] == 2
+    assert first.complete(task['id']) is False
+    first.heartbeat([task['id']])
+    assert second.complete(task['id']) is True
+    assert second.claim() == []
+
+
+def test_fail_schedules_a_retry_with_backoff(clock, db_path):
+    queue = PostQueue(db_path)
+    queue.enqueue_slot('2024-01-01 20:00', ['alice'], 'caption')
+    [task] = queue.claim()
+
+    assert queue.fail(task['id'], 'error') is True
+    assert queue.claim() == []
+    assert queue.next_due_in() == post_queue.RETRY_BASE_DELAY
+
+    clock.advance(post_queue.RETRY_BASE_DELAY)
+    [retry] = queue.claim()
+    assert retry['attempt'] == 2
+
+
+def test_release_returns_the_task_without_counting_an_attempt(clock, db_path):
+    queue = PostQueue(db_path)
+    queue.enqueue_slot('2024-01-01 20:00', ['alice'], 'caption')
+    [task] = queue.claim()
+
+    queue.release(task['id'])
+
+    [again] = queue.claim()
+    assert again['attempt'] == 1
+
+
+def test_not_before_delays_the_claim(clock, db_path):
+    queue = PostQueue(db_path)
+    queue.enqueue_slot('2024-01-01 20:00', ['alice', 'bob'], 'caption', {'alice': clock.now + 120})
+
+    assert [task['account'] for task in queue.claim(2)] == ['bob']
+    clock.advance(120)
+    assert [task['account'] for task in queue.claim(2)] == ['alice']
+
+
+def test_two_queues_sharing_a_file_never_claim_the_same_task(db_path):
+    accounts = [f'account-{index}' for index in range(60)]
+    PostQueue(db_path).enqueue_slot('2024-01-01 20:00', accounts, 'caption')
+    claimed = {}
+    start = threading.Barrier(2)
+
+    def worker(name):
+        queue = PostQueue(db_path)
+        tasks = claimed[name] = []
+        start.wait()
+        while True:
+            batch = queue.claim(3)
+            if not batch:
+                return
+            tasks.extend(task['id'] for task in batch)
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in ('web', 'scheduler')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not set(claimed['web']) & set(claimed['scheduler'])
+    assert len(claimed['web']) + len(claimed['scheduler']) == len(accounts)
@@ -0,0 +1,160 @@
+from datetime import date, datetime, timedelta
+import pytest
+from post_schedule import MAX_POSTS_PER_DAY, CronExpression, Schedule, Timeline
+
+# 2024-01-05 は金曜日
+FRIDAY = datetime(2024, 1, 5)
+
+
+def schedule(entries, overrides=None, caption='caption'):
+    data = {'caption': caption, 'entries': entries}
+    if overrides is not None:
+        data['overrides'] = overrides
+    return Schedule.from_dict(data)
+
+
+def test_cron_occurrences_on_weekdays():
+    cron = CronExpression('0 9,18 * * 1-5')
+
+    occurrences = list(cron.occurrences(FRIDAY, FRIDAY + timedelta(days=4)))
+
+    assert occurrences == [
+        datetime(2024, 1, 5, 9), datetime(2024, 1, 5, 18),
+        datetime(2024, 1, 8, 9), datetime(2024, 1, 8, 18),
+    ]
+
+
+def test_cron_occurrences_exclude_start_and_include_end():
+    cron = CronExpression('*/30 9 * * *')
+
+    occurrences = list(cron.occurrences(datetime(2024, 1, 5, 9, 0), datetime(2024, 1, 6, 9, 0)))
+
+    assert occurrences == [datetime(2024, 1, 5, 9, 30), datetime(2024, 1, 6, 9, 0)]
+
+
+def test_cron_day_and_weekday_match_either():
+    cron = CronExpression('0 12 1 * 1')
+
+    assert cron.matches_day(date(2024, 2, 1))  # 1日（木曜日）
+    assert cron.matches_day(date(2024, 1, 8))  # 月曜日
+    assert not cron.matches_day(date(2024, 1, 9))
+
+
+@pytest.mark.parametrize('expression', ['0 9 * *', '60 9 * * *', '0 9 * * mon', '0 5-2 * * *'])
+def test_invalid_cron_expression(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_timeline_pops_at_post_time_and_keeps_the_jitter():
+    timeline = Timeline(horizon_days=1, jitter=lambda: 90)
+    timeline.update(schedule([{'id': 'morning', 'cron': '0 9 * * *', 'accounts': ['alice', 'bob']}]), now=FRIDAY)
+
+    post_time = datetime(2024, 1, 5, 9)
+    assert timeline.next_post_time() == post_time
+    assert timeline.pop_due(post_time - timedelta(seconds=1)) == []
+
+    due = timeline.pop_due(post_time)
+
+    assert [(occurrence['account'], occurrence['post_time'], occurrence['fire_time']) for occurrence in due] == [
+        ('alice', post_time, post_time + timedelta(seconds=90)),
+        ('bob', post_time, post_time + timedelta(seconds=90)),
+    ]
+    assert timeline.next_post_time() is None
+
+
+def test_timeline_applies_per_account_offset_and_caption():
+    timeline = Timeline(horizon_days=1)
+    timeline.update(schedule(
+        [{'id': 'morning', 'cron': '0 9 * * *', 'accounts': ['alice', 'bob']}],
+        overrides={'bob': {'offset_minutes': 15, 'caption': 'bob caption'}, 'alice': {'enabled': True}},
+    ), now=FRIDAY)
+
+    upcoming = timeline.upcoming()
+
+    assert [(occurrence['account'], occurrence['post_time'], occurrence['caption']) for occurrence in upcoming] == [
+        ('alice', datetime(2024, 1, 5, 9), 'caption'),
+        ('bob', datetime(2024, 1, 5, 9, 15), 'bob caption'),
+    ]
+    assert upcoming[0]['fire_time'] == upcoming[0]['post_time']
+
+
+def test_timeline_update_recalculates_only_changed_slots():
+    timeline = Timeline(horizon_days=2)
+    entries = [{'id': 'morning', 'cron': '0 9 * * *', 'accounts': ['alice', 'bob']}]
+    timeline.update(schedule(entries), now=FRIDAY)
+    assert len(timeline) == 4
+
+    changed = timeline.update(schedule(entries, overrides={'bob': {'enabled': False}}), now=FRIDAY)
+
+    assert changed == 1
+    assert len(timeline) == 2
+    assert {occurrence['account'] for occurrence in timeline.upcoming()} == {'alice'}
+
+
+def test_timeline_extend_adds_new_days():
+    timeline = Timeline(horizon_days=1)
+    timeline.update(schedule([{'id': 'morning', 'cron': '0 9 * * *', 'accounts': ['alice']}]), now=FRIDAY)
+    timeline.pop_due(datetime(2024, 1, 5, 9))
+
+    timeline.extend(FRIDAY + timedelta(days=1))
+
+    assert timeline.next_post_time() == datetime(2024, 1, 6, 9)
+
+
+def test_timeline_drop_missed_discards_only_old_occurrences():
+    timeline = Timeline(horizon_days=1)
+    timeline.update(schedule([{'cron': '0 * * * *', 'accounts': ['alice']}]), now=FRIDAY)
+    resumed = datetime(2024, 1, 5, 6, 5)
+
+    assert timeline.drop_missed(resumed - timedelta(minutes=10)) == 5
+    assert [occurrence['post_time'] for occurrence in timeline.pop_due(resumed)] == [datetime(2024, 1, 5, 6)]
+    assert len(timeline) == 18
+
+
+def test_legacy_format_is_converted_to_daily_entries():
+    legacy = Schedule.from_dict({'post_times': ['09:00', '18:30'], 'accounts': ['alice'], 'caption': 'caption'})
+
+    assert [entry.cron.expression for entry in legacy.entries] == ['0 9 * * *', '30 18 * * *']
+    assert legacy.accounts == ['alice']
+
+
+@pytest.mark.parametrize('data', [
+    {'entries': [{'cron': '0 9 * * *', 'accounts': 'alice'}]},
+    {'entries': [{'cron': '0 9 * * *', 'accounts': ['alice']}], 'overrides': {'alice': {'offset_minutes': 'ten'}}},
+    {'entries': [{'cron': '0 9 * * *', 'accounts': ['alice']}], 'overrides': ['alice']},
+    {'entries': [{'cron': '0 9 * * *', 'accounts': ['alice']}], 'overrides': {'alice': 15}},
+    {'entries': [{'cron': 9, 'accounts': ['alice']}]},
+    {'entries': [{'accounts': ['alice']}]},
+    {'post_times': ['9時'], 'accounts': ['alice'], 'caption': 'caption'},
+    ['not', 'a', 'schedule'],
+])
+def test_malformed_schedule_raises_value_error(data):
+    with pytest.raises(ValueError):
+        Schedule.from_dict(data)
+
+
+def test_numeric_offset_string_is_normalised():
+    parsed = schedule([{'cron': '0 9 * * *', 'accounts': ['alice']}], overrides={'alice': {'offset_minutes': '-30'}})
+
+    assert parsed.overrides == {'alice': {'offset_minutes': -30}}
+
+
+def test_validate_rejects_too_many_posts_per_day():
+    hours = ','.join(str(hour) for hour in range(MAX_POSTS_PER_DAY))
+    daily = {'id': 'daily', 'cron': f'0 {hours} * * *', 'accounts': ['alice']}
+    friday = {'id': 'friday', 'cron': '30 23 * * 5', 'accounts': ['alice']}
+
+    schedule([daily]).validate(today=FRIDAY.date())
+    # 金曜日だけ上限を超える場合も、1週間分の各日を数えて検出する
+    with pytest.raises(ValueError):
+        schedule([daily, friday]).validate(today=FRIDAY.date() + timedelta(days=1))
+
+
+def test_validate_rejects_entries_posting_the_same_account_in_the_same_minute():
+    morning = {'id': 'morning', 'cron': '0 9 * * *', 'accounts': ['alice', 'bob']}
+    friday = {'id': 'friday', 'cron': '0 9 * * 5', 'accounts': ['alice']}
+
+    schedule([morning, dict(friday, accounts=['carol'])]).validate(today=FRIDAY.date())
+    with pytest.raises(ValueError, match='alice'):
+        schedule([morning, friday]).validate(today=FRIDAY.date() + timedelta(days=1))
@@ -0,0 +1,40 @@
+import threading
+from concurrent.futures import Future
+from post_queue import PostQueue
+from scheduler import Scheduler
+
+
+class FakeConfigManager:
+    def get_random_wait_time(self):
+        return 0
+
+    def load_schedule(self):
+        return None
+
+
+class FakeUploadPool:
+    max_workers = 2
+
+
+def test_stop_releases_unstarted_tasks_and_waits_for_running_ones(tmp_path):
+    db_path = str(tmp_path / 'post_queue.db')
+    queue = PostQueue(db_path)
+    queue.enqueue_slot('2024-01-01 20:00', ['alice', 'bob'], 'caption')
+    scheduler = Scheduler(FakeConfigManager(), str(tmp_path / 'videos'), upload_pool=FakeUploadPool(), post_queue=queue)
+
+    running, waiting = Future(), Future()
+    running.set_running_or_notify_cancel()
+    tasks = queue.claim(2)
+    for task, future in zip(tasks, (running, waiting)):
+        scheduler._in_flight[task['id']] = future
+        future.add_done_callback(lambda f, task=task: scheduler._finish_task(task, f))
+    threading.Timer(0.1, running.set_result, [{'status': 'success', 'error': None}]).start()
+
+    scheduler._drain_in_flight()
+
+    assert running.done() and waiting.cancelled()
+    assert scheduler._in_flight == {}
+    # 実行を始めていなかったタスクだけが、リースの期限を待たずに別のプロセスから取得できる
+    [released] = PostQueue(db_path).claim(2)
+    assert released['account'] == tasks[1]['account']
+    assert released['attempt'] == 1
@@ -0,0 +1,75 @@
+import threading
+import pytest
+from leader_election import AccountLocks
+from upload_pool import UploadPool
+
+
+def ignore_progress(account, state, **details):
+    pass
+
+
+@pytest.fixture
+def make_pool(tmp_path):
+    pools = []
+
+    def make_pool(upload_account=None):
+        pool = UploadPool(object(), str(tmp_path / 'videos'), browser_pool=object(), preprocessor=object(),
+                          checkpoints=object(), history=object(),
+                          account_locks=AccountLocks(str(tmp_path / 'post_queue.db')))
+        if upload_account is not None:
+            pool._upload_account = upload_account
+        pools.append(pool)
+        return pool
+
+    yield make_pool
+    for pool in pools:
+        pool._executor.shutdown()
+
+
+def blocking_upload():
+    """started をセットし、release がセットされるまで戻らない _upload_account"""
+    started, release = threading.Event(), threading.Event()
+
+    def upload_account(account, caption, check_post_flag, progress, run_id, slot=None):
+        started.set()
+        release.wait(5)
+        return {'status': 'success', 'error': None}
+
+    return upload_account, started, release
+
+
+def test_account_is_not_posted_twice_at_once_in_one_pool(make_pool):
+    upload_account, started, release = blocking_upload()
+    pool = make_pool(upload_account)
+
+    future = pool.submit('alice', 'caption')
+    assert started.wait(5)
+    blocked = pool._post_account('alice', 'caption', False, ignore_progress, None)
+    other = pool.submit('bob', 'caption')
+    release.set()
+
+    assert blocked == {'status': 'failed', 'error': 'アカウント alice は別の投稿処理が実行中です'}
+    assert future.result(5)['status'] == 'success'
+    assert other.result(5)['status'] == 'success'
+    # 拒否された呼び出しは実行中の処理の状態を消さず、終了後は再び投稿できる
+    assert pool._active_accounts == set()
+    assert pool._post_account('alice', 'caption', False, ignore_progress, None)['status'] == 'success'
+
+
+def test_account_is_not_posted_by_two_processes_at_once(make_pool):
+    upload_account, started, release = blocking_upload()
+    first = make_pool(upload_account)
+    second = make_pool(lambda *args, **kwargs: pytest.fail('the account is locked by the other pool'))
+
+    future = first.submit('alice', 'caption')
+    assert started.wait(5)
+    blocked = second._post_account('alice', 'caption', False, ignore_progress, None)
+    release.set()
+
+    assert blocked['status'] == 'failed'
+    assert '別のプロセス' in blocked['error']
+    assert future.result(5)['status'] == 'success'
+
+    # ロックは投稿処理の終了時に解放される
+    second._upload_account = lambda *args, **kwargs: {'status': 'success', 'error': None}
+    assert second._post_account('alice', 'caption', False, ignore_progress, None)['status'] == 'success'
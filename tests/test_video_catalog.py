@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+import video_catalog
+from video_catalog import VideoCatalog
+
+
+def make_videos(folder, count):
+    folder.mkdir(exist_ok=True)
+    for i in range(count):
+        (folder / f'video{i:02d}.mp4').write_bytes(f'video {i}'.encode())
+    return str(folder)
+
+
+def test_two_catalogs_on_one_db_never_pick_the_same_video(tmp_path):
+    folder = make_videos(tmp_path / 'videos', 40)
+    db_path = str(tmp_path / 'video_catalog.db')
+    catalogs = [VideoCatalog(db_path), VideoCatalog(db_path)]
+    catalogs[0].refresh(folder)
+    picked = []
+    start = threading.Barrier(len(catalogs))
+
+    def worker(catalog):
+        start.wait()
+        for _ in range(10):
+            picked.extend(catalog.pick(folder, 2))
+
+    threads = [threading.Thread(target=worker, args=(catalog,)) for catalog in catalogs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(picked) == 40
+    assert len(set(picked)) == 40
+
+
+def test_ensure_indexed_scans_a_new_folder_before_returning(tmp_path):
+    folder = make_videos(tmp_path / 'videos', 3)
+    catalog = VideoCatalog(str(tmp_path / 'video_catalog.db'))
+
+    catalog.ensure_indexed(folder)
+
+    assert len(catalog.pick(folder, 3)) == 3
+
+
+def test_ensure_indexed_rescans_a_changed_folder_in_the_background(tmp_path, monkeypatch):
+    folder = make_videos(tmp_path / 'videos', 1)
+    catalog = VideoCatalog(str(tmp_path / 'video_catalog.db'))
+    catalog.ensure_indexed(folder)
+
+    scan_started, release_scan = threading.Event(), threading.Event()
+    original_scan = os.scandir
+
+    def slow_scandir(path):
+        scan_started.set()
+        release_scan.wait(5)
+        return original_scan(path)
+
+    monkeypatch.setattr(video_catalog.os, 'scandir', slow_scandir)
+    (tmp_path / 'videos' / 'new.mp4').write_bytes(b'new video')
+    os.utime(folder, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+    catalog.ensure_indexed(folder)
+    assert scan_started.wait(5)
+    # スキャンの完了を待たずに、現在の索引から選べる
+    assert [os.path.basename(path) for path in catalog.pick(folder, 2)] == ['video00.mp4']
+
+    release_scan.set()
+    deadline = time.time() + 5
+    while catalog._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(catalog.pick(folder, 2)) == 2
@@ -0,0 +1,165 @@
+import threading
+from selenium.webdriver.common.by import By
+from logger import setup_logger
+
+logger = setup_logger('ui_selectors', 'logs/ui_selectors.log')
+
+# UI要素ごとの候補ロケーター（優先順）。先頭が従来のセレクタで、以降はマークアップ変更時の代替
+UI_TARGETS = {
+    'later_button': [
+        (By.XPATH, '//button[contains(@class, "_a9--") and contains(@class, "ap36") and contains(@class, "a9_1") and contains(text(), "後で")]'),
+        (By.XPATH, '//button[contains(text(), "後で")]'),
+        (By.XPATH, '//button[contains(text(), "Not Now")]'),
+    ],
+    'new_post': [
+        (By.CSS_SELECTOR, 'div svg[aria-label="新規投稿"]'),
+        (By.CSS_SELECTOR, 'svg[aria-label="New post"]'),
+    ],
+    'post_menu': [
+        (By.XPATH, '//div[contains(@class, "x9f619") and contains(@class, "xjbqb8w")]//span[contains(text(), "Post") or contains(text(), "投稿")]'),
+        (By.XPATH, '//a[@role="link"]//span[text()="投稿" or text()="Post"]'),
+    ],
+    'file_input': [
+        (By.CSS_SELECTOR, 'input[type="file"]._ac69'),
+        (By.CSS_SELECTOR, 'form[enctype="multipart/form-data"] input[type="file"]'),
+        (By.CSS_SELECTOR, 'input[type="file"][accept*="video"]'),
+    ],
+    'upload_next': [
+        (By.CSS_SELECTOR, 'button._acan._acap._acaq._acas._acav._aj1-[type="button"]'),
+        (By.XPATH, '//div[@role="dialog"]//button[text()="OK"]'),
+    ],
+    'crop': [
+        (By.CSS_SELECTOR, "div.x9f619.xjbqb8w.x78zum5.x168nmei.x13lgxp2.x5pf9jr.xo71vjh.x1y1aw1k.x1sxyh0.xwib8y2.xurb0ha.x1n2onr6.x1plvlek.xryxfnj.x1c4vz4f.x2lah0s.x1q0g3np.xqjyukv.x6s0dn4.x1oa3qoh.xl56j7k svg[aria-label='切り取りを選択']"),
+        (By.CSS_SELECTOR, "svg[aria-label='切り取りを選択']"),
+        (By.CSS_SELECTOR, "svg[aria-label='Select crop']"),
+    ],
+    'vertical_crop': [
+        (By.CSS_SELECTOR, "div.x9f619.xjbqb8w.x78zum5.x168nmei.x13lgxp2.x5pf9jr.xo71vjh.xz9dl7a.xn6708d.xsag5q8.x1ye3gou.x1n2onr6.x1plvlek.xryxfnj.x1c4vz4f.x2lah0s.xdt5ytf.xqjyukv.x1qjc9v5.x1oa3qoh.x1nhvcw1 svg[aria-label='縦型トリミングアイコン']"),
+        (By.CSS_SELECTOR, "svg[aria-label='縦型トリミングアイコン']"),
+        (By.CSS_SELECTOR, "svg[aria-label='Crop portrait icon']"),
+    ],
+    'next': [
+        (By.XPATH, '//div[text()="次へ"]'),
+        (By.XPATH, '//div[@role="button" and text()="Next"]'),
+    ],
+    'caption': [
+        (By.CSS_SELECTOR, 'div[aria-label="キャプションを入力…"]'),
+        (By.CSS_SELECTOR, 'div[aria-label="Write a caption..."]'),
+        (By.CSS_SELECTOR, 'div[role="dialog"] div[contenteditable="true"][role="textbox"]'),
+    ],
+    'share': [
+        (By.XPATH, '//div[text()="シェア"]'),
+        (By.XPATH, '//div[@role="button" and text()="Share"]'),
+    ],
+    'share_done': [
+        (By.XPATH, '//div[text()="リール動画がシェアされました"]'),
+        (By.XPATH, '//*[text()="リール動画がシェアされました" or text()="Your reel has been shared."]'),
+    ],
+    'close_dialog': [
+        (By.CSS_SELECTOR, 'div[role="dialog"] svg[aria-label="閉じる"]'),
+        (By.CSS_SELECTOR, 'svg[aria-label="閉じる"]'),
+        (By.CSS_SELECTOR, 'svg[aria-label="Close"]'),
+    ],
+}
+
+# 表示されていなくても見つかれば良いターゲット
+HIDDEN_TARGETS = {'file_input', 'share_done'}
+
+# 候補を順に評価し、ターゲットごとに最初に見つかった（必要なら表示・有効な）要素を返す
+_PROBE_SCRIPT = '''
+var candidates = arguments[0];
+var found = {};
+function usable(el, needVisible) {
+    if (!needVisible) return true;
+    return el.getClientRects().length > 0 && !el.disabled && el.getAttribute('aria-disabled') !== 'true';
+}
+for (var i = 0; i < candidates.length; i++) {
+    var c = candidates[i];
+    var name = c[0];
+    if (found[name]) continue;
+    var nodes = [];
+    if (c[2] === 'xpath') {
+        var result = document.evaluate(c[3], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (var j = 0; j < result.snapshotLength; j++) nodes.push(result.snapshotItem(j));
+    } else {
+        nodes = document.querySelectorAll(c[3]);
+    }
+    for (var k = 0; k < nodes.length; k++) {
+        if (usable(nodes[k], c[4])) {
+            found[name] = [c[1], nodes[k]];
+            break;
+        }
+    }
+}
+return found;
+'''
+
+
+class SelectorResolver:
+    """UI要素の候補ロケーターを1回のJavaScript実行でまとめて評価するリゾルバー"""
+
+    # 前回成功した候補のインデックス（全インスタンスで共有）
+    _winners = {}
+    _winners_lock = threading.Lock()
+
+    def __init__(self, targets=None):
+        """
+        :param targets: ターゲット名から候補ロケーターのリストへの辞書。省略時はUI_TARGETS
+        """
+        self.targets = targets or UI_TARGETS
+
+    def probe(self, driver, names):
+        """
+        指定したターゲットの全候補を1回のラウンドトリップで調べる
+
+        :param driver: ChromeDriver
+        :param names: ターゲット名のリスト
+        :return: 見つかったターゲット名から要素への辞書
+        """
+        candidates = []
+        for name in names:
+            for index in self._ordered_indexes(name):
+                by, selector = self.targets[name][index]
+                kind = 'xpath' if by == By.XPATH else 'css'
+                candidates.append([name, index, kind, selector, name not in HIDDEN_TARGETS])
+
+        found = driver.execute_script(_PROBE_SCRIPT, candidates) or {}
+        elements = {}
+        for name, (index, element) in found.items():
+            self._remember(name, index)
+            elements[name] = element
+        return elements
+
+    def wait_for(self, names, required=None):
+        """
+        WebDriverWait用の条件を返す
+
+        :param names: 調べるターゲット名のリスト（任意のダイアログも含める）
+        :param required: このいずれかが見つかった時点で待機を終える。省略時はnamesのいずれか
+        :return: 見つかった要素の辞書を返す条件関数
+        """
+        required = required or names
+
+        def condition(driver):
+            found = self.probe(driver, names)
+            if any(name in found for name in required):
+                return found
+            return False
+
+        return condition
+
+    def _ordered_indexes(self, name):
+        indexes = list(range(len(self.targets[name])))
+        with self._winners_lock:
+            winner = self._winners.get(name)
+        if winner is not None and winner < len(indexes):
+            indexes.remove(winner)
+            indexes.insert(0, winner)
+        return indexes
+
+    def _remember(self, name, index):
+        with self._winners_lock:
+            previous = self._winners.get(name)
+            self._winners[name] = index
+        if previous != index and index > 0:
+            logger.warning("%s は代替セレクタ (候補%d) で見つかりました", name, index + 1)
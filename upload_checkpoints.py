@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import threading
+import time
+from logger import setup_logger
+
+logger = setup_logger('upload_checkpoints', 'logs/upload_checkpoints.log')
+
+
+class UploadCheckpoints:
+    """実行ごと・アカウントごとに、選んだ動画とシェア済み・結果不明の動画を記録するチェックポイント"""
+
+    def __init__(self, db_path='upload_checkpoints.db'):
+        """
+        :param db_path: チェックポイントを保存するSQLiteファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT NOT NULL,
+                account TEXT NOT NULL,
+                videos TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (run_id, account)
+            );
+            CREATE TABLE IF NOT EXISTS shared_videos (
+                run_id TEXT NOT NULL,
+                account TEXT NOT NULL,
+                video_index INTEGER NOT NULL,
+                shared_at REAL NOT NULL,
+                PRIMARY KEY (run_id, account, video_index)
+            );
+            CREATE TABLE IF NOT EXISTS unconfirmed_videos (
+                run_id TEXT NOT NULL,
+                account TEXT NOT NULL,
+                video_index INTEGER NOT NULL,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (run_id, account, video_index)
+            );
+        ''')
+        self._conn.commit()
+        logger.info(f"UploadCheckpointsが初期化されました: {db_path}")
+
+    def load(self, run_id, account):
+        """
+        前回の試行で選んだ動画と、シェア済み・結果不明の動画番号を返す
+
+        :return: (動画パスのリスト, シェア済みの動画番号の集合, 結果不明の動画番号の集合)。
+                 記録が無い場合は (None, 空集合, 空集合)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT videos FROM runs WHERE run_id = ? AND account = ?', (run_id, account)
+            ).fetchone()
+            shared = {
+                index for index, in self._conn.execute(
+                    'SELECT video_index FROM shared_videos WHERE run_id = ? AND account = ?', (run_id, account)
+                )
+            }
+            unconfirmed = {
+                index for index, in self._conn.execute(
+                    'SELECT video_index FROM unconfirmed_videos WHERE run_id = ? AND account = ?', (run_id, account)
+                )
+            }
+        if row is None:
+            return None, set(), set()
+        return json.loads(row[0]), shared, unconfirmed
+
+    def start(self, run_id, account, video_paths):
+        """この実行でアカウントに投稿する動画を記録する"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO runs (run_id, account, videos, created_at) VALUES (?, ?, ?, ?)',
+                (run_id, account, json.dumps(video_paths, ensure_ascii=False), time.time())
+            )
+
+    def record_shared(self, run_id, account, video_index):
+        """動画のシェア完了を記録する"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO shared_videos (run_id, account, video_index, shared_at) VALUES (?, ?, ?, ?)',
+                (run_id, account, video_index, time.time())
+            )
+        logger.info(f"チェックポイントを記録しました: run={run_id}, account={account}, video={video_index}")
+
+    def record_unconfirmed(self, run_id, account, video_index):
+        """「シェア」ボタンを押した後に結果を確認できなかった動画を記録する（再開時に投稿し直さない）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO unconfirmed_videos (run_id, account, video_index, recorded_at) VALUES (?, ?, ?, ?)',
+                (run_id, account, video_index, time.time())
+            )
+        logger.warning(f"結果不明の動画を記録しました: run={run_id}, account={account}, video={video_index}")
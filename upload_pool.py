@@ -0,0 +1,246 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from browser_pool import BrowserPool
+from leader_election import AccountLocks
+from logger import log_context, setup_logger
+import metrics
+from post_history import PostHistory
+from upload_checkpoints import UploadCheckpoints
+from video_preprocessor import VideoPreprocessor
+from wait_policy import WaitPolicy
+
+logger = setup_logger('upload_pool', 'logs/upload_pool.log')
+
+DEFAULT_MAX_WORKERS = 3
+VIDEOS_PER_ACCOUNT = 3
+# 投稿できない動画を除外した後、代わりの動画を選び直す回数の上限
+MAX_VIDEO_PICK_ATTEMPTS = 3
+
+ACCOUNT_UPLOADS_TOTAL = metrics.counter('account_uploads_total', 'アカウントごとの投稿処理の結果')
+ACCOUNT_UPLOAD_SECONDS = metrics.histogram('account_upload_seconds', 'アカウント1件の投稿処理にかかった時間（秒）')
+VIDEO_PREPARE_SECONDS = metrics.histogram('video_prepare_seconds', 'アカウント1件分の動画の選択・事前処理にかかった時間（秒）')
+BROWSER_WAIT_SECONDS = metrics.histogram('browser_wait_seconds', 'ブラウザの貸し出しを待った時間（秒）')
+
+
+def _ignore_progress(account, state, **details):
+    pass
+
+
+class UploadPool:
+    """複数アカウントへの投稿を並列に実行するワーカープール"""
+
+    def __init__(self, config_manager, video_folder, max_workers=DEFAULT_MAX_WORKERS, browser_pool=None, preprocessor=None,
+                 checkpoints=None, videos_in_flight=1, history=None, account_locks=None):
+        """
+        :param config_manager: アカウント情報と動画の取得に使うConfigManager
+        :param video_folder: 動画フォルダのパス
+        :param max_workers: 同時に投稿処理を行うアカウント数の上限
+        :param browser_pool: ブラウザの貸し出しに使うBrowserPool。省略時はmax_workersと同じサイズで作成する
+        :param preprocessor: 動画の事前検査・変換に使うVideoPreprocessor。省略時は既定の設定で作成する
+        :param checkpoints: 動画ごとの進捗を記録するUploadCheckpoints。省略時は既定の設定で作成する
+        :param videos_in_flight: 1アカウント内でシェア処理の完了を待たずに進める動画の数（1の場合は順番に投稿する）
+        :param history: 動画ごとの投稿結果を記録するPostHistory。省略時は既定の設定で作成する
+        :param account_locks: 他のプロセス（Webのワーカー、scheduler_service.py）と同じアカウントを同時に操作しないための
+                              AccountLocks。省略時は既定の設定で作成する
+        """
+        self.config_manager = config_manager
+        self.video_folder = video_folder
+        self.max_workers = max_workers
+        self.browser_pool = browser_pool or BrowserPool(size=max_workers)
+        self.preprocessor = preprocessor or VideoPreprocessor()
+        self.checkpoints = checkpoints or UploadCheckpoints()
+        self.videos_in_flight = videos_in_flight
+        self.history = history or PostHistory()
+        self.account_locks = account_locks or AccountLocks()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+        # このプロセスで投稿処理中のアカウント（1アカウントにつき同時に1セッションまで。他のプロセスとはaccount_locksで調整する）
+        self._active_accounts = set()
+        self._active_lock = threading.Lock()
+        logger.info("UploadPoolが初期化されました: max_workers=%d, videos_in_flight=%d", max_workers, videos_in_flight)
+
+    def post_accounts(self, accounts, caption, check_post_flag=False, progress=None, run_id=None):
+        """
+        指定されたアカウントに並列で動画を投稿し、全ての完了を待つ
+
+        :param accounts: 投稿先のユーザー名のリスト
+        :param caption: 投稿のキャプション
+        :param check_post_flag: Trueの場合、投稿フラグがFalseのアカウントをスキップする
+        :param progress: 進捗の通知を受け取る関数 progress(account, state, **details)
+        :param run_id: 実行の識別子。指定すると同じrun_idでの再実行時にシェア済みの動画を飛ばす
+        :return: ユーザー名をキーとする結果の辞書
+                 {'status': 'success'|'failed'|'unconfirmed'|'skipped', 'error': str|None, 'videos': 動画ごとの結果のリスト}
+                 'unconfirmed' は、シェアしなかった動画が全て「シェア」ボタンを押した後に結果を確認できなかったもの
+                 （投稿されている可能性があるため、再試行してはいけない）
+        """
+        logger.info("%d個のアカウントへの並列投稿を開始します (max_workers=%d)", len(accounts), self.max_workers)
+        progress = progress or _ignore_progress
+        futures = {}
+        for account in dict.fromkeys(accounts):
+            futures[account] = self.submit(account, caption, check_post_flag, progress, run_id)
+
+        results = {}
+        for account, future in futures.items():
+            try:
+                results[account] = future.result()
+            except Exception as e:
+                error_message = f"アカウント {account} でエラーが発生しました: {str(e)}"
+                logger.exception(error_message)
+                results[account] = {'status': 'failed', 'error': error_message}
+                progress(account, 'failed', error=error_message)
+        logger.info("全てのアカウントの並列投稿が完了しました")
+        return results
+
+    def submit(self, account, caption, check_post_flag=False, progress=None, run_id=None, slot=None):
+        """
+        1つのアカウントへの投稿をワーカープールに登録する
+
+        :param slot: スケジュールの投稿枠（投稿履歴に記録する）
+
+        :return: post_accountsと同じ形式の結果を返すFuture
+        """
+        return self._executor.submit(self._post_account, account, caption, check_post_flag,
+                                     progress or _ignore_progress, run_id, slot)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self.browser_pool.close()
+        self.preprocessor.shutdown()
+        logger.info("UploadPoolを停止しました")
+
+    def _post_account(self, account, caption, check_post_flag, progress, run_id, slot=None):
+        with self._active_lock:
+            busy = account in self._active_accounts
+            self._active_accounts.add(account)
+
+        if busy:
+            error_message = f"アカウント {account} は別の投稿処理が実行中です"
+            logger.warning(error_message)
+            result = {'status': 'failed', 'error': error_message}
+        elif not self.account_locks.acquire(account):
+            with self._active_lock:
+                self._active_accounts.discard(account)
+            error_message = f"アカウント {account} は別のプロセスで投稿処理が実行中です"
+            logger.warning(error_message)
+            result = {'status': 'failed', 'error': error_message}
+        else:
+            started = time.monotonic()
+            try:
+                with log_context(account=account, job=run_id):
+                    result = self._upload_account(account, caption, check_post_flag, progress, run_id, slot)
+            finally:
+                self.account_locks.release(account)
+                with self._active_lock:
+                    self._active_accounts.discard(account)
+            ACCOUNT_UPLOAD_SECONDS.observe(time.monotonic() - started, outcome=result['status'])
+        ACCOUNT_UPLOADS_TOTAL.inc(account=account, outcome=result['status'])
+        progress(account, result['status'], error=result['error'])
+        return result
+
+    def _upload_account(self, account, caption, check_post_flag, progress, run_id, slot=None):
+        logger.info("アカウント %s の投稿処理を開始", account)
+        account_info = self.config_manager.get_account(account)
+        if not account_info:
+            error_message = f'アカウント {account} が見つかりません'
+            logger.error(error_message)
+            return {'status': 'failed', 'error': error_message}
+
+        if check_post_flag and not account_info['postFlag']:
+            logger.info("アカウント %s は投稿フラグがFalseのためスキップします", account)
+            return {'status': 'skipped', 'error': None}
+
+        # 同じ実行の再試行であれば、前回選んだ動画とシェア済み・結果不明の動画を引き継ぐ
+        prepared, completed, unconfirmed = self.checkpoints.load(run_id, account) if run_id else (None, set(), set())
+        if prepared is None:
+            progress(account, 'preparing')
+            with VIDEO_PREPARE_SECONDS.time():
+                prepared = self._prepare_videos()
+            if len(prepared) < VIDEOS_PER_ACCOUNT:
+                error_message = f'アカウント {account} の投稿に失敗しました: 十分な数の動画ファイルが見つかりません'
+                logger.error(error_message)
+                return {'status': 'failed', 'error': error_message}
+            if run_id:
+                self.checkpoints.start(run_id, account, prepared)
+        else:
+            # 以前のチェックポイントにはアップロード用のパスだけが記録されている
+            prepared = [
+                video if isinstance(video, dict) else {'path': video, 'source': video, 'source_hash': None}
+                for video in prepared
+            ]
+        video_paths = [video['path'] for video in prepared]
+
+        if len(completed | unconfirmed) >= len(video_paths):
+            # 再試行しても投稿する動画が残っていないため、ブラウザを使わずに前回の結果を返す
+            videos = [
+                {'path': path, 'status': 'shared' if i in completed else 'unconfirmed', 'error': None}
+                for i, path in enumerate(video_paths, 1)
+            ]
+            if not unconfirmed - completed:
+                return {'status': 'success', 'error': None, 'videos': videos}
+            return self._result(account, video_paths, videos, '前回の試行で結果を確認できなかった動画があります')
+
+        def on_shared(index, video_path):
+            if run_id:
+                self.checkpoints.record_shared(run_id, account, index)
+
+        def on_unconfirmed(index, video_path):
+            if run_id:
+                self.checkpoints.record_unconfirmed(run_id, account, index)
+
+        # seleniumを含むアップロード処理は、実際に投稿する時に初めて読み込む
+        from instagram_uploader import InstagramUploader
+
+        try:
+            progress(account, 'waiting_browser')
+            waiting_started = time.monotonic()
+            with self.browser_pool.lease(account) as driver:
+                BROWSER_WAIT_SECONDS.observe(time.monotonic() - waiting_started)
+                uploader = InstagramUploader(
+                    driver=driver, wait_policy=WaitPolicy(supervisor=self.browser_pool.supervisor),
+                    max_in_flight=self.videos_in_flight, profile=self.browser_pool.profile, history=self.history
+                )
+                upload_result = uploader.upload_to_instagram(
+                    video_paths, caption, account, account_info['password'],
+                    progress=lambda state, **details: progress(account, state, **details),
+                    completed=completed, on_shared=on_shared, slot=slot, run_id=run_id,
+                    unconfirmed=unconfirmed, on_unconfirmed=on_unconfirmed, sources=prepared
+                )
+        except Exception as e:
+            error_message = f"アカウント {account} でエラーが発生しました: {str(e)}"
+            logger.exception(error_message)
+            return {'status': 'failed', 'error': error_message}
+
+        if upload_result['success']:
+            logger.info("アカウント %s への3つの動画アップロードが成功しました", account)
+            return {'status': 'success', 'error': None, 'videos': upload_result['videos']}
+        return self._result(account, video_paths, upload_result['videos'], upload_result['error'])
+
+    def _result(self, account, video_paths, videos, error):
+        """シェアできなかった動画がある場合の結果を作る"""
+        shared_count = sum(1 for video in videos if video['status'] == 'shared')
+        unsettled = [video for video in videos if video['status'] not in ('shared', 'unconfirmed')]
+        status = 'failed' if unsettled else 'unconfirmed'
+        error_message = (f'アカウント {account} への投稿に{"失敗しました" if unsettled else "成功したか確認できませんでした"} '
+                         f'({shared_count}/{len(video_paths)}件シェア済み): {error}')
+        logger.error(error_message)
+        return {'status': status, 'error': error_message, 'videos': videos}
+
+    def _prepare_videos(self):
+        """
+        ブラウザを起動する前に動画を選んで検査・変換し、投稿できない動画は選び直す
+
+        :return: {'path': アップロードするファイル, 'source': 動画フォルダの元のファイル, 'source_hash': 元のファイルの内容ハッシュ}
+                 のリスト
+        """
+        ready = []
+        for _ in range(MAX_VIDEO_PICK_ATTEMPTS):
+            candidates = self.config_manager.get_random_videos(self.video_folder, VIDEOS_PER_ACCOUNT - len(ready))
+            if not candidates:
+                break
+            prepared, _ = self.preprocessor.prepare(candidates)
+            ready.extend(prepared)
+            if len(ready) >= VIDEOS_PER_ACCOUNT:
+                break
+        # 投稿履歴を動画カタログと突き合わせられるよう、変換前のファイルの内容ハッシュを添える
+        hashes = self.config_manager.video_catalog.content_hashes([video['source'] for video in ready])
+        return [dict(video, source_hash=hashes.get(video['source'])) for video in ready]
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from logger import setup_logger
+
+logger = setup_logger('video_catalog', 'logs/video_catalog.log')
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+# ディレクトリに変化が無くても、この間隔（秒）ごとにファイルのサイズと更新日時を確認する
+FULL_SCAN_INTERVAL = 600
+
+# 内容ハッシュに使う先頭・末尾のバイト数
+HASH_CHUNK_SIZE = 1024 * 1024
+# パスから内容ハッシュを調べる際に、1回のクエリで渡すパスの数
+_LOOKUP_CHUNK = 500
+
+
+def content_hash(path, size):
+    """ファイルの先頭と末尾、サイズから内容ハッシュを計算する（大きな動画全体は読まない）"""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(HASH_CHUNK_SIZE))
+        if size > HASH_CHUNK_SIZE * 2:
+            f.seek(-HASH_CHUNK_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_CHUNK_SIZE))
+    return digest.hexdigest()
+
+
+class VideoCatalog:
+    """動画フォルダの内容をSQLiteに索引し、使用履歴に基づいて動画を選ぶカタログ"""
+
+    def __init__(self, db_path='video_catalog.db'):
+        """
+        :param db_path: カタログを保存するSQLiteファイルのパス
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS videos (
+                path TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                present INTEGER NOT NULL DEFAULT 1,
+                last_used REAL NOT NULL DEFAULT 0,
+                use_count INTEGER NOT NULL DEFAULT 0,
+                shuffle_key REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_videos_pick
+                ON videos (folder, present, last_used, shuffle_key);
+            CREATE TABLE IF NOT EXISTS folders (
+                folder TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+        ''')
+        self._conn.commit()
+        # バックグラウンドで再スキャン中のフォルダ
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        logger.info(f"VideoCatalogが初期化されました: {db_path}")
+
+    def ensure_indexed(self, video_folder):
+        """
+        pickの前に呼び、選ぶ動画の索引を用意する
+
+        初めてのフォルダは同期してスキャンする。索引済みのフォルダは変更を検知した場合にバックグラウンドで再スキャンし、
+        完了を待たずに現在の索引から選べるようにする（フォルダの確認はstat 1回だけで済む）
+
+        :param video_folder: 動画フォルダのパス
+        """
+        folder = os.path.abspath(video_folder)
+        row = self._scan_state(folder)
+        if row is None:
+            self.refresh(video_folder, force=True)
+            return
+        if not self._needs_scan(folder, row):
+            return
+        with self._refreshing_lock:
+            if folder in self._refreshing:
+                return
+            self._refreshing.add(folder)
+        threading.Thread(target=self._refresh_in_background, args=(video_folder, folder),
+                         name='video-catalog-refresh', daemon=True).start()
+
+    def _refresh_in_background(self, video_folder, folder):
+        try:
+            self.refresh(video_folder)
+        except Exception as e:
+            logger.error(f"動画カタログの更新中にエラーが発生しました: {folder}: {str(e)}")
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(folder)
+
+    def _scan_state(self, folder):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT mtime_ns, scanned_at FROM folders WHERE folder = ?', (folder,)
+            ).fetchone()
+
+    def _needs_scan(self, folder, row):
+        return row is None or row[0] != os.stat(folder).st_mtime_ns or time.time() - row[1] >= FULL_SCAN_INTERVAL
+
+    def refresh(self, video_folder, force=False):
+        """
+        フォルダの変更を検知した場合のみ再スキャンし、追加・変更・削除されたファイルを反映する
+
+        :param video_folder: 動画フォルダのパス
+        :param force: Trueの場合は変更検知を省略して必ずスキャンする
+        """
+        folder = os.path.abspath(video_folder)
+        folder_mtime = os.stat(folder).st_mtime_ns
+        if not force and not self._needs_scan(folder, self._scan_state(folder)):
+            return
+
+        with self._lock:
+            known = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._conn.execute(
+                    'SELECT path, size, mtime_ns FROM videos WHERE folder = ? AND present = 1', (folder,)
+                )
+            }
+
+        changed = []
+        seen = set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                path = entry.path
+                seen.add(path)
+                if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    try:
+                        digest = content_hash(path, stat.st_size)
+                    except OSError as e:
+                        logger.warning(f"動画ファイルを読み込めませんでした: {path}: {str(e)}")
+                        continue
+                    changed.append((path, folder, stat.st_size, stat.st_mtime_ns, digest, random.random()))
+        removed = [(path,) for path in known if path not in seen]
+
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO videos (path, folder, size, mtime_ns, content_hash, shuffle_key)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    content_hash = excluded.content_hash,
+                    present = 1
+            ''', changed)
+            self._conn.executemany('UPDATE videos SET present = 0 WHERE path = ?', removed)
+            self._conn.execute('''
+                INSERT INTO folders (folder, mtime_ns, scanned_at) VALUES (?, ?, ?)
+                ON CONFLICT(folder) DO UPDATE SET mtime_ns = excluded.mtime_ns, scanned_at = excluded.scanned_at
+            ''', (folder, folder_mtime, time.time()))
+        if changed or removed:
+            logger.info(f"動画カタログを更新しました: {folder} (追加・変更 {len(changed)}件, 削除 {len(removed)}件)")
+
+    def pick(self, video_folder, count):
+        """
+        最も長く使われていない動画を指定された数だけ選び、使用済みとして記録する
+
+        選択と使用日時の更新を1つの書き込みトランザクション（BEGIN IMMEDIATE）で行うため、
+        他のプロセスから並行して呼ばれても同じ動画が重複して選ばれることはない
+
+        :param video_folder: 動画フォルダのパス
+        :param count: 選ぶ動画の数
+        :return: 動画ファイルの絶対パスのリスト
+        """
+        folder = os.path.abspath(video_folder)
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute('''
+                SELECT path FROM videos
+                WHERE folder = ? AND present = 1
+                ORDER BY last_used, shuffle_key
+                LIMIT ?
+            ''', (folder, count)).fetchall()
+            now = time.time()
+            self._conn.executemany('''
+                UPDATE videos SET last_used = ?, use_count = use_count + 1, shuffle_key = ?
+                WHERE path = ?
+            ''', [(now, random.random(), path) for path, in rows])
+        return [path for path, in rows]
+
+    def content_hashes(self, paths):
+        """
+        :param paths: 動画ファイルの絶対パスのリスト
+        :return: {パス: 内容ハッシュ}。カタログに無いパスは含まない
+        """
+        hashes = {}
+        with self._lock:
+            for start in range(0, len(paths), _LOOKUP_CHUNK):
+                chunk = paths[start:start + _LOOKUP_CHUNK]
+                hashes.update(self._conn.execute(f'''
+                    SELECT path, content_hash FROM videos WHERE path IN ({','.join('?' * len(chunk))})
+                ''', chunk))
+        return hashes
+
+    def videos(self, video_folder):
+        """
+        :return: フォルダ内の動画の {'path', 'content_hash'} のリスト
+        """
+        folder = os.path.abspath(video_folder)
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT path, content_hash FROM videos WHERE folder = ? AND present = 1 ORDER BY path
+            ''', (folder,)).fetchall()
+        return [{'path': path, 'content_hash': digest} for path, digest in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
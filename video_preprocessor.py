@@ -0,0 +1,212 @@
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from logger import setup_logger
+from video_catalog import content_hash
+
+logger = setup_logger('video_preprocessor', 'logs/video_preprocessor.log')
+
+# リール動画として受け付ける条件（既定値。max_durationはVideoPreprocessorの引数で変更できる）
+# max_durationの90秒は、Instagramが長い動画をリールとして扱わない場合がある上限に合わせている
+REEL_LIMITS = {
+    'min_duration': 3,
+    'max_duration': 90,
+    'max_size': 4 * 1024 ** 3,
+}
+
+# アップロード用に変換する際の出力形式
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+TARGET_VIDEO_CODEC = 'h264'
+TARGET_AUDIO_CODECS = ('aac',)
+MAX_BITRATE = 6_000_000
+ASPECT_TOLERANCE = 0.01
+
+
+def probe_video(path):
+    """
+    ffprobeで動画の情報を取得する
+
+    :param path: 動画ファイルのパス
+    :return: duration, width, height, video_codec, audio_codec, bit_rate, size を持つ辞書
+    """
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        capture_output=True, check=True, text=True
+    ).stdout
+    data = json.loads(output)
+    video = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
+    audio = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
+    if video is None:
+        raise ValueError('映像ストリームがありません')
+
+    width, height = int(video['width']), int(video['height'])
+    rotation = int(video.get('tags', {}).get('rotate', 0))
+    for side_data in video.get('side_data_list', []):
+        rotation = int(side_data.get('rotation', rotation))
+    if abs(rotation) in (90, 270):
+        width, height = height, width
+
+    return {
+        'duration': float(data['format'].get('duration', 0)),
+        'width': width,
+        'height': height,
+        'video_codec': video.get('codec_name'),
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'bit_rate': int(data['format'].get('bit_rate', 0)),
+        'size': int(data['format'].get('size', os.path.getsize(path))),
+    }
+
+
+def validate_video(info, limits=REEL_LIMITS):
+    """
+    リールとして投稿できない動画の問題点を返す（変換で解決できない問題のみ）
+
+    :param info: probe_videoの戻り値
+    :param limits: 受け付ける条件。省略時はREEL_LIMITS
+    :return: 問題点のリスト。空の場合は投稿可能
+    """
+    problems = []
+    if info['duration'] < limits['min_duration']:
+        problems.append(f"動画が短すぎます ({info['duration']:.1f}秒)")
+    if info['duration'] > limits['max_duration']:
+        problems.append(f"動画が長すぎます ({info['duration']:.1f}秒)")
+    return problems
+
+
+def needs_transcode(info):
+    """アップロード前に9:16への変換や再エンコードが必要かどうか"""
+    aspect = info['width'] / info['height']
+    return (
+        abs(aspect - TARGET_WIDTH / TARGET_HEIGHT) > ASPECT_TOLERANCE
+        or info['width'] > TARGET_WIDTH
+        or info['video_codec'] != TARGET_VIDEO_CODEC
+        or (info['audio_codec'] is not None and info['audio_codec'] not in TARGET_AUDIO_CODECS)
+        or info['bit_rate'] > MAX_BITRATE
+        or info['size'] > REEL_LIMITS['max_size']
+    )
+
+
+def transcode_video(source, destination):
+    """動画を中央で9:16に切り抜き、1080x1920・ビットレート上限付きのH.264/AACに変換する"""
+    video_filter = (
+        f"crop='min(iw,ih*{TARGET_WIDTH}/{TARGET_HEIGHT})':'min(ih,iw*{TARGET_HEIGHT}/{TARGET_WIDTH})',"
+        f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:force_original_aspect_ratio=decrease,"
+        f"pad={TARGET_WIDTH}:{TARGET_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+    )
+    temporary = destination + '.part.mp4'
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error', '-i', source,
+        '-vf', video_filter,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+        '-maxrate', str(MAX_BITRATE // 2), '-bufsize', str(MAX_BITRATE),
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart',
+        temporary
+    ], check=True, capture_output=True)
+    os.replace(temporary, destination)
+
+
+def prepare_video(path, output_dir, limits=REEL_LIMITS):
+    """
+    1つの動画を検査し、必要であればアップロード用に変換する（プロセスプールから呼ばれる）
+
+    結果は内容ハッシュをキーにoutput_dirへキャッシュし、同じ動画を同じ条件で再度処理しない
+
+    :param path: 元の動画ファイルのパス
+    :param output_dir: 変換結果と検査結果を保存するディレクトリ
+    :param limits: 受け付ける条件。省略時はREEL_LIMITS
+    :return: {'source', 'path', 'problems', 'transcoded'} の辞書。問題がある場合pathはNone
+    """
+    digest = content_hash(path, os.path.getsize(path))
+    result_file = os.path.join(output_dir, f"{digest}.json")
+    if os.path.exists(result_file):
+        with open(result_file) as f:
+            result = json.load(f)
+        # 受け付ける条件が変わった場合は検査し直す
+        if result.get('limits') == limits and (result['path'] is None or os.path.exists(result['path'])):
+            return dict(result, source=path)
+
+    try:
+        info = probe_video(path)
+        problems = validate_video(info, limits)
+    except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+        info = None
+        problems = [f"動画を解析できませんでした: {str(e)}"]
+
+    result = {'source': path, 'path': None, 'problems': problems, 'transcoded': False, 'limits': limits}
+    if not problems:
+        if needs_transcode(info):
+            destination = os.path.join(output_dir, f"{digest}.mp4")
+            try:
+                transcode_video(path, destination)
+                result.update(path=os.path.abspath(destination), transcoded=True)
+            except subprocess.CalledProcessError as e:
+                result['problems'] = [f"動画の変換に失敗しました: {e.stderr.decode(errors='replace').strip()}"]
+        else:
+            result['path'] = os.path.abspath(path)
+
+    with open(result_file, 'w') as f:
+        json.dump(result, f, ensure_ascii=False)
+    return result
+
+
+class VideoPreprocessor:
+    """ブラウザを起動する前に、動画の検査と9:16への変換をプロセスプールで並列に行う"""
+
+    def __init__(self, output_dir='processed_videos', max_workers=None, max_duration=None):
+        """
+        :param output_dir: 変換済み動画と検査結果のキャッシュを保存するディレクトリ
+        :param max_workers: 並列に処理する動画の数。省略時はCPU数
+        :param max_duration: 受け付ける動画の長さの上限（秒）。省略時はREEL_LIMITSの値
+        """
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.limits = dict(REEL_LIMITS)
+        if max_duration is not None:
+            self.limits['max_duration'] = max_duration
+        self.enabled = shutil.which('ffprobe') is not None and shutil.which('ffmpeg') is not None
+        self._executor = None
+        if self.enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            logger.info(f"VideoPreprocessorが初期化されました: output_dir={output_dir}")
+        else:
+            logger.warning("ffprobe/ffmpegが見つからないため、動画の事前処理を行いません")
+
+    def prepare(self, video_paths):
+        """
+        動画を並列に検査・変換する
+
+        :param video_paths: 動画ファイルのパスのリスト
+        :return: (投稿できる動画の {'source': 元のパス, 'path': アップロード用のパス} のリスト, 投稿できない動画の問題点の辞書)
+        """
+        if not self.enabled:
+            return [{'source': path, 'path': path} for path in video_paths], {}
+        if self._executor is None:
+            # スレッドが動いているプロセスからforkすると、ロックを保持したままの状態が子プロセスに複製されるためspawnで起動する
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+        futures = [self._executor.submit(prepare_video, path, self.output_dir, self.limits) for path in video_paths]
+        ready = []
+        rejected = {}
+        for path, future in zip(video_paths, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'path': None, 'problems': [f"動画の事前処理中にエラーが発生しました: {str(e)}"], 'transcoded': False}
+            if result['path']:
+                ready.append({'source': path, 'path': result['path']})
+                if result['transcoded']:
+                    logger.info(f"アップロード用に変換しました: {path} -> {result['path']}")
+            else:
+                rejected[path] = result['problems']
+                logger.warning(f"投稿できない動画を除外しました: {path}: {'; '.join(result['problems'])}")
+        return ready, rejected
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,71 @@
+import random
+import time
+import metrics
+from logger import log_context, setup_logger
+
+logger = setup_logger('wait_policy', 'logs/wait_policy.log')
+
+UPLOAD_STEP_SECONDS = metrics.histogram('upload_step_seconds', 'アップロードの各ステップの所要時間（秒）')
+UPLOAD_STEP_TIMEOUTS = metrics.counter('upload_step_timeouts_total', 'アップロードの各ステップでのタイムアウト回数')
+
+# 各ステップの最低所要時間（秒）。数値か (最小, 最大) のタプルで指定し、タプルの場合はその範囲でランダムに決める
+# ステップ名: session_check, login_form, login_result, later, new_post, post_menu, file_input, upload_next, crop, vertical_crop,
+#             next, next_transition, caption, share, share_confirm, between_videos
+DEFAULT_STEP_FLOORS = {
+    'between_videos': 10,
+}
+
+
+class WaitPolicy:
+    """UI操作の各ステップで、要素の準備完了を待ってから進むための待機ポリシー"""
+
+    def __init__(self, timeout=10, floors=None, supervisor=None):
+        """
+        :param timeout: 条件を待つ既定のタイムアウト（秒）
+        :param floors: ステップ名ごとの最低所要時間。DEFAULT_STEP_FLOORSを上書きする
+        :param supervisor: ステップの開始を通知するBrowserSupervisor。ステップの期限の監視に使う
+        """
+        self.timeout = timeout
+        self.supervisor = supervisor
+        self.floors = dict(DEFAULT_STEP_FLOORS)
+        if floors:
+            self.floors.update(floors)
+
+    def until(self, driver, step, condition, timeout=None):
+        """
+        条件が満たされるまで待機し、そのステップの最低所要時間に満たない場合は残りを待つ
+
+        :param driver: ChromeDriver
+        :param step: ステップ名
+        :param condition: WebDriverWaitに渡す条件
+        :param timeout: タイムアウト（秒）。省略時は既定値
+        :return: 条件の戻り値（通常は要素）
+        """
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        started = time.monotonic()
+        if self.supervisor is not None:
+            self.supervisor.mark(driver, step)
+        with log_context(step=step):
+            try:
+                result = WebDriverWait(driver, timeout if timeout is not None else self.timeout).until(condition)
+            except TimeoutException:
+                UPLOAD_STEP_TIMEOUTS.inc(step=step)
+                raise
+            self._sleep_remaining(step, started)
+        UPLOAD_STEP_SECONDS.observe(time.monotonic() - started, step=step)
+        return result
+
+    def pace(self, step):
+        """条件を伴わないステップで、最低所要時間だけ待機する"""
+        self._sleep_remaining(step, time.monotonic())
+
+    def _sleep_remaining(self, step, started):
+        floor = self.floors.get(step, 0)
+        if isinstance(floor, (tuple, list)):
+            floor = random.uniform(*floor)
+        remaining = floor - (time.monotonic() - started)
+        if remaining > 0:
+            logger.debug("ステップ %s の最低所要時間に合わせて%.2f秒間待機します", step, remaining)
+            time.sleep(remaining)